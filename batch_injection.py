@@ -0,0 +1,20 @@
+from playback_plan import OP_BUTTON_DOWN, OP_BUTTON_UP, OP_MOVE, OP_CLICK, OP_DOUBLE_CLICK
+
+# Steps whose deadlines fall within this many seconds of the first step of a
+# batch are injected together at the batch's last deadline
+BATCH_TICK = 0.001
+
+# Opcodes that position the cursor themselves, making a move right before them redundant
+POSITIONING_OPS = (OP_MOVE, OP_CLICK, OP_DOUBLE_CLICK, OP_BUTTON_DOWN, OP_BUTTON_UP)
+
+
+def add_step(batch, step):
+    """Append a step whose first three fields are (offset, opcode, args) to `batch`.
+
+    A move followed by another move, a click or a button press or release is
+    replaced, since only the final cursor position is observable.
+    """
+    if batch and batch[-1][1] == OP_MOVE and step[1] in POSITIONING_OPS:
+        batch[-1] = step
+    else:
+        batch.append(step)
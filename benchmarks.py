@@ -0,0 +1,348 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from capture_clock import CaptureClock
+from event_store import KEYBOARD, MOUSE
+from input_backend import SimulatedInputBackend, KeyboardEvent, MoveEvent
+from macro_format import COMPRESSIONS, load_events, save_events, macro_path
+from macro_recorder import MacroRecorder
+from playback_plan import PlaybackPlan
+from playback_jobs import JobScheduler
+from playback_telemetry import LatencyHistogram, PlaybackTelemetry
+from recording_journal import RecordingJournal
+from recording_pipeline import RecordingPipeline
+from ring_buffer import RingBuffer
+
+MEMORY_SIZES = (10000, 100000, 1000000, 10000000)
+QUICK_MEMORY_SIZES = (10000, 100000)
+PLAYBACK_SPEEDS = (0.5, 1.0, 2.0, 5.0, 10.0, 20.0)
+CONCURRENT_JOBS = (1, 8, 32)
+
+# Metrics where a larger value is a regression, with the absolute change below
+# which a difference is treated as noise; everything else numeric is informational
+LOWER_IS_BETTER = (('_ns', 50.0), ('_ms', 0.5), ('_seconds', 0.01), ('_bytes', 4096), ('bytes_per_event', 1.0))
+HIGHER_IS_BETTER = ('_per_second',)
+
+
+def log(message):
+    print(message, file=sys.stderr)
+
+
+def synthetic_events(event_count, mouse_rate=1000.0, keyboard_rate=5.0, seed=0):
+    """Hook events from the simulated backend, as (received ns, source, event) ring items.
+
+    Each event is received exactly when it was captured; see new_recorder().
+    """
+    backend = SimulatedInputBackend()
+    duration = event_count / (mouse_rate + 2 * keyboard_rate + 2.5)
+    items = []
+    for event in backend.synthetic_events(duration * 1.1 + 1.0, mouse_rate, keyboard_rate, seed=seed):
+        if len(items) >= event_count:
+            break
+        items.append((round(event.time * 1e9), KEYBOARD if isinstance(event, KeyboardEvent) else MOUSE, event))
+    return items
+
+
+class MemoryJournal:
+    """Stands in for a RecordingJournal when the whole recording should stay in recorder.events."""
+
+    def collect(self, events):
+        pass
+
+
+def record(items, event_count=None, journal=False):
+    """Feed ring items through MacroRecorder.process_event and return the recorder.
+
+    With `event_count` the items are cycled, with increasing receive times, until
+    that many hook events were processed; the repeats are timed by their callback. With `journal` full blocks go to
+    an on-disk journal as in a real recording, which the caller discards.
+    """
+    recorder = new_recorder(journal)
+    process_event = recorder.process_event
+    if event_count is None:
+        for item in items:
+            process_event(item)
+    else:
+        period = items[-1][0]
+        for i in range(event_count):
+            cycle, index = divmod(i, len(items))
+            timestamp, source, event = items[index]
+            process_event((timestamp + cycle * period, source, event))
+    return recorder
+
+
+def synthetic_buffer(event_count, mouse_rate=1000.0, keyboard_rate=5.0, seed=0):
+    """An EventBuffer recorded from the simulated backend's synthetic input."""
+    return record(synthetic_events(event_count, mouse_rate, keyboard_rate, seed)).events
+
+
+def new_recorder(journal=False):
+    recorder = MacroRecorder(SimulatedInputBackend())
+    recorder.recording = True
+    recorder.journal = RecordingJournal(recorder.macro_dir) if journal else MemoryJournal()
+    # Synthetic event times count from 0 on the same clock as the ring items
+    recorder.capture_clock = CaptureClock(start=0, wall_offset=0, use_event_time=True)
+    recorder.buffer = recorder.events
+    recorder.pipeline = RecordingPipeline(recorder.config, recorder.buffer, recorder.backend)
+    return recorder
+
+
+def bench_callbacks(event_count=200000, repeat=3):
+    """Cost of the hook callbacks and of the consumer storing and journaling what they queued (best of `repeat`)."""
+    moves = [MoveEvent(i % 1920, i % 1080, i * 0.001) for i in range(event_count)]
+    keys = [KeyboardEvent('down', 30, 'a', i * 0.001) for i in range(event_count)]
+    # Rings large enough to hold the whole run, so nothing is dropped or consumed mid-measurement
+    capacity = 1 << max(event_count - 1, 1).bit_length()
+
+    result = {'events': event_count}
+    for _ in range(repeat):
+        recorder = new_recorder(journal=True)
+        recorder.capture_clock = CaptureClock()
+        recorder.keyboard_ring = RingBuffer(capacity)
+        recorder.mouse_ring = RingBuffer(capacity)
+
+        timings = {}
+        for name, callback, events in (('mouse', recorder.on_mouse_event, moves),
+                                       ('keyboard', recorder.on_keyboard_event, keys)):
+            started = time.perf_counter_ns()
+            for event in events:
+                callback(event)
+            timings[f'{name}_callback_ns'] = (time.perf_counter_ns() - started) / event_count
+
+        items = recorder.mouse_ring.pop_batch(event_count) + recorder.keyboard_ring.pop_batch(event_count)
+        started = time.perf_counter_ns()
+        for item in items:
+            recorder.process_event(item)
+        timings['process_event_ns'] = (time.perf_counter_ns() - started) / len(items)
+        recorder.journal.discard()
+
+        for name, value in timings.items():
+            result[name] = min(value, result.get(name, value))
+    return result
+
+
+def bench_memory(sizes=MEMORY_SIZES, pool_size=65536):
+    """Peak traced memory while recording `size` hook events, per size.
+
+    The hook events come from a pre-generated pool so that only the
+    recorder's own allocations are traced. Recording goes through the
+    on-disk journal, so the peak should stay flat as `size` grows.
+    """
+    pool = synthetic_events(min(pool_size, max(sizes)))
+    results = {}
+    for size in sizes:
+        log(f"memory: {size} events")
+        tracemalloc.start()
+        recorder = record(pool, size, journal=True)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        events = recorder.journal.event_count(recorder.events)
+        results[str(size)] = {
+            'hook_events': size,
+            'events': events,
+            'peak_bytes': peak,
+            'retained_bytes': current,
+            'bytes_per_event': peak / events,
+        }
+        recorder.journal.discard()
+    return results
+
+
+def bench_storage(event_count=200000, directory=None):
+    """Save/load throughput and file size for every format and compression."""
+    buffer = synthetic_buffer(event_count)
+    targets = [('mrec', compression) for compression in COMPRESSIONS] + [('json', None)]
+    results = {}
+    with tempfile.TemporaryDirectory(dir=directory) as macro_dir:
+        for file_format, compression in targets:
+            label = file_format if compression is None else f"{file_format}-{compression}"
+            log(f"storage: {label}")
+            path = macro_path(macro_dir, 'bench', file_format)
+
+            started = time.perf_counter()
+            save_events(path, buffer, compression or 'zlib')
+            save_seconds = time.perf_counter() - started
+            started = time.perf_counter()
+            loaded = load_events(path)
+            load_seconds = time.perf_counter() - started
+
+            size = os.path.getsize(path)
+            results[label] = {
+                'events': len(loaded),
+                'file_bytes': size,
+                'bytes_per_event': size / len(loaded),
+                'save_seconds': save_seconds,
+                'load_seconds': load_seconds,
+                'save_events_per_second': len(loaded) / save_seconds,
+                'load_events_per_second': len(loaded) / load_seconds,
+            }
+            os.remove(path)
+    return results
+
+
+def bench_playback(speeds=PLAYBACK_SPEEDS, seconds=2.0, mouse_rate=500.0):
+    """p50/p99 lateness of injected events against their deadlines, per playback speed.
+
+    Each run plays `seconds` of wall time into the simulated backend as one
+    job on a JobScheduler, like real playback, so the numbers measure the
+    scheduler and dispatch overhead rather than the OS.
+    """
+    results = {}
+    for speed in speeds:
+        log(f"playback: speed {speed}")
+        backend = SimulatedInputBackend()
+        events = synthetic_buffer(int(seconds * speed * mouse_rate), mouse_rate)
+        plan = PlaybackPlan.compile(events, speed)
+
+        scheduler = JobScheduler(backend)
+        job = scheduler.play(plan, telemetry=PlaybackTelemetry())
+        job.wait()
+        scheduler.shutdown()
+        report = job.report()
+        lateness = job.telemetry.summary()['lateness']
+
+        results[str(speed)] = {
+            'events': len(plan),
+            'injected': job.injected,
+            'batches': scheduler.batches,
+            'p50_lateness_ms': lateness['p50_ms'],
+            'p99_lateness_ms': lateness['p99_ms'],
+            'max_lateness_ms': lateness['max_ms'],
+            'final_drift_ms': report['final_drift'] * 1000,
+        }
+    return results
+
+
+def bench_concurrent(job_counts=CONCURRENT_JOBS, seconds=1.0, mouse_rate=200.0, keyboard_rate=50.0):
+    """Lateness when many macros play at once, merged on the JobScheduler's single injection thread."""
+    results = {}
+    events = synthetic_buffer(int(seconds * (mouse_rate + keyboard_rate)), mouse_rate, keyboard_rate)
+    plan = PlaybackPlan.compile(events)
+    for job_count in job_counts:
+        log(f"concurrent: {job_count} jobs")
+        scheduler = JobScheduler(SimulatedInputBackend())
+        jobs = [scheduler.play(plan, telemetry=PlaybackTelemetry()) for _ in range(job_count)]
+        for job in jobs:
+            job.wait()
+        scheduler.shutdown()
+
+        lateness = LatencyHistogram()
+        for job in jobs:
+            for histogram in job.telemetry.lateness:
+                lateness.add(histogram)
+        summary = lateness.summary()
+        results[str(job_count)] = {
+            'steps': len(plan) * job_count,
+            'injected': sum(job.injected for job in jobs),
+            'p50_lateness_ms': summary['p50_ms'],
+            'p99_lateness_ms': summary['p99_ms'],
+            'max_lateness_ms': summary['max_ms'],
+        }
+    return results
+
+
+def run_benchmarks(quick=False, callback_events=200000, storage_events=200000, memory_sizes=None,
+                   speeds=PLAYBACK_SPEEDS, playback_seconds=2.0):
+    if memory_sizes is None:
+        memory_sizes = QUICK_MEMORY_SIZES if quick else MEMORY_SIZES
+    if quick:
+        callback_events = min(callback_events, 20000)
+        storage_events = min(storage_events, 20000)
+        playback_seconds = min(playback_seconds, 0.5)
+
+    # MacroRecorder creates its macros directory in the working directory
+    with tempfile.TemporaryDirectory() as workdir:
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            log("callbacks")
+            callbacks = bench_callbacks(callback_events)
+            memory = bench_memory(memory_sizes)
+            storage = bench_storage(storage_events)
+            playback = bench_playback(speeds, playback_seconds)
+            concurrent = bench_concurrent(seconds=playback_seconds)
+        finally:
+            os.chdir(cwd)
+
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'quick': quick,
+        },
+        'callbacks': callbacks,
+        'memory': memory,
+        'storage': storage,
+        'playback': playback,
+        'concurrent': concurrent,
+    }
+
+
+def flatten(results, prefix=''):
+    """Flatten nested result dicts into {'section.key.metric': value} for numeric values."""
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, path + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare(results, baseline, tolerance=0.2):
+    """List metrics that got worse than the baseline by more than `tolerance` (a fraction)."""
+    current = flatten(results)
+    regressions = []
+    for path, old in flatten(baseline).items():
+        if path.startswith('meta.') or path not in current or not old:
+            continue
+        new = current[path]
+        change = (new - old) / abs(old)
+        if path.endswith(HIGHER_IS_BETTER):
+            change = -change
+        else:
+            floor = next((floor for suffix, floor in LOWER_IS_BETTER if path.endswith(suffix)), None)
+            if floor is None or new - old < floor:
+                continue
+        if change > tolerance:
+            regressions.append({'metric': path, 'baseline': old, 'current': new, 'change': change})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark recording, storage and playback without input hardware")
+    parser.add_argument('--output', '-o', help="Write the JSON results to this file instead of stdout")
+    parser.add_argument('--quick', action='store_true', help="Small sizes for a fast smoke run")
+    parser.add_argument('--memory-sizes', type=int, nargs='+', help="Recording sizes for the memory benchmark")
+    parser.add_argument('--speeds', type=float, nargs='+', default=PLAYBACK_SPEEDS)
+    parser.add_argument('--baseline', help="Earlier results to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Relative slowdown reported as a regression (default: 0.2)")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.quick, memory_sizes=args.memory_sizes, speeds=args.speeds)
+    if args.baseline:
+        with open(args.baseline) as f:
+            results['regressions'] = compare(results, json.load(f), args.tolerance)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+    return 1 if results.get('regressions') else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
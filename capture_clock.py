@@ -0,0 +1,119 @@
+import time
+
+from playback_telemetry import LatencyHistogram
+
+# Event timestamps further than this before the callback (or after it) are not
+# trusted, e.g. after the wall clock was stepped; the callback's time is used instead.
+# Hook-to-callback delays are normally well under a millisecond, so only small
+# clock corrections can slip through, and only until the next re-measurement
+MAX_CAPTURE_DELAY_NS = 5_000_000
+
+# Event timestamps are only used when the wall clock they come from is at least this fine-grained.
+# On Windows before Python 3.13 time.time() ticks every ~15.6 ms, so there every
+# event is timed by its callback; summary() reports this as `coarse_clock`
+MAX_WALL_RESOLUTION = 0.001
+
+# How often the offset between the wall clock and clock() is measured again, so
+# drift and clock corrections don't pile up over a long recording
+WALL_OFFSET_INTERVAL_NS = 1_000_000_000
+
+
+class CaptureClock:
+    """Timestamps of a recording, in integer nanoseconds on one monotonic timeline.
+
+    The `keyboard` and `mouse` libraries stamp every event with the wall
+    clock when the OS hook fires, before it is queued for our callback. The
+    hook callbacks take `clock()` as they receive an event; timestamp() maps
+    the event's own time onto that clock with the offset between the two
+    clocks, measured at the start and again every WALL_OFFSET_INTERVAL_NS,
+    which leaves out the delay between capture and callback. Events without
+    a usable time (no `time` field, a coarse wall clock, or a
+    capture-to-callback delay outside [0, MAX_CAPTURE_DELAY_NS]) are timed
+    by their callback instead. Timestamps never go backwards.
+
+    A `wall_offset` passed in is used as is and never measured again.
+    """
+
+    def __init__(self, clock=time.perf_counter_ns, start=None, wall_offset=None, use_event_time=None,
+                 wall_clock=time.time_ns):
+        self.clock = clock
+        self.wall_clock = wall_clock
+        self.start = clock() if start is None else start
+        self.measures = 0
+        if wall_offset is None:
+            self.measure_offset()
+        else:
+            self.wall_offset = wall_offset  # Wall clock time minus clock() time, in ns
+            self.next_measure = None
+        self.coarse_clock = time.get_clock_info('time').resolution > MAX_WALL_RESOLUTION
+        if use_event_time is None:
+            use_event_time = not self.coarse_clock
+        self.use_event_time = use_event_time
+        self.delay = LatencyHistogram()
+        self.fallbacks = 0
+        self.untrusted = 0
+        self.last = 0
+
+    def measure_offset(self):
+        """Measure the wall clock minus clock() offset, against the middle of two clock() reads."""
+        before = self.clock()
+        wall = self.wall_clock()
+        after = self.clock()
+        self.wall_offset = wall - (before + after) // 2
+        self.next_measure = after + WALL_OFFSET_INTERVAL_NS
+        self.measures += 1
+
+    def timestamp(self, event, received):
+        """Nanoseconds from the start of the recording to the capture of `event`.
+
+        `received` is the clock() value taken when the callback got the event.
+        """
+        event_time = getattr(event, 'time', None) if self.use_event_time else None
+        if event_time is not None:
+            if self.next_measure is not None and received >= self.next_measure:
+                self.measure_offset()
+            captured = round(event_time * 1e9) - self.wall_offset
+            delay = received - captured
+            if 0 <= delay <= MAX_CAPTURE_DELAY_NS:
+                self.delay.record(delay)
+            else:
+                captured = received
+                self.fallbacks += 1
+                self.untrusted += 1
+        else:
+            captured = received
+            self.fallbacks += 1
+        timestamp = captured - self.start
+        if timestamp < self.last:
+            return self.last
+        self.last = timestamp
+        return timestamp
+
+    def summary(self):
+        """Capture-to-callback delay of the events timed by their own timestamp, plus how many were not.
+
+        `fallbacks` counts every event timed by its callback; `untrusted` the
+        ones among them whose own time was out of range. With `coarse_clock`
+        the wall clock was too coarse to use event times at all.
+        """
+        summary = self.delay.summary()
+        summary['fallbacks'] = self.fallbacks
+        summary['untrusted'] = self.untrusted
+        summary['coarse_clock'] = self.coarse_clock and not self.use_event_time
+        summary['offset_measures'] = self.measures
+        return summary
+
+
+def format_capture_delay(summary):
+    fallbacks = f"{summary['fallbacks']} events timed by the callback"
+    if summary['untrusted']:
+        fallbacks += f", {summary['untrusted']} of them out of range"
+    if summary['coarse_clock']:
+        return f"capture delay unknown, wall clock too coarse ({fallbacks})"
+    if not summary['count']:
+        return f"capture delay unknown ({fallbacks})"
+    text = (f"capture delay p50 {summary['p50_ms']:.2f} ms / p99 {summary['p99_ms']:.2f} ms / "
+            f"max {summary['max_ms']:.2f} ms")
+    if summary['fallbacks']:
+        text += f", {fallbacks}"
+    return text
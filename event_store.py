@@ -0,0 +1,221 @@
+from array import array
+
+KEYBOARD = 0
+MOUSE = 1
+SYNC = 2
+EVENT_TYPES = ('keyboard', 'mouse', 'sync')
+TYPE_CODES = {name: code for code, name in enumerate(EVENT_TYPES)}
+
+# Event dict field holding the name and the delta of each type of event; a sync
+# event stores its condition as the name and its timeout in seconds as the delta
+NAME_FIELDS = ('key', 'button', 'condition')
+DELTA_FIELDS = ('delta', 'delta', 'timeout')
+
+# Per-event flags telling which optional fields are set
+HAS_NAME = 1
+HAS_POSITION = 2
+HAS_DELTA = 4
+
+NO_ID = -1
+
+# Column attributes of an EventBuffer, in a fixed order
+COLUMNS = ('types', 'kinds', 'flags', 'ids', 'xs', 'ys', 'deltas', 'times')
+
+
+class StringTable:
+    """Interns strings so each event only stores a small integer id."""
+
+    def __init__(self, strings=()):
+        self.strings = []
+        self.ids = {}
+        for string in strings:
+            self.intern(string)
+
+    def intern(self, string):
+        string_id = self.ids.get(string)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.strings.append(string)
+            self.ids[string] = string_id
+        return string_id
+
+    def __getitem__(self, string_id):
+        return self.strings[string_id]
+
+    def __len__(self):
+        return len(self.strings)
+
+
+class EventBuffer:
+    """Struct-of-arrays event store with a list-like API.
+
+    Every event lives in typed columns instead of its own dict, so a recording
+    costs ~30 bytes per event. Times are stored as integer nanoseconds from
+    the start of the recording. Indexing and iteration still produce the
+    dicts the rest of the code expects, with the time in seconds.
+    """
+
+    # Kind and name tables are seeded with the common values so they get stable ids
+    KINDS = ('press', 'move', 'click', 'double click', 'scroll', 'up', 'down', 'double')
+
+    def __init__(self, events=()):
+        self.kind_table = StringTable(self.KINDS)
+        self.name_table = StringTable()
+        self.clear()
+        self.extend(events)
+
+    def empty_like(self):
+        """Return an empty buffer sharing this buffer's kind and name tables."""
+        buffer = EventBuffer()
+        buffer.kind_table = self.kind_table
+        buffer.name_table = self.name_table
+        return buffer
+
+    def clear(self):
+        self.types = array('B')
+        self.kinds = array('B')
+        self.flags = array('B')
+        self.ids = array('i')
+        self.xs = array('i')
+        self.ys = array('i')
+        self.deltas = array('d')
+        self.times = array('q')
+
+    def detach(self):
+        """Move all events into a new buffer sharing this buffer's tables and leave this one empty.
+
+        Only the column arrays change hands, so this is O(1) however many
+        events there are.
+        """
+        buffer = self.empty_like()
+        for column in COLUMNS:
+            setattr(buffer, column, getattr(self, column))
+        self.clear()
+        return buffer
+
+    def _append(self, type_code, kind, name, x, y, delta, time_ns, flags):
+        self.types.append(type_code)
+        self.kinds.append(self.kind_table.intern(kind))
+        self.flags.append(flags)
+        self.ids.append(NO_ID if name is None else self.name_table.intern(name))
+        self.xs.append(x)
+        self.ys.append(y)
+        self.deltas.append(delta)
+        self.times.append(time_ns)
+
+    # Fast paths used by the recording callbacks; they never build a dict and take the time in ns
+    def add_keyboard(self, kind, key, time_ns):
+        self._append(KEYBOARD, kind, key, 0, 0, 0.0, time_ns, HAS_NAME if key is not None else 0)
+
+    def add_mouse(self, kind, button, x, y, time_ns):
+        flags = HAS_POSITION | (HAS_NAME if button is not None else 0)
+        self._append(MOUSE, kind, button, int(x), int(y), 0.0, time_ns, flags)
+
+    def add_move(self, x, y, time_ns):
+        self._append(MOUSE, 'move', None, int(x), int(y), 0.0, time_ns, HAS_POSITION)
+
+    def add_scroll(self, delta, time_ns):
+        self._append(MOUSE, 'scroll', None, 0, 0, float(delta), time_ns, HAS_DELTA)
+
+    def append(self, event):
+        type_code = TYPE_CODES[event['type']]
+        name = event.get(NAME_FIELDS[type_code])
+        position = event.get('position')
+        delta = event.get(DELTA_FIELDS[type_code])
+        flags = 0
+        if name is not None:
+            flags |= HAS_NAME
+        if position is not None:
+            flags |= HAS_POSITION
+            x, y = int(position[0]), int(position[1])
+        else:
+            x = y = 0
+        if delta is not None:
+            flags |= HAS_DELTA
+        self._append(type_code, event['event'], name, x, y,
+                     float(delta or 0.0), round(event['time'] * 1e9), flags)
+
+    def extend(self, events):
+        for event in events:
+            self.append(event)
+
+    def extend_slice(self, buffer, start, end):
+        """Append events [start, end) of `buffer`, which must share this buffer's tables."""
+        for column in COLUMNS:
+            getattr(self, column).extend(getattr(buffer, column)[start:end])
+
+    def event(self, index):
+        type_code = self.types[index]
+        flags = self.flags[index]
+        event = {'type': EVENT_TYPES[type_code], 'event': self.kind_table[self.kinds[index]]}
+        if flags & HAS_NAME:
+            event[NAME_FIELDS[type_code]] = self.name_table[self.ids[index]]
+        if flags & HAS_POSITION:
+            event['position'] = (self.xs[index], self.ys[index])
+        if flags & HAS_DELTA:
+            event[DELTA_FIELDS[type_code]] = self.deltas[index]
+        event['time'] = self.times[index] / 1e9
+        return event
+
+    def __len__(self):
+        return len(self.times)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.event(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("event index out of range")
+        return self.event(index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.event(index)
+
+    def to_list(self):
+        return list(self)
+
+    def duration(self):
+        """Time of the last event in seconds."""
+        return max(self.times, default=0) / 1e9
+
+    def nbytes(self):
+        """Approximate memory used by the columns and string tables."""
+        columns = [getattr(self, name) for name in COLUMNS]
+        size = sum(column.buffer_info()[1] * column.itemsize for column in columns)
+        size += sum(len(s) + 49 for s in self.name_table.strings)
+        return size
+
+
+def memory_comparison(event_count=100000):
+    """Measure the memory of `event_count` mouse moves as dicts vs. an EventBuffer."""
+    import tracemalloc
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    events = []
+    for i in range(event_count):
+        events.append({'type': 'mouse', 'event': 'move', 'position': (i % 1920, i % 1080), 'time': i * 0.001})
+    dict_bytes = tracemalloc.get_traced_memory()[0] - baseline
+    del events
+
+    baseline = tracemalloc.get_traced_memory()[0]
+    buffer = EventBuffer()
+    for i in range(event_count):
+        buffer.add_move(i % 1920, i % 1080, i * 1000000)
+    buffer_bytes = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+
+    return {
+        'events': event_count,
+        'dict_bytes': dict_bytes,
+        'buffer_bytes': buffer_bytes,
+        'ratio': dict_bytes / buffer_bytes if buffer_bytes else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    result = memory_comparison()
+    print(f"{result['events']} mouse moves: list of dicts {result['dict_bytes'] / 1e6:.1f} MB, "
+          f"EventBuffer {result['buffer_bytes'] / 1e6:.1f} MB ({result['ratio']:.1f}x smaller)")
@@ -0,0 +1,50 @@
+class HotkeyRegistry:
+    """The global hotkeys of the app, one per action, registered through an InputBackend.
+
+    `callbacks` maps each action to the function its hotkey calls. apply()
+    takes the wanted {action: hotkey} and only touches the actions whose
+    hotkey changed, so the others never stop working and nothing is
+    registered twice. The registry only removes handles it added itself;
+    recording hooks and other hotkeys on the backend are left alone.
+    """
+
+    def __init__(self, backend, callbacks):
+        self.backend = backend
+        self.callbacks = callbacks
+        self.registered = {}  # action: (hotkey, handle)
+
+    def apply(self, hotkeys):
+        """Register `hotkeys` ({action: hotkey}; empty or missing ones are removed).
+
+        A hotkey the backend refuses keeps the action's previous hotkey.
+        Returns (action, hotkey, error) for each hotkey that was refused.
+        """
+        failures = []
+        for action in list(self.registered):
+            if not hotkeys.get(action):
+                self.backend.remove_hotkey(self.registered.pop(action)[1])
+        for action, hotkey in hotkeys.items():
+            if not hotkey or action not in self.callbacks:
+                continue
+            current = self.registered.get(action)
+            if current is not None and current[0] == hotkey:
+                continue
+            try:
+                handle = self.backend.add_hotkey(hotkey, self.callbacks[action])
+            except ValueError as e:
+                failures.append((action, hotkey, e))
+                continue
+            if current is not None:
+                self.backend.remove_hotkey(current[1])
+            self.registered[action] = (hotkey, handle)
+        return failures
+
+    def hotkey(self, action):
+        """The hotkey registered for `action`, or None."""
+        current = self.registered.get(action)
+        return current[0] if current is not None else None
+
+    def clear(self):
+        for _, handle in self.registered.values():
+            self.backend.remove_hotkey(handle)
+        self.registered = {}
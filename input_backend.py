@@ -0,0 +1,574 @@
+import random
+import sys
+import threading
+import time
+from collections import namedtuple
+from functools import cached_property
+
+from playback_plan import (OP_BUTTON_DOWN, OP_BUTTON_UP, OP_CLICK, OP_DOUBLE_CLICK, OP_MOVE, OP_SCROLL,
+                           bind_handlers)
+
+# Hook event shapes; they mirror the event classes of the `keyboard` and `mouse`
+# libraries so recorder code works the same with every backend
+KeyboardEvent = namedtuple('KeyboardEvent', ['event_type', 'scan_code', 'name', 'time'])
+ButtonEvent = namedtuple('ButtonEvent', ['event_type', 'button', 'time'])
+WheelEvent = namedtuple('WheelEvent', ['delta', 'time'])
+MoveEvent = namedtuple('MoveEvent', ['x', 'y', 'time'])
+
+
+class InputBackend:
+    """Everything the recorder needs from the OS input stack.
+
+    Hook callbacks receive keyboard events (event_type, scan_code, name, time)
+    and mouse events shaped like ButtonEvent, WheelEvent or MoveEvent. The
+    event classes a backend delivers are exposed as class attributes so
+    callers can dispatch on type.
+    """
+
+    keyboard_event_class = KeyboardEvent
+    button_event_class = ButtonEvent
+    wheel_event_class = WheelEvent
+    move_event_class = MoveEvent
+
+    def __init__(self):
+        # Injection method for each playback opcode
+        self.handlers = bind_handlers(self)
+
+    # Hooks and hotkeys
+    def hook_keyboard(self, callback):
+        raise NotImplementedError
+
+    def hook_mouse(self, callback):
+        raise NotImplementedError
+
+    def unhook_keyboard(self, handle):
+        raise NotImplementedError
+
+    def unhook_mouse(self, handle):
+        raise NotImplementedError
+
+    def unhook_all(self):
+        raise NotImplementedError
+
+    def add_hotkey(self, hotkey, callback):
+        raise NotImplementedError
+
+    def remove_hotkey(self, handle):
+        raise NotImplementedError
+
+    def read_key_name(self):
+        """Block until the next key press and return its name."""
+        raise NotImplementedError
+
+    def scan_codes(self, key):
+        """Scan codes of the key named `key`, or () if it is not a single known key."""
+        raise NotImplementedError
+
+    def wait(self, hotkey):
+        """Block until `hotkey` is pressed."""
+        raise NotImplementedError
+
+    # Injection
+    def press_key(self, key):
+        raise NotImplementedError
+
+    def release_key(self, key):
+        raise NotImplementedError
+
+    def tap_key(self, key):
+        self.press_key(key)
+        self.release_key(key)
+
+    def move_to(self, x, y):
+        raise NotImplementedError
+
+    def press_button(self, button):
+        raise NotImplementedError
+
+    def release_button(self, button):
+        raise NotImplementedError
+
+    def click(self, button):
+        raise NotImplementedError
+
+    def double_click(self, button):
+        raise NotImplementedError
+
+    def click_at(self, x, y, button):
+        self.move_to(x, y)
+        self.click(button)
+
+    def double_click_at(self, x, y, button):
+        self.move_to(x, y)
+        self.double_click(button)
+
+    def press_button_at(self, x, y, button):
+        self.move_to(x, y)
+        self.press_button(button)
+
+    def release_button_at(self, x, y, button):
+        self.move_to(x, y)
+        self.release_button(button)
+
+    def scroll(self, delta):
+        raise NotImplementedError
+
+    def position(self):
+        raise NotImplementedError
+
+    def submit(self, batch):
+        """Inject a batch of playback steps, in order.
+
+        Each step is a tuple starting with (offset, opcode, args); callers may
+        append their own fields. Backends that can hand several inputs to the
+        OS in one call should override this.
+        """
+        handlers = self.handlers
+        for step in batch:
+            handlers[step[1]](*step[2])
+
+
+# Win32 SendInput constants, see the MOUSEINPUT documentation
+INPUT_MOUSE = 0
+MOUSEEVENTF_MOVE = 0x0001
+MOUSEEVENTF_WHEEL = 0x0800
+MOUSEEVENTF_VIRTUALDESK = 0x4000
+MOUSEEVENTF_ABSOLUTE = 0x8000
+WHEEL_DELTA = 120
+SM_XVIRTUALSCREEN, SM_YVIRTUALSCREEN, SM_CXVIRTUALSCREEN, SM_CYVIRTUALSCREEN = 76, 77, 78, 79
+
+# `mouse` button names to their (down flag, up flag, mouseData)
+SEND_INPUT_BUTTONS = {
+    'left': (0x0002, 0x0004, 0),
+    'right': (0x0008, 0x0010, 0),
+    'middle': (0x0020, 0x0040, 0),
+    'x': (0x0080, 0x0100, 1),
+    'x2': (0x0080, 0x0100, 2),
+}
+
+
+class SendInputBatch:
+    """Turns the mouse steps of a playback batch into one Win32 SendInput call.
+
+    add() appends the inputs of a move, click, double click, button press
+    or release, or scroll step and returns False for anything else (key
+    taps go through `keyboard`, which maps key names to scan codes);
+    flush() sends what was added in one call. `send_input` and
+    `system_metrics` default to user32's SendInput and GetSystemMetrics.
+    """
+
+    def __init__(self, send_input=None, system_metrics=None):
+        import ctypes
+        from ctypes import wintypes
+
+        class MOUSEINPUT(ctypes.Structure):
+            _fields_ = [('dx', wintypes.LONG), ('dy', wintypes.LONG), ('mouseData', wintypes.DWORD),
+                        ('dwFlags', wintypes.DWORD), ('time', wintypes.DWORD), ('dwExtraInfo', ctypes.c_size_t)]
+
+        # MOUSEINPUT is the largest member of INPUT's union, so this has the size SendInput expects
+        class INPUT(ctypes.Structure):
+            _fields_ = [('type', wintypes.DWORD), ('mi', MOUSEINPUT)]
+
+        if send_input is None or system_metrics is None:
+            user32 = ctypes.WinDLL('user32', use_last_error=True)
+            send_input = user32.SendInput
+            send_input.argtypes = (wintypes.UINT, ctypes.POINTER(INPUT), ctypes.c_int)
+            send_input.restype = wintypes.UINT
+            system_metrics = user32.GetSystemMetrics
+        self.INPUT = INPUT
+        self.input_size = ctypes.sizeof(INPUT)
+        self.send_input = send_input
+        self.system_metrics = system_metrics
+        self.screen = None  # Virtual screen (left, top, width, height), read once per batch
+        self.inputs = []
+
+    def _mouse(self, flags, dx=0, dy=0, data=0):
+        self.inputs.append((flags, dx, dy, data))
+
+    def _move(self, x, y):
+        if self.screen is None:
+            metrics = self.system_metrics
+            self.screen = (metrics(SM_XVIRTUALSCREEN), metrics(SM_YVIRTUALSCREEN),
+                           max(metrics(SM_CXVIRTUALSCREEN), 2), max(metrics(SM_CYVIRTUALSCREEN), 2))
+        left, top, width, height = self.screen
+        # Absolute coordinates are normalized to 0..65535 across the virtual desktop
+        self._mouse(MOUSEEVENTF_MOVE | MOUSEEVENTF_ABSOLUTE | MOUSEEVENTF_VIRTUALDESK,
+                    round((x - left) * 65535 / (width - 1)), round((y - top) * 65535 / (height - 1)))
+
+    def _button(self, button, down=True, up=True):
+        down_flag, up_flag, data = SEND_INPUT_BUTTONS[button]
+        if down:
+            self._mouse(down_flag, data=data)
+        if up:
+            self._mouse(up_flag, data=data)
+
+    def add(self, op, args):
+        if op == OP_MOVE:
+            self._move(*args)
+        elif op in (OP_CLICK, OP_DOUBLE_CLICK, OP_BUTTON_DOWN, OP_BUTTON_UP):
+            x, y, button = args
+            if button not in SEND_INPUT_BUTTONS:
+                return False
+            self._move(x, y)
+            self._button(button, op != OP_BUTTON_UP, op != OP_BUTTON_DOWN)
+            if op == OP_DOUBLE_CLICK:
+                self._button(button)
+        elif op == OP_SCROLL:
+            self._mouse(MOUSEEVENTF_WHEEL, data=round(args[0] * WHEEL_DELTA) & 0xffffffff)
+        else:
+            return False
+        return True
+
+    def flush(self):
+        inputs = self.inputs
+        if not inputs:
+            return
+        self.inputs = []
+        structs = (self.INPUT * len(inputs))()
+        for item, (flags, dx, dy, data) in zip(structs, inputs):
+            item.type = INPUT_MOUSE
+            item.mi.dx = dx
+            item.mi.dy = dy
+            item.mi.mouseData = data
+            item.mi.dwFlags = flags
+        sent = self.send_input(len(inputs), structs, self.input_size)
+        if sent != len(inputs):
+            raise OSError(f"SendInput injected {sent} of {len(inputs)} inputs")
+
+
+class SystemInputBackend(InputBackend):
+    """The real input stack: `keyboard`/`mouse` for hooks, `keyboard` and pynput for injection.
+
+    All mouse injection outside of playback batches goes through one pynput
+    controller, so a click at a position is a cursor move and a click in the
+    same library. pynput is only loaded the first time the cursor is read or
+    moved.
+
+    On Windows submit() hands the mouse steps of a batch to the OS in one
+    SendInput call (see SendInputBatch); key taps still go through
+    `keyboard` one at a time, after the mouse inputs queued before them.
+    """
+
+    def __init__(self):
+        # Imported here so the simulated backend works where these can't be loaded
+        import keyboard
+        import mouse
+
+        super().__init__()
+        self.keyboard = keyboard
+        self.mouse = mouse
+        self.keyboard_event_class = keyboard.KeyboardEvent
+        self.button_event_class = mouse.ButtonEvent
+        self.wheel_event_class = mouse.WheelEvent
+        self.move_event_class = mouse.MoveEvent
+
+    @cached_property
+    def send_input_batch(self):
+        """The SendInputBatch of this backend, or None where there is no SendInput."""
+        return SendInputBatch() if sys.platform == 'win32' else None
+
+    def submit(self, batch):
+        inputs = self.send_input_batch
+        if inputs is None:
+            super().submit(batch)
+            return
+        handlers = self.handlers
+        inputs.screen = None  # Monitors may have changed since the last batch
+        try:
+            for step in batch:
+                if not inputs.add(step[1], step[2]):
+                    inputs.flush()  # Keeps the order of the steps
+                    handlers[step[1]](*step[2])
+            inputs.flush()
+        finally:
+            inputs.inputs = []
+
+    # cached_property stores the value on the instance, so later lookups cost a plain attribute read
+    @cached_property
+    def mouse_controller(self):
+        from pynput.mouse import Controller as MouseController
+        return MouseController()
+
+    @cached_property
+    def buttons(self):
+        """`mouse` button names to pynput buttons."""
+        from pynput.mouse import Button
+        buttons = {name: getattr(Button, name) for name in ('left', 'right', 'middle')}
+        for name, pynput_name in (('x', 'x1'), ('x2', 'x2')):
+            if hasattr(Button, pynput_name):
+                buttons[name] = getattr(Button, pynput_name)
+        return buttons
+
+    def hook_keyboard(self, callback):
+        return self.keyboard.hook(callback)
+
+    def hook_mouse(self, callback):
+        return self.mouse.hook(callback)
+
+    def unhook_keyboard(self, handle):
+        self.keyboard.unhook(handle)
+
+    def unhook_mouse(self, handle):
+        self.mouse.unhook(handle)
+
+    def unhook_all(self):
+        self.keyboard.unhook_all()
+        self.mouse.unhook_all()
+
+    def add_hotkey(self, hotkey, callback):
+        return self.keyboard.add_hotkey(hotkey, callback)
+
+    def remove_hotkey(self, handle):
+        self.keyboard.remove_hotkey(handle)
+
+    def read_key_name(self):
+        return self.keyboard.read_event(suppress=True).name
+
+    def scan_codes(self, key):
+        try:
+            return self.keyboard.key_to_scan_codes(key)
+        except ValueError:  # Unknown keys and combinations like "ctrl+q"
+            return ()
+
+    def wait(self, hotkey):
+        self.keyboard.wait(hotkey)
+
+    def press_key(self, key):
+        self.keyboard.press(key)
+
+    def release_key(self, key):
+        self.keyboard.release(key)
+
+    def move_to(self, x, y):
+        self.mouse_controller.position = (x, y)
+
+    def press_button(self, button):
+        self.mouse_controller.press(self.buttons[button])
+
+    def release_button(self, button):
+        self.mouse_controller.release(self.buttons[button])
+
+    def click(self, button):
+        self.mouse_controller.click(self.buttons[button])
+
+    def double_click(self, button):
+        self.mouse_controller.click(self.buttons[button], 2)
+
+    def click_at(self, x, y, button):
+        controller = self.mouse_controller
+        controller.position = (x, y)
+        controller.click(self.buttons[button])
+
+    def double_click_at(self, x, y, button):
+        controller = self.mouse_controller
+        controller.position = (x, y)
+        controller.click(self.buttons[button], 2)
+
+    def press_button_at(self, x, y, button):
+        controller = self.mouse_controller
+        controller.position = (x, y)
+        controller.press(self.buttons[button])
+
+    def release_button_at(self, x, y, button):
+        controller = self.mouse_controller
+        controller.position = (x, y)
+        controller.release(self.buttons[button])
+
+    def scroll(self, delta):
+        self.mouse_controller.scroll(0, delta)
+
+    def position(self):
+        return self.mouse_controller.position
+
+
+class SimulatedInputBackend(InputBackend):
+    """Deterministic in-memory backend for tests and benchmarks.
+
+    Injected actions are appended to `actions` as (timestamp, action, args)
+    tuples instead of reaching the OS, and synthetic input can be fed to the
+    installed hooks with generate()/deliver().
+    """
+
+    def __init__(self, clock=time.perf_counter, screen_size=(1920, 1080)):
+        super().__init__()
+        self.clock = clock
+        self.screen_size = screen_size
+        self.actions = []
+        self.keyboard_hooks = []
+        self.mouse_hooks = []
+        self.hotkeys = {}
+        self.cursor = (0, 0)
+        self.key_presses = threading.Condition()
+        self.last_key = None
+
+    def _record(self, action, *args):
+        self.actions.append((self.clock(), action, args))
+
+    def hook_keyboard(self, callback):
+        self.keyboard_hooks.append(callback)
+        return callback
+
+    def hook_mouse(self, callback):
+        self.mouse_hooks.append(callback)
+        return callback
+
+    def unhook_keyboard(self, handle):
+        self.keyboard_hooks.remove(handle)
+
+    def unhook_mouse(self, handle):
+        self.mouse_hooks.remove(handle)
+
+    def unhook_all(self):
+        self.keyboard_hooks = []
+        self.mouse_hooks = []
+        self.hotkeys = {}
+
+    def add_hotkey(self, hotkey, callback):
+        handle = object()
+        self.hotkeys[handle] = (hotkey, callback)
+        return handle
+
+    def remove_hotkey(self, handle):
+        del self.hotkeys[handle]
+
+    def trigger_hotkey(self, hotkey):
+        for name, callback in list(self.hotkeys.values()):
+            if name == hotkey:
+                callback()
+
+    def read_key_name(self):
+        with self.key_presses:
+            self.key_presses.wait()
+            return self.last_key
+
+    def scan_codes(self, key):
+        # Synthetic key events use the character code as scan code
+        return (ord(key),) if len(key) == 1 else ()
+
+    def wait(self, hotkey):
+        done = threading.Event()
+        handle = self.add_hotkey(hotkey, done.set)
+        done.wait()
+        self.remove_hotkey(handle)
+
+    def press_key(self, key):
+        self._record('press_key', key)
+
+    def release_key(self, key):
+        self._record('release_key', key)
+
+    def tap_key(self, key):
+        self._record('tap_key', key)
+
+    def move_to(self, x, y):
+        self.cursor = (x, y)
+        self._record('move_to', x, y)
+
+    def press_button(self, button):
+        self._record('press_button', button)
+
+    def release_button(self, button):
+        self._record('release_button', button)
+
+    def click(self, button):
+        self._record('click', button)
+
+    def double_click(self, button):
+        self._record('double_click', button)
+
+    def click_at(self, x, y, button):
+        self.cursor = (x, y)
+        self._record('click_at', x, y, button)
+
+    def double_click_at(self, x, y, button):
+        self.cursor = (x, y)
+        self._record('double_click_at', x, y, button)
+
+    def press_button_at(self, x, y, button):
+        self.cursor = (x, y)
+        self._record('press_button_at', x, y, button)
+
+    def release_button_at(self, x, y, button):
+        self.cursor = (x, y)
+        self._record('release_button_at', x, y, button)
+
+    def scroll(self, delta):
+        self._record('scroll', delta)
+
+    def position(self):
+        return self.cursor
+
+    def synthetic_events(self, duration, mouse_rate=1000.0, keyboard_rate=5.0, click_rate=1.0,
+                         scroll_rate=0.5, seed=0, start_time=0.0):
+        """Yield a reproducible stream of hook events covering `duration` seconds.
+
+        Each event source fires at a fixed rate; mouse moves follow a random
+        walk, keys and buttons alternate down/up. Events come out in time order.
+        """
+        rng = random.Random(seed)
+        width, height = self.screen_size
+        x, y = width // 2, height // 2
+        keys = 'abcdefghijklmnopqrstuvwxyz'
+
+        sources = [(rate, kind) for rate, kind in ((mouse_rate, 'move'), (keyboard_rate, 'key'),
+                                                   (click_rate, 'button'), (scroll_rate, 'wheel')) if rate > 0]
+        next_times = [start_time + 1.0 / rate for rate, _ in sources]
+        end_time = start_time + duration
+        while True:
+            index = min(range(len(sources)), key=next_times.__getitem__)
+            timestamp = next_times[index]
+            if timestamp > end_time:
+                return
+            rate, kind = sources[index]
+            next_times[index] += 1.0 / rate
+
+            if kind == 'move':
+                x = min(max(x + rng.randint(-4, 4), 0), width - 1)
+                y = min(max(y + rng.randint(-4, 4), 0), height - 1)
+                yield MoveEvent(x, y, timestamp)
+            elif kind == 'key':
+                key = rng.choice(keys)
+                yield KeyboardEvent('down', ord(key), key, timestamp)
+                yield KeyboardEvent('up', ord(key), key, timestamp)
+            elif kind == 'button':
+                yield ButtonEvent('down', 'left', timestamp)
+                yield ButtonEvent('up', 'left', timestamp)
+            else:
+                yield WheelEvent(rng.choice((-1.0, 1.0)), timestamp)
+
+    def deliver(self, event):
+        """Feed one hook event to the installed hooks, as the OS hook thread would.
+
+        Like the hook libraries, the event is stamped with the wall clock as it is delivered.
+        """
+        event = event._replace(time=time.time())
+        if isinstance(event, KeyboardEvent):
+            if event.event_type == 'down':
+                with self.key_presses:
+                    self.last_key = event.name
+                    self.key_presses.notify_all()
+                self.trigger_hotkey(event.name)
+            for callback in self.keyboard_hooks:
+                callback(event)
+        else:
+            if isinstance(event, MoveEvent):
+                self.cursor = (event.x, event.y)
+            for callback in self.mouse_hooks:
+                callback(event)
+
+    def generate(self, duration, realtime=False, **rates):
+        """Deliver synthetic_events() to the hooks and return how many were sent.
+
+        With `realtime` the events are paced against the clock, otherwise
+        they are delivered as fast as the hooks accept them.
+        """
+        count = 0
+        started = self.clock()
+        for event in self.synthetic_events(duration, **rates):
+            if realtime:
+                delay = event.time - (self.clock() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            self.deliver(event)
+            count += 1
+        return count
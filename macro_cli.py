@@ -0,0 +1,374 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from event_store import EVENT_TYPES
+from input_backend import SimulatedInputBackend
+from macro_format import (BINARY_EXTENSION, EVENT_EXTENSIONS, MACRO_EXTENSIONS, COMPOSITE_EXTENSION,
+                          COMPRESSIONS, JSON_EXTENSION, MacroFormatError, Segment, deduplicate, flatten_segments,
+                          load_events, save_events, save_composite, read_header)
+from macro_index import INDEX_FILENAME, MacroIndex, macro_stats
+from macro_recorder import MacroRecorder
+from path_simplify import simplify_moves
+from play_range import PlayRange
+from playback_plan import compile_event
+from sync_points import (DEFAULT_SYNC_TIMEOUT, PixelCondition, SystemConditionProvider, WindowCondition,
+                         insert_sync_point, parse_region, sync_event)
+from timeline_transform import TimelineTransform
+
+# Files handed to each worker process at a time
+CHUNK_SIZE = 64
+
+
+def expand_paths(paths):
+    """Expand directories into the macro files they contain."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for file in sorted(os.listdir(path)):
+                if os.path.splitext(file)[1] in MACRO_EXTENSIONS:
+                    files.append(os.path.join(path, file))
+        else:
+            files.append(path)
+    return files
+
+
+def output_path(path, extension, output_dir=None):
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(output_dir or os.path.dirname(path), name + extension)
+
+
+def validate_file(path):
+    errors = []
+    events = load_events(path)
+    if path.endswith(BINARY_EXTENSION):
+        with open(path, 'rb') as f:
+            header = read_header(f)
+        if header['event_count'] != len(events):
+            errors.append(f"header says {header['event_count']} events, file has {len(events)}")
+
+    last_time = 0.0
+    for index, event in enumerate(events):
+        if event['type'] not in EVENT_TYPES:
+            errors.append(f"event {index}: unknown type {event['type']!r}")
+        elif event['event'] in ('move', 'click', 'double click') and 'position' not in event:
+            errors.append(f"event {index}: {event['event']} without a position")
+        else:
+            try:
+                compile_event(event)
+            except KeyError as e:
+                errors.append(f"event {index}: missing field {e}")
+            except ValueError as e:  # A sync point with a malformed condition
+                errors.append(f"event {index}: {e}")
+        if event['time'] < last_time:
+            errors.append(f"event {index}: time goes backwards ({event['time']:.6f} < {last_time:.6f})")
+        last_time = event['time']
+        if len(errors) >= 10:
+            errors.append("too many errors, stopping")
+            break
+    return {'events': len(events), 'errors': errors, 'ok': not errors}
+
+
+def convert_file(path, to, compression, output_dir, replace):
+    extension = '.' + to
+    target = output_path(path, extension, output_dir)
+    size_before = os.path.getsize(path)
+    events = load_events(path)
+    save_events(target, events, compression)
+    if replace and os.path.abspath(target) != os.path.abspath(path):
+        os.remove(path)
+    return {'output': target, 'events': len(events),
+            'size_before': size_before, 'size_after': os.path.getsize(target)}
+
+
+def stats_file(path):
+    stats = macro_stats(path)
+    stats['size'] = os.path.getsize(path)
+    return stats
+
+
+def optimize_file(path, tolerance, time_scale, compression, output_dir):
+    events, stats = simplify_moves(load_events(path), tolerance, time_scale)
+    target = output_path(path, BINARY_EXTENSION, output_dir)
+    save_events(target, events, compression)
+    stats['output'] = target
+    return stats
+
+
+def run_task(task):
+    """Worker entry point: run one command on one file and never raise."""
+    command, path, options = task
+    started = time.perf_counter()
+    try:
+        if command == 'validate':
+            result = validate_file(path)
+        elif command == 'convert':
+            result = convert_file(path, **options)
+        elif command == 'stats':
+            result = stats_file(path)
+        else:
+            result = optimize_file(path, **options)
+        result.setdefault('ok', True)
+    except Exception as e:
+        result = {'ok': False, 'errors': [f"{type(e).__name__}: {e}"]}
+    result['path'] = path
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+
+def run_batch(command, files, options, jobs):
+    tasks = [(command, path, options) for path in files]
+    if jobs == 1 or len(tasks) <= 1:
+        return [run_task(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(run_task, tasks, chunksize=CHUNK_SIZE))
+
+
+def summarize(command, results, elapsed, details):
+    failed = [r for r in results if not r['ok']]
+    summary = {
+        'command': command,
+        'files': len(results),
+        'ok': len(results) - len(failed),
+        'failed': len(failed),
+        'events': sum(r.get('events', r.get('event_count', r.get('events_before', 0))) or 0 for r in results),
+        'elapsed': elapsed,
+        'failures': [{'path': r['path'], 'errors': r.get('errors', [])} for r in failed],
+    }
+    if details:
+        summary['results'] = results
+    return summary
+
+
+def parse_numbers(text, count, usage):
+    """Parse `count` colon-separated numbers, e.g. START:END:SPEED."""
+    try:
+        values = tuple(float(value) for value in text.split(':'))
+    except ValueError:
+        values = ()
+    if len(values) != count:
+        raise argparse.ArgumentTypeError(f"invalid value {text!r}, expected {usage}")
+    return values
+
+
+def cmd_play(args):
+    backend = SimulatedInputBackend() if args.simulate else None
+    # The simulated backend has no desktop to check sync conditions against
+    conditions = None if args.simulate or args.skip_sync else SystemConditionProvider()
+    # Playback only: no macros folder in the working directory, and no journal recovery
+    recorder = MacroRecorder(backend, conditions, macro_dir=None)
+    recorder.playback_telemetry = not args.no_timing
+    transform = TimelineTransform(args.max_idle, args.trim, args.retime, args.speed_curve)
+    play_range = PlayRange(args.start, args.end, args.first_event, args.last_event, not args.keep_cursor)
+    recorder.play_file(args.macro, args.speed, transform, play_range, repeat_count=args.repeat,
+                       repeat_delay=args.repeat_delay, loop_playback=args.loop)
+    if args.simulate:
+        print(json.dumps({'command': 'play', 'macro': args.macro, 'actions': len(backend.actions)}))
+    return 0
+
+
+def cmd_sync(args):
+    if args.macro.endswith(COMPOSITE_EXTENSION):
+        raise SystemExit("Sync points are added to the macros a composite plays, not to the composite")
+    if args.hash is not None and args.pixels is None:
+        raise SystemExit("--hash only goes with --pixels")
+    if args.window is not None:
+        condition = WindowCondition(args.window)
+    elif args.hash is not None:
+        condition = PixelCondition(*args.pixels, args.hash)
+    else:
+        condition = PixelCondition.capture(SystemConditionProvider(), *args.pixels)
+
+    compression = 'zlib'
+    if not args.macro.endswith(JSON_EXTENSION):
+        with open(args.macro, 'rb') as f:
+            code = read_header(f)['compression']
+        compression = next(name for name, value in COMPRESSIONS.items() if value == code)
+    events = insert_sync_point(load_events(args.macro), sync_event(condition, args.at, args.timeout))
+    save_events(args.macro, events, compression)
+    print(json.dumps({'command': 'sync', 'macro': args.macro, 'at': args.at, 'kind': condition.kind,
+                      'condition': condition.text(), 'timeout': args.timeout, 'events': len(events)}))
+    return 0
+
+
+def parse_segment(text):
+    """Parse a NAME[:REPEAT[:OFFSET]] command line segment."""
+    name, *options = text.split(':')
+    try:
+        if len(options) > 2:
+            raise ValueError
+        repeat = int(options[0]) if options else 1
+        offset = float(options[1]) if len(options) > 1 else 0.0
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid segment {text!r}, expected NAME[:REPEAT[:OFFSET]]")
+    return Segment(name, repeat, offset)
+
+
+def sync_region(text):
+    try:
+        return parse_region(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def cmd_compose(args):
+    path = os.path.join(args.dir, args.name + COMPOSITE_EXTENSION)
+    # find_macro_file() prefers recorded macros, so a composite of the same name would never be played
+    for extension in EVENT_EXTENSIONS:
+        if os.path.exists(os.path.join(args.dir, args.name + extension)):
+            print(f"compose: a macro named '{args.name}' already exists as {args.name}{extension}", file=sys.stderr)
+            return 1
+    try:
+        # Fails if a segment is missing or leads back to this composite; nothing is written then
+        events = flatten_segments(path, args.segments)
+    except (OSError, ValueError, MacroFormatError) as e:
+        print(f"compose: {e}", file=sys.stderr)
+        return 1
+    save_composite(path, args.segments)
+    print(json.dumps({'command': 'compose', 'output': path, 'segments': len(args.segments),
+                      'events': len(events), 'duration': events.duration()}))
+    return 0
+
+
+def cmd_dedupe(args):
+    replaced = deduplicate(args.dir, args.dry_run)
+    if replaced and not args.dry_run and os.path.exists(os.path.join(args.dir, INDEX_FILENAME)):
+        # Point the index rows of the replaced macros at their composites
+        index = MacroIndex(args.dir)
+        try:
+            for name, _ in replaced:
+                index.update_file(os.path.join(args.dir, name + COMPOSITE_EXTENSION))
+        finally:
+            index.close()
+    print(json.dumps({'command': 'dedupe', 'dry_run': args.dry_run, 'replaced': len(replaced),
+                      'duplicates': [{'macro': name, 'copy_of': kept} for name, kept in replaced]}, indent=2))
+    return 0
+
+
+def cmd_batch(args):
+    files = expand_paths(args.paths)
+    if args.command == 'convert':
+        options = {'to': args.to, 'compression': args.compression,
+                   'output_dir': args.output_dir, 'replace': args.replace}
+    elif args.command == 'optimize':
+        options = {'tolerance': args.tolerance, 'time_scale': args.time_scale,
+                   'compression': args.compression, 'output_dir': args.output_dir}
+    else:
+        options = {}
+    if getattr(args, 'output_dir', None):
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    started = time.perf_counter()
+    results = run_batch(args.command, files, options, args.jobs)
+    summary = summarize(args.command, results, time.perf_counter() - started, args.details)
+
+    output = json.dumps(summary, indent=2)
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+    return 0 if not summary['failed'] else 1
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="macro_cli", description="Headless Macro Recorder tools")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    play = commands.add_parser('play', help="Play a macro file")
+    play.add_argument('macro')
+    play.add_argument('--speed', type=float, default=1.0)
+    play.add_argument('--repeat', type=int, default=1)
+    play.add_argument('--repeat-delay', type=float, default=0.0)
+    play.add_argument('--loop', action='store_true')
+    play.add_argument('--simulate', action='store_true',
+                      help="Inject into the in-memory simulated backend instead of the real input devices")
+    play.add_argument('--no-timing', action='store_true',
+                      help="Don't time injected events or write the .timing summary")
+    play.add_argument('--max-idle', type=float, default=0.0,
+                      help="Shorten pauses longer than this many seconds to it")
+    play.add_argument('--trim', action='store_true',
+                      help="Skip the wait before the first step and cursor moves after the last action")
+    play.add_argument('--retime', action='append', default=[], metavar='START:END:SPEED',
+                      type=lambda text: parse_numbers(text, 3, 'START:END:SPEED'),
+                      help="Play the recording between START and END seconds SPEED times as fast (repeatable)")
+    play.add_argument('--speed-curve', action='append', default=[], metavar='TIME:SPEED',
+                      type=lambda text: parse_numbers(text, 2, 'TIME:SPEED'),
+                      help="Speed at a point of the recording, interpolated between points (repeatable)")
+    play.add_argument('--from', dest='start', type=float, metavar='SECONDS',
+                      help="Start playing at this time of the recording")
+    play.add_argument('--to', dest='end', type=float, metavar='SECONDS',
+                      help="Stop playing at this time of the recording")
+    play.add_argument('--from-event', dest='first_event', type=int, metavar='N',
+                      help="Start playing at event number N (counting from 0)")
+    play.add_argument('--to-event', dest='last_event', type=int, metavar='N',
+                      help="Stop playing before event number N")
+    play.add_argument('--keep-cursor', action='store_true',
+                      help="Don't move the cursor to where it was at the start of the range first")
+    play.add_argument('--skip-sync', action='store_true',
+                      help="Ignore sync points and keep the recorded pauses before them")
+    play.set_defaults(handler=cmd_play)
+
+    sync = commands.add_parser('sync', help="Add a sync point that waits for a window or screen region")
+    sync.add_argument('macro')
+    sync.add_argument('--at', type=float, required=True, metavar='SECONDS',
+                      help="Time of the recording to wait at; the steps after it wait for the condition")
+    condition = sync.add_mutually_exclusive_group(required=True)
+    condition.add_argument('--window', metavar='TITLE', help="Wait for a window whose title contains TITLE")
+    condition.add_argument('--pixels', metavar='X,Y,WIDTH,HEIGHT', type=sync_region,
+                           help="Wait for this screen region to look like it does now (or like --hash)")
+    sync.add_argument('--hash', help="Expected hash of the --pixels region instead of capturing it")
+    sync.add_argument('--timeout', type=float, default=DEFAULT_SYNC_TIMEOUT,
+                      help=f"Seconds to wait before playback fails (default: {DEFAULT_SYNC_TIMEOUT:g})")
+    sync.set_defaults(handler=cmd_sync)
+
+    compose = commands.add_parser('compose', help="Save a composite macro that plays other macros as segments")
+    compose.add_argument('name')
+    compose.add_argument('segments', nargs='+', type=parse_segment, metavar='NAME[:REPEAT[:OFFSET]]',
+                         help="Macro to play, how many times, and seconds to wait after the previous segment")
+    compose.add_argument('--dir', default='macros', help="Macros directory (default: macros)")
+    compose.set_defaults(handler=cmd_compose)
+
+    dedupe = commands.add_parser('dedupe', help="Replace identical copies of a macro with composites of it")
+    dedupe.add_argument('--dir', default='macros', help="Macros directory (default: macros)")
+    dedupe.add_argument('--dry-run', action='store_true', help="Only report the duplicates")
+    dedupe.set_defaults(handler=cmd_dedupe)
+
+    batch = argparse.ArgumentParser(add_help=False)
+    batch.add_argument('paths', nargs='+', help="Macro files or directories of macros")
+    batch.add_argument('--jobs', '-j', type=int, default=os.cpu_count(),
+                       help="Worker processes (default: one per core)")
+    batch.add_argument('--summary', help="Write the JSON summary to this file instead of stdout")
+    batch.add_argument('--details', action='store_true', help="Include per-file results in the summary")
+
+    commands.add_parser('validate', parents=[batch], help="Check that macros parse and are well formed")
+    commands.add_parser('stats', parents=[batch], help="Event counts, duration and device mix")
+
+    convert = commands.add_parser('convert', parents=[batch], help="Re-encode macros in another format")
+    convert.add_argument('--to', choices=[ext[1:] for ext in EVENT_EXTENSIONS], default=BINARY_EXTENSION[1:])
+    convert.add_argument('--compression', choices=tuple(COMPRESSIONS), default='zlib')
+    convert.add_argument('--output-dir')
+    convert.add_argument('--replace', action='store_true', help="Delete the source file after converting")
+
+    optimize = commands.add_parser('optimize', parents=[batch], help="Simplify mouse paths and save as .mrec")
+    optimize.add_argument('--tolerance', type=float, default=2.0, help="Max path error in pixels")
+    optimize.add_argument('--time-scale', type=float, default=0.0,
+                          help="Pixels per second when treating time as a third coordinate")
+    optimize.add_argument('--compression', choices=tuple(COMPRESSIONS), default='zlib')
+    optimize.add_argument('--output-dir')
+
+    for name in ('validate', 'stats', 'convert', 'optimize'):
+        commands.choices[name].set_defaults(handler=cmd_batch)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,770 @@
+import hashlib
+import json
+import lzma
+import mmap
+import os
+import struct
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from itertools import accumulate
+
+from event_store import EventBuffer, StringTable, HAS_POSITION, HAS_DELTA
+
+# Binary macro file layout (all integers little endian):
+#
+#   header   32 bytes, see HEADER below; event_count, footer_offset and
+#            duration are patched in when the writer is closed
+#   blocks   up to BLOCK_SIZE events each, framed as
+#            varint event_count, varint raw_size, varint stored_size, payload
+#   footer   kind table and key/button name table (varint count, then
+#            varint length + utf-8 bytes per string)
+#   index    only if the header flags have FLAG_SEEK_INDEX: one entry per
+#            block, stored column by column as int64 first event number,
+#            int64 time of the first event in ns, int64 file offset of the
+#            block's frame, then int32 cursor x and int32 cursor y before
+#            the block (NO_CURSOR until an event had a position); the
+#            entry count follows as the last 8 bytes of the file. Readers
+#            that don't know the flag only read the tables.
+#
+# A block payload (optionally zlib/lzma compressed) is columnar:
+#   type/flags byte per event, kind id byte per event,
+#   zigzag varint name ids, zigzag varint time deltas in nanoseconds,
+#   zigzag varint x deltas then y deltas for events with a position,
+#   float64 deltas for scroll events.
+# Deltas restart at zero in every block, so each block decodes on its own.
+#
+# A block with an event_count of 0 holds no events. Journal files use it to
+# record the kind and name strings added since the previous block (a kind
+# string list then a name string list, as in the footer), so an unclosed
+# journal can be recovered without its footer. Readers skip such blocks.
+
+MAGIC = b'MREC'
+VERSION = 1
+HEADER = struct.Struct('<4sBBHQQd')
+BLOCK_SIZE = 4096
+
+# Header flags
+FLAG_SEEK_INDEX = 1
+
+SEEK_INDEX_TRAILER = struct.Struct('<Q')
+NO_CURSOR = -(1 << 31)
+
+BINARY_EXTENSION = '.mrec'
+JSON_EXTENSION = '.json'
+COMPOSITE_EXTENSION = '.mcomp'
+MACRO_EXTENSIONS = (BINARY_EXTENSION, JSON_EXTENSION, COMPOSITE_EXTENSION)
+# Formats events can be saved in; composites only reference other macros
+EVENT_EXTENSIONS = (BINARY_EXTENSION, JSON_EXTENSION)
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_LZMA = 2
+COMPRESSIONS = {'none': COMPRESSION_NONE, 'zlib': COMPRESSION_ZLIB, 'lzma': COMPRESSION_LZMA}
+
+
+class MacroFormatError(Exception):
+    pass
+
+
+def _encode_varints(values, out):
+    for value in values:
+        while value >= 0x80:
+            out.append((value & 0x7f) | 0x80)
+            value >>= 7
+        out.append(value)
+
+
+def _encode_signed(values, out):
+    _encode_varints([(v << 1) ^ (v >> 63) for v in values], out)
+
+
+def _decode_varints(data, pos, count):
+    values = []
+    append = values.append
+    for _ in range(count):
+        byte = data[pos]
+        pos += 1
+        if byte < 0x80:
+            append(byte)
+            continue
+        result = byte & 0x7f
+        shift = 7
+        while True:
+            byte = data[pos]
+            pos += 1
+            result |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        append(result)
+    return values, pos
+
+
+def _decode_signed(data, pos, count):
+    values, pos = _decode_varints(data, pos, count)
+    return [(v >> 1) ^ -(v & 1) for v in values], pos
+
+
+def _read_varint(f):
+    result = 0
+    shift = 0
+    while True:
+        byte = f.read(1)
+        if not byte:
+            raise EOFError
+        result |= (byte[0] & 0x7f) << shift
+        if byte[0] < 0x80:
+            return result
+        shift += 7
+
+
+def _deltas(values):
+    previous = 0
+    result = []
+    for value in values:
+        result.append(value - previous)
+        previous = value
+    return result
+
+
+def _compress(payload, compression):
+    if compression == COMPRESSION_ZLIB:
+        return zlib.compress(payload, 6)
+    if compression == COMPRESSION_LZMA:
+        return lzma.compress(payload, preset=6)
+    return payload
+
+
+def _decompress(payload, compression):
+    if compression == COMPRESSION_ZLIB:
+        return zlib.decompress(payload)
+    if compression == COMPRESSION_LZMA:
+        return lzma.decompress(payload)
+    return payload
+
+
+def _write_strings(strings, out):
+    _encode_varints([len(strings)], out)
+    for string in strings:
+        encoded = string.encode('utf-8')
+        _encode_varints([len(encoded)], out)
+        out += encoded
+
+
+def _read_strings(data, pos):
+    (count,), pos = _decode_varints(data, pos, 1)
+    strings = []
+    for _ in range(count):
+        (length,), pos = _decode_varints(data, pos, 1)
+        strings.append(bytes(data[pos:pos + length]).decode('utf-8'))
+        pos += length
+    return strings, pos
+
+
+def encode_block(buffer, start, end, kind_map, name_map):
+    """Encode events [start, end) of an EventBuffer into a raw block payload."""
+    types = buffer.types[start:end]
+    flags = buffer.flags[start:end]
+    payload = bytearray((t << 3) | f for t, f in zip(types, flags))
+    payload += bytes(kind_map[k] for k in buffer.kinds[start:end])
+    _encode_signed([name_map[i] if i >= 0 else -1 for i in buffer.ids[start:end]], payload)
+    _encode_signed(_deltas(buffer.times[start:end]), payload)
+
+    positioned = [i for i, f in enumerate(flags, start) if f & HAS_POSITION]
+    _encode_signed(_deltas([buffer.xs[i] for i in positioned]), payload)
+    _encode_signed(_deltas([buffer.ys[i] for i in positioned]), payload)
+
+    scrolls = array('d', (buffer.deltas[i] for i, f in enumerate(flags, start) if f & HAS_DELTA))
+    payload += scrolls.tobytes()
+    return bytes(payload)
+
+
+def decode_block(payload, count, buffer):
+    """Decode a raw block payload and append its events to an EventBuffer.
+
+    The buffer's kind and name tables must already be the file's tables.
+    """
+    type_flags = payload[:count]
+    kinds = payload[count:2 * count]
+    pos = 2 * count
+    ids, pos = _decode_signed(payload, pos, count)
+    time_deltas, pos = _decode_signed(payload, pos, count)
+
+    flags = [tf & 7 for tf in type_flags]
+    positioned = sum(1 for f in flags if f & HAS_POSITION)
+    x_deltas, pos = _decode_signed(payload, pos, positioned)
+    y_deltas, pos = _decode_signed(payload, pos, positioned)
+    scrolls = array('d')
+    scrolls.frombytes(payload[pos:pos + 8 * sum(1 for f in flags if f & HAS_DELTA)])
+
+    xs = array('i', bytes(4 * count))
+    ys = array('i', bytes(4 * count))
+    deltas = array('d', bytes(8 * count))
+    xi = yi = si = 0
+    x_values = list(accumulate(x_deltas))
+    y_values = list(accumulate(y_deltas))
+    for i, f in enumerate(flags):
+        if f & HAS_POSITION:
+            xs[i] = x_values[xi]
+            ys[i] = y_values[yi]
+            xi += 1
+            yi += 1
+        if f & HAS_DELTA:
+            deltas[i] = scrolls[si]
+            si += 1
+
+    buffer.types.extend(array('B', (tf >> 3 for tf in type_flags)))
+    buffer.kinds.frombytes(bytes(kinds))
+    buffer.flags.extend(array('B', flags))
+    buffer.ids.extend(array('i', ids))
+    buffer.xs.extend(xs)
+    buffer.ys.extend(ys)
+    buffer.deltas.extend(deltas)
+    buffer.times.extend(array('q', accumulate(time_deltas)))
+
+
+class SeekIndex:
+    """Where each block of a binary macro starts, for seeking without decoding earlier blocks.
+
+    One entry per block, in columns: `events` (number of the block's first
+    event), `times` (its time in ns), `offsets` (file offset of the block's
+    frame) and `xs`/`ys` (cursor position before the block). Columns are
+    arrays while an index is built, and memoryviews over a memory-mapped
+    file when it is read; release() unmaps them. Lookups are binary searches.
+    """
+
+    COLUMNS = (('events', 'q'), ('times', 'q'), ('offsets', 'q'), ('xs', 'i'), ('ys', 'i'))
+
+    def __init__(self):
+        for name, typecode in self.COLUMNS:
+            setattr(self, name, array(typecode))
+        self.mapping = None
+
+    @classmethod
+    def from_mapping(cls, mapping, start, count):
+        """An index over `count` entries stored from `start` in a memory-mapped file."""
+        index = cls()
+        index.mapping = mapping
+        view = memoryview(mapping)
+        for name, typecode in cls.COLUMNS:
+            size = array(typecode).itemsize * count
+            setattr(index, name, view[start:start + size].cast(typecode))
+            start += size
+        view.release()
+        return index
+
+    def add(self, first_event, time_ns, offset, cursor):
+        self.events.append(first_event)
+        self.times.append(time_ns)
+        self.offsets.append(offset)
+        self.xs.append(cursor[0])
+        self.ys.append(cursor[1])
+
+    def __len__(self):
+        return len(self.events)
+
+    def block_for_time(self, time_ns):
+        """The block holding the first event at or after `time_ns`, or the one before it."""
+        return max(bisect_left(self.times, time_ns) - 1, 0)
+
+    def block_for_event(self, event):
+        """The block holding event number `event`."""
+        return max(bisect_right(self.events, event) - 1, 0)
+
+    def cursor(self, block):
+        """Cursor position before `block`, or None if no event had a position yet."""
+        x = self.xs[block]
+        return None if x == NO_CURSOR else (x, self.ys[block])
+
+    def tobytes(self):
+        data = b''.join(getattr(self, name).tobytes() for name, _ in self.COLUMNS)
+        return data + SEEK_INDEX_TRAILER.pack(len(self))
+
+    def release(self):
+        if self.mapping is None:
+            return
+        for name, _ in self.COLUMNS:
+            getattr(self, name).release()
+        self.mapping.close()
+        self.mapping = None
+
+
+def last_position(buffer, start, end, cursor=None):
+    """Position of the last event in [start, end) of `buffer` that has one, else `cursor`."""
+    flags = buffer.flags
+    for i in range(end - 1, start - 1, -1):
+        if flags[i] & HAS_POSITION:
+            return buffer.xs[i], buffer.ys[i]
+    return cursor
+
+
+class MacroWriter:
+    """Writes a binary macro file block by block, along with its seek index."""
+
+    def __init__(self, path, compression='zlib', block_size=BLOCK_SIZE):
+        self.path = path
+        self.compression = COMPRESSIONS[compression]
+        self.block_size = block_size
+        self.kind_table = StringTable(EventBuffer.KINDS)
+        self.name_table = StringTable()
+        self.event_count = 0
+        self.duration = 0.0
+        self.index = SeekIndex()
+        self.cursor = None
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, self.compression, 0, 0, 0, 0.0))
+
+    def write_block(self, buffer, start, end):
+        kind_map = [self.kind_table.intern(k) for k in buffer.kind_table.strings]
+        name_map = [self.name_table.intern(n) for n in buffer.name_table.strings]
+        self._write_events(buffer, start, end, kind_map, name_map)
+
+    def _write_events(self, buffer, start, end, kind_map, name_map):
+        self.index.add(self.event_count, buffer.times[start], self.file.tell(), self.cursor or (NO_CURSOR, NO_CURSOR))
+        self._write_frame(end - start, encode_block(buffer, start, end, kind_map, name_map))
+        self.event_count += end - start
+        self.duration = max(self.duration, buffer.times[end - 1] / 1e9)
+        self.cursor = last_position(buffer, start, end, self.cursor)
+
+    def _write_frame(self, count, payload):
+        stored = _compress(payload, self.compression)
+        frame = bytearray()
+        _encode_varints([count, len(payload), len(stored)], frame)
+        self.file.write(frame)
+        self.file.write(stored)
+
+    def write_events(self, events):
+        if not isinstance(events, EventBuffer):
+            events = EventBuffer(events)
+        for start in range(0, len(events), self.block_size):
+            self.write_block(events, start, min(start + self.block_size, len(events)))
+
+    def close(self):
+        footer_offset = self.file.tell()
+        footer = bytearray()
+        _write_strings(self.kind_table.strings, footer)
+        _write_strings(self.name_table.strings, footer)
+        self.file.write(footer)
+        self.file.write(self.index.tobytes())
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, self.compression, FLAG_SEEK_INDEX,
+                                    self.event_count, footer_offset, self.duration))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class JournalWriter(MacroWriter):
+    """A MacroWriter whose file stays recoverable if it is never closed.
+
+    Every block is preceded by the strings it added to the tables and is
+    flushed to disk before write_block() returns; see finish_binary().
+    """
+
+    def __init__(self, path, compression='zlib', block_size=BLOCK_SIZE):
+        super().__init__(path, compression, block_size)
+        self.saved_kinds = len(self.kind_table)
+        self.saved_names = len(self.name_table)
+
+    def write_block(self, buffer, start, end):
+        kind_map = [self.kind_table.intern(k) for k in buffer.kind_table.strings]
+        name_map = [self.name_table.intern(n) for n in buffer.name_table.strings]
+        if len(self.kind_table) > self.saved_kinds or len(self.name_table) > self.saved_names:
+            tables = bytearray()
+            _write_strings(self.kind_table.strings[self.saved_kinds:], tables)
+            _write_strings(self.name_table.strings[self.saved_names:], tables)
+            self._write_frame(0, bytes(tables))
+            self.saved_kinds = len(self.kind_table)
+            self.saved_names = len(self.name_table)
+
+        self._write_events(buffer, start, end, kind_map, name_map)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+
+def finish_binary(path):
+    """Close a binary macro file whose writer never got to close it.
+
+    Blocks are read back up to the first truncated or corrupt one, which is
+    cut off together with everything after it; then the footer is written
+    and the header patched. Only files written by JournalWriter carry their
+    tables along with the blocks. Returns the number of events kept.
+    """
+    with open(path, 'r+b') as f:
+        header = read_header(f)
+        if header['footer_offset']:
+            return header['event_count']
+
+        kinds = StringTable(EventBuffer.KINDS)
+        names = StringTable()
+        index = SeekIndex()
+        cursor = None
+        event_count = 0
+        duration = 0.0
+        end = HEADER.size
+        while True:
+            try:
+                count = _read_varint(f)
+                _read_varint(f)
+                stored_size = _read_varint(f)
+                stored = f.read(stored_size)
+                if len(stored) < stored_size:
+                    break
+                payload = _decompress(stored, header['compression'])
+                if count:
+                    block = new_buffer(kinds.strings, names.strings)
+                    decode_block(payload, count, block)
+                    if max(block.ids, default=-1) >= len(names) or max(block.kinds) >= len(kinds):
+                        break
+                    duration = max(duration, block.duration())
+                    index.add(event_count, block.times[0], end, cursor or (NO_CURSOR, NO_CURSOR))
+                    cursor = last_position(block, 0, count, cursor)
+                else:
+                    new_kinds, pos = _read_strings(payload, 0)
+                    new_names, _ = _read_strings(payload, pos)
+                    for kind in new_kinds:
+                        kinds.intern(kind)
+                    for name in new_names:
+                        names.intern(name)
+            except (EOFError, IndexError, ValueError, zlib.error, lzma.LZMAError):
+                break
+            event_count += count
+            end = f.tell()
+
+        f.seek(end)
+        f.truncate()
+        footer = bytearray()
+        _write_strings(kinds.strings, footer)
+        _write_strings(names.strings, footer)
+        f.write(footer)
+        f.write(index.tobytes())
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, header['compression'], FLAG_SEEK_INDEX, event_count, end, duration))
+    return event_count
+
+
+def read_header(f):
+    data = f.read(HEADER.size)
+    if len(data) < HEADER.size:
+        raise MacroFormatError("File is too short to be a macro")
+    magic, version, compression, flags, event_count, footer_offset, duration = HEADER.unpack(data)
+    if magic != MAGIC:
+        raise MacroFormatError("Not a binary macro file")
+    if version > VERSION:
+        raise MacroFormatError(f"Unsupported macro file version {version}")
+    return {
+        'version': version,
+        'compression': compression,
+        'flags': flags,
+        'event_count': event_count,
+        'footer_offset': footer_offset,
+        'duration': duration,
+    }
+
+
+def read_tables(f, header):
+    f.seek(header['footer_offset'])
+    footer = f.read()
+    kinds, pos = _read_strings(footer, 0)
+    names, pos = _read_strings(footer, pos)
+    return kinds, names
+
+
+def iter_blocks(f, header, offset=HEADER.size):
+    """Yield (event_count, raw payload) for each block of an open binary macro, from the frame at `offset` on."""
+    f.seek(offset)
+    while f.tell() < header['footer_offset']:
+        count = _read_varint(f)
+        _read_varint(f)
+        stored_size = _read_varint(f)
+        yield count, _decompress(f.read(stored_size), header['compression'])
+
+
+def new_buffer(kinds, names):
+    buffer = EventBuffer()
+    buffer.kind_table = StringTable(kinds)
+    buffer.name_table = StringTable(names)
+    return buffer
+
+
+def iter_event_blocks(path):
+    """Lazily decode a binary macro, yielding one EventBuffer per block."""
+    with open(path, 'rb') as f:
+        header = read_header(f)
+        kinds, names = read_tables(f, header)
+        for count, payload in iter_blocks(f, header):
+            buffer = new_buffer(kinds, names)
+            decode_block(payload, count, buffer)
+            yield buffer
+
+
+def read_seek_index(f, header):
+    """The SeekIndex of an open binary macro; call release() on it when done.
+
+    The index is memory-mapped, so opening it reads no more than its pages
+    that a lookup touches. Files written before the index existed are
+    indexed by decoding every block once.
+    """
+    if header['flags'] & FLAG_SEEK_INDEX:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        count, = SEEK_INDEX_TRAILER.unpack_from(mapping, len(mapping) - SEEK_INDEX_TRAILER.size)
+        size = sum(array(typecode).itemsize for _, typecode in SeekIndex.COLUMNS) * count
+        return SeekIndex.from_mapping(mapping, len(mapping) - SEEK_INDEX_TRAILER.size - size, count)
+
+    index = SeekIndex()
+    cursor = None
+    first_event = 0
+    f.seek(HEADER.size)
+    while f.tell() < header['footer_offset']:
+        offset = f.tell()
+        count = _read_varint(f)
+        _read_varint(f)
+        payload = _decompress(f.read(_read_varint(f)), header['compression'])
+        if not count:
+            continue
+        block = EventBuffer()
+        decode_block(payload, count, block)
+        index.add(first_event, block.times[0], offset, cursor or (NO_CURSOR, NO_CURSOR))
+        cursor = last_position(block, 0, count, cursor)
+        first_event += count
+    return index
+
+
+def seek_blocks(path, time_ns=None, event=None):
+    """Yield (first event number, cursor before the block, EventBuffer) from the block holding a seek point on.
+
+    The seek point is the first event at or after `time_ns`, or event
+    number `event`. Binary macros jump straight to its block through the
+    seek index, so nothing before it is decoded; other formats are loaded
+    whole as a single block. All blocks share one set of tables. The cursor
+    is None if no earlier event had a position.
+    """
+    if path.endswith((JSON_EXTENSION, COMPOSITE_EXTENSION)):
+        yield 0, None, load_events(path)
+        return
+    with open(path, 'rb') as f:
+        header = read_header(f)
+        template = new_buffer(*read_tables(f, header))
+        index = read_seek_index(f, header)
+        try:
+            if not len(index):
+                return
+            block = index.block_for_time(time_ns) if time_ns is not None else index.block_for_event(event or 0)
+            first_event = index.events[block]
+            cursor = index.cursor(block)
+            offset = index.offsets[block]
+        finally:
+            index.release()
+        for count, payload in iter_blocks(f, header, offset):
+            if not count:
+                continue
+            buffer = template.empty_like()
+            decode_block(payload, count, buffer)
+            yield first_event, cursor, buffer
+            first_event += count
+            cursor = last_position(buffer, 0, count, cursor)
+
+
+def iter_events(path):
+    """Yield the events of a macro file one at a time.
+
+    Binary macros are decoded block by block, so memory use does not depend
+    on the macro's length. JSON and composite macros are loaded in one go.
+    """
+    if path.endswith((JSON_EXTENSION, COMPOSITE_EXTENSION)):
+        yield from load_events(path)
+        return
+    for buffer in iter_event_blocks(path):
+        yield from buffer
+
+
+def load_binary(path):
+    with open(path, 'rb') as f:
+        header = read_header(f)
+        buffer = new_buffer(*read_tables(f, header))
+        for count, payload in iter_blocks(f, header):
+            decode_block(payload, count, buffer)
+    return buffer
+
+
+def save_binary(path, events, compression='zlib'):
+    with MacroWriter(path, compression) as writer:
+        writer.write_events(events)
+
+
+class Segment(namedtuple('Segment', ['macro', 'repeat', 'offset'])):
+    """One part of a composite macro.
+
+    `macro` is the name of another macro in the same directory, played
+    `repeat` times back to back, starting `offset` seconds after the
+    previous segment ended.
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, macro, repeat=1, offset=0.0):
+        return super().__new__(cls, macro, repeat, offset)
+
+
+def read_composite(path):
+    """The segments of a composite macro file."""
+    with open(path, 'r') as f:
+        data = json.load(f)
+    return [Segment(segment['macro'], segment.get('repeat', 1), segment.get('offset', 0.0))
+            for segment in data['segments']]
+
+
+def save_composite(path, segments):
+    """Write a composite macro; an existing file at `path` is only replaced once the new one is complete."""
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump({'segments': [segment._asdict() for segment in segments]}, f, indent=2)
+    os.replace(temp_path, path)
+
+
+def segment_path(composite_path, segment):
+    return find_macro_file(os.path.dirname(composite_path) or '.', segment.macro)
+
+
+def load_composite(path, including=()):
+    """Flatten a composite macro, and the composites it references, into one EventBuffer."""
+    return flatten_segments(path, read_composite(path), including)
+
+
+def flatten_segments(path, segments, including=()):
+    """Flatten the `segments` of a composite macro saved at `path` into one EventBuffer.
+
+    `path` doesn't have to exist, so segments can be checked before they
+    are saved: a missing segment raises FileNotFoundError and a segment
+    that leads back to `path` raises MacroFormatError.
+    """
+    including = including + (os.path.abspath(path),)
+    buffer = EventBuffer()
+    start = 0.0
+    for segment in segments:
+        part_path = segment_path(path, segment)
+        if os.path.abspath(part_path) in including:
+            raise MacroFormatError(f"Composite macro '{segment.macro}' includes itself")
+        if part_path.endswith(COMPOSITE_EXTENSION):
+            part = load_composite(part_path, including)
+        else:
+            part = load_events(part_path)
+        start += segment.offset
+        duration = part.duration()
+        for _ in range(segment.repeat):
+            for event in part:
+                event['time'] += start
+                buffer.append(event)
+            start += duration
+    return buffer
+
+
+def load_events(path):
+    """Load a macro file of any supported format into an EventBuffer."""
+    if path.endswith(COMPOSITE_EXTENSION):
+        return load_composite(path)
+    if path.endswith(JSON_EXTENSION):
+        with open(path, 'r') as f:
+            return EventBuffer(json.load(f))
+    return load_binary(path)
+
+
+def save_events(path, events, compression='zlib'):
+    """Save events in the format given by the file extension."""
+    if path.endswith(JSON_EXTENSION):
+        if isinstance(events, EventBuffer):
+            events = events.to_list()
+        with open(path, 'w') as f:
+            json.dump(events, f)
+    else:
+        save_binary(path, events, compression)
+
+
+def macro_path(macro_dir, name, file_format='mrec'):
+    return os.path.join(macro_dir, f"{name}.{file_format}")
+
+
+def find_macro_file(macro_dir, name):
+    """Return the path of a saved macro, whichever format it was saved in."""
+    for extension in MACRO_EXTENSIONS:
+        path = os.path.join(macro_dir, name + extension)
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"No macro named '{name}' in {macro_dir}")
+
+
+def list_macro_names(macro_dir):
+    names = set()
+    if os.path.exists(macro_dir):
+        for file in os.listdir(macro_dir):
+            name, extension = os.path.splitext(file)
+            if extension in MACRO_EXTENSIONS:
+                names.add(name)
+    return sorted(names)
+
+
+def content_hash(path, chunk_size=1 << 20):
+    """Hex digest of a file's bytes; identical macros hash the same whatever they are called."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def find_references(macro_dir, name):
+    """Names of the composite macros in `macro_dir` that use the macro `name` as a segment."""
+    names = []
+    for other in list_macro_names(macro_dir):
+        path = os.path.join(macro_dir, other + COMPOSITE_EXTENSION)
+        if os.path.exists(path) and any(segment.macro == name for segment in read_composite(path)):
+            names.append(other)
+    return names
+
+
+def rename_references(macro_dir, old_name, new_name):
+    """Point every composite that uses `old_name` at `new_name`; returns their names."""
+    renamed = find_references(macro_dir, old_name)
+    for name in renamed:
+        path = os.path.join(macro_dir, name + COMPOSITE_EXTENSION)
+        save_composite(path, [segment._replace(macro=new_name) if segment.macro == old_name else segment
+                              for segment in read_composite(path)])
+    return renamed
+
+
+def deduplicate(macro_dir, dry_run=False):
+    """Replace macros whose files are byte-for-byte copies of another with one-segment composites.
+
+    The copy whose name sorts first is kept. Sidecar files named after a
+    replaced macro's file (e.g. "login.mrec.timing") are renamed to go with
+    its composite. Returns (duplicate, kept) name pairs; keeping an index of
+    the directory up to date is left to the caller.
+    """
+    groups = {}
+    for name in list_macro_names(macro_dir):
+        path = find_macro_file(macro_dir, name)
+        if path.endswith(COMPOSITE_EXTENSION):
+            continue
+        groups.setdefault((os.path.getsize(path), content_hash(path)), []).append((name, path))
+
+    replaced = []
+    for macros in groups.values():
+        kept = macros[0][0]
+        for name, path in macros[1:]:
+            if not dry_run:
+                composite = os.path.join(macro_dir, name + COMPOSITE_EXTENSION)
+                save_composite(composite, [Segment(kept)])
+                os.remove(path)
+                prefix = os.path.basename(path) + '.'
+                for file in os.listdir(macro_dir):
+                    # Other macros can have names starting with this file's name too
+                    if file.startswith(prefix) and os.path.splitext(file)[1] not in MACRO_EXTENSIONS:
+                        os.replace(os.path.join(macro_dir, file), composite + file[len(prefix) - 1:])
+            replaced.append((name, kept))
+    return replaced
@@ -0,0 +1,173 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from event_store import KEYBOARD, MOUSE
+from macro_format import (COMPOSITE_EXTENSION, JSON_EXTENSION, MACRO_EXTENSIONS, iter_event_blocks,
+                          load_composite, read_header)
+
+INDEX_FILENAME = "index.sqlite3"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS macros (
+    name TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    format TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    event_count INTEGER NOT NULL,
+    duration REAL NOT NULL,
+    keyboard_events INTEGER NOT NULL,
+    mouse_events INTEGER NOT NULL,
+    last_played REAL
+)
+"""
+
+# Sort keys offered to the GUI, mapped to SQL ORDER BY expressions
+SORT_COLUMNS = {
+    "name": "name COLLATE NOCASE",
+    "events": "event_count",
+    "duration": "duration",
+    "size": "size",
+    "modified": "mtime_ns",
+    "last played": "last_played",
+}
+
+
+def macro_stats(path):
+    """Count events by device and measure the duration of a macro file.
+
+    Composite macros are measured as of the last time their own file changed.
+    """
+    if path.endswith(COMPOSITE_EXTENSION):
+        events = load_composite(path)
+        return {
+            'event_count': len(events),
+            'duration': events.duration(),
+            'keyboard_events': events.types.count(KEYBOARD),
+            'mouse_events': events.types.count(MOUSE),
+        }
+    if path.endswith(JSON_EXTENSION):
+        with open(path, 'r') as f:
+            events = json.load(f)
+        return {
+            'event_count': len(events),
+            'duration': max((event['time'] for event in events), default=0.0),
+            'keyboard_events': sum(1 for event in events if event['type'] == 'keyboard'),
+            'mouse_events': sum(1 for event in events if event['type'] == 'mouse'),
+        }
+
+    with open(path, 'rb') as f:
+        header = read_header(f)
+    keyboard_events = mouse_events = 0
+    for buffer in iter_event_blocks(path):
+        keyboard_events += buffer.types.count(KEYBOARD)
+        mouse_events += buffer.types.count(MOUSE)
+    return {
+        'event_count': header['event_count'],
+        'duration': header['duration'],
+        'keyboard_events': keyboard_events,
+        'mouse_events': mouse_events,
+    }
+
+
+class MacroIndex:
+    """Persistent SQLite index of the macros directory.
+
+    Files are only re-read when their mtime or size changed since the last
+    refresh, so listing a library of thousands of macros stays cheap.
+    """
+
+    def __init__(self, macro_dir, filename=INDEX_FILENAME):
+        self.macro_dir = macro_dir
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(macro_dir, filename), check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.db:
+            self.db.execute(SCHEMA)
+
+    def _scan(self):
+        # One entry per macro name; the first extension in MACRO_EXTENSIONS wins
+        files = {}
+        priority = {extension: i for i, extension in enumerate(MACRO_EXTENSIONS)}
+        for entry in os.scandir(self.macro_dir):
+            name, extension = os.path.splitext(entry.name)
+            if extension not in priority or not entry.is_file():
+                continue
+            current = files.get(name)
+            if current is None or priority[extension] < priority[os.path.splitext(current.name)[1]]:
+                files[name] = entry
+        return files
+
+    def refresh(self):
+        """Bring the index up to date with the directory; returns the number of changed rows."""
+        files = self._scan()
+        with self.lock:
+            known = {row['name']: (row['path'], row['mtime_ns'], row['size'])
+                     for row in self.db.execute("SELECT name, path, mtime_ns, size FROM macros")}
+        changed = 0
+        for name, entry in files.items():
+            stat = entry.stat()
+            if known.get(name) != (entry.path, stat.st_mtime_ns, stat.st_size):
+                try:
+                    self.update_file(entry.path)
+                except Exception:
+                    continue  # Unreadable macros are simply left out of the index
+                changed += 1
+        removed = [name for name in known if name not in files]
+        with self.lock, self.db:
+            self.db.executemany("DELETE FROM macros WHERE name = ?", [(name,) for name in removed])
+        return changed + len(removed)
+
+    def update_file(self, path):
+        stat = os.stat(path)
+        stats = macro_stats(path)
+        name, extension = os.path.splitext(os.path.basename(path))
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT INTO macros (name, path, format, size, mtime_ns, event_count, duration,"
+                " keyboard_events, mouse_events) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT(name) DO UPDATE SET path = excluded.path, format = excluded.format,"
+                " size = excluded.size, mtime_ns = excluded.mtime_ns, event_count = excluded.event_count,"
+                " duration = excluded.duration, keyboard_events = excluded.keyboard_events,"
+                " mouse_events = excluded.mouse_events",
+                (name, path, extension[1:], stat.st_size, stat.st_mtime_ns, stats['event_count'],
+                 stats['duration'], stats['keyboard_events'], stats['mouse_events']))
+
+    def rename(self, old_name, new_path):
+        new_name = os.path.splitext(os.path.basename(new_path))[0]
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM macros WHERE name = ?", (new_name,))
+            self.db.execute("UPDATE macros SET name = ?, path = ? WHERE name = ?", (new_name, new_path, old_name))
+
+    def remove(self, name):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM macros WHERE name = ?", (name,))
+
+    def mark_played(self, name):
+        with self.lock, self.db:
+            self.db.execute("UPDATE macros SET last_played = ? WHERE name = ?", (time.time(), name))
+
+    def query(self, filter_text="", sort="name", descending=False):
+        """Return index rows whose name contains `filter_text`, sorted by one of SORT_COLUMNS."""
+        order = SORT_COLUMNS[sort] + (" DESC" if descending else "")
+        pattern = "%" + filter_text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        with self.lock:
+            return self.db.execute(
+                f"SELECT * FROM macros WHERE name LIKE ? ESCAPE '\\' ORDER BY {order}, name", (pattern,)
+            ).fetchall()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+def format_macro_row(row):
+    """One-line Listbox label with the cached metadata of a macro."""
+    minutes, seconds = divmod(int(row['duration']), 60)
+    total = row['keyboard_events'] + row['mouse_events']
+    keyboard_share = row['keyboard_events'] / total if total else 0.0
+    return (f"{row['name']}  -  {row['event_count']} events, {minutes}:{seconds:02d}, "
+            f"{keyboard_share:.0%} keyboard / {1 - keyboard_share:.0%} mouse")
@@ -1,129 +1,191 @@
-import keyboard
-import mouse
-import json
 import time
-from pynput.mouse import Controller as MouseController
-from pynput.keyboard import Controller as KeyboardController
 from datetime import datetime
 import os
+from capture_clock import CaptureClock, format_capture_delay
+from event_store import EventBuffer, KEYBOARD, MOUSE
+from input_backend import SystemInputBackend
+from macro_format import load_events, save_events, macro_path
+from macro_stream import MacroStream, open_macro
+from path_simplify import simplify_moves, format_simplify_stats
+from play_range import format_range, load_range
+from recording_journal import RecordingJournal, recover_journals
+from recording_pipeline import RecordingConfig, RecordingPipeline
+from ring_buffer import RingBuffer, RingConsumer
+from playback_plan import PlanCache, PlaybackPlan
+from playback_jobs import JobScheduler, FAILED
+from playback_scheduler import format_drift_report
+from playback_telemetry import PlaybackTelemetry, write_summary, format_telemetry
+from sync_points import SystemConditionProvider
+from timeline_transform import apply_transform, format_transform_report
 
 class MacroRecorder:
-    def __init__(self):
+    def __init__(self, backend=None, conditions=None, macro_dir="macros"):
         self.recording = False
-        self.events = []
-        self.mouse = MouseController()
-        self.keyboard = KeyboardController()
+        self.events = EventBuffer()
+        self.backend = backend if backend is not None else SystemInputBackend()
         self.start_time = None
-        self.macro_dir = "macros"
+        # With macro_dir=None the recorder only plays files: no folder is created and
+        # no journals are recovered, so it can't touch another instance's recording
+        self.macro_dir = macro_dir
+        self.config = RecordingConfig()  # Replace to filter what gets recorded
+        self.journal = None  # On-disk journal of the last recording until it is saved
+
+        # Compiled playback plans, and the injection thread every playback runs on;
+        # sync points are skipped unless a ConditionProvider is given
+        self.plan_cache = PlanCache()
+        self.job_scheduler = JobScheduler(self.backend, conditions=conditions)
+        self.playback_telemetry = True  # Time every injected event during playback
         
+        if self.macro_dir is None:
+            return
+
         # Create macros directory if it doesn't exist
         if not os.path.exists(self.macro_dir):
             os.makedirs(self.macro_dir)
 
+        for filename in recover_journals(self.macro_dir):
+            print(f"Recovered unfinished recording as: {filename}")
+
     def start_recording(self):
         print("Recording started... Press 'Esc' to stop recording.")
         self.recording = True
-        self.events = []
+        self.buffer = EventBuffer()  # Filled by the consumer thread; self.events is replaced on stop
+        self.events = self.buffer
         self.start_time = time.time()
+        self.capture_clock = CaptureClock()
+        if self.journal is not None:
+            self.journal.discard()  # The previous recording was never saved
+        self.journal = RecordingJournal(self.macro_dir)
+        self.pipeline = RecordingPipeline(self.config, self.buffer, self.backend, self.stop_recording)
+
+        # Hook callbacks only queue raw events; a consumer thread stores them
+        self.keyboard_ring = RingBuffer()
+        self.mouse_ring = RingBuffer()
+        self.event_consumer = RingConsumer([self.keyboard_ring, self.mouse_ring], self.process_event)
+        self.event_consumer.start()
         
         # Start listening to events
-        keyboard.hook(self.on_keyboard_event)
-        mouse.hook(self.on_mouse_event)
+        self.keyboard_hook = self.backend.hook_keyboard(self.on_keyboard_event)
+        self.mouse_hook = self.backend.hook_mouse(self.on_mouse_event)
 
     def stop_recording(self):
         self.recording = False
-        keyboard.unhook_all()
-        mouse.unhook_all()
-        print("Recording stopped.")
+        self.backend.unhook_keyboard(self.keyboard_hook)
+        self.backend.unhook_mouse(self.mouse_hook)
+        self.event_consumer.stop()
+        stats = self.event_consumer.stats()
+
+        # The journal now holds the whole recording; play it from disk until it is saved
+        self.journal.close(self.buffer)
+        self.events = MacroStream(self.journal.path)
+        print(f"Recording stopped. {len(self.events)} events recorded, "
+              f"peak queue depth {stats['high_water']}, {stats['overflows']} dropped.")
+        print(f"Timing: {format_capture_delay(self.capture_clock.summary())}")
         return self.events
 
     def on_keyboard_event(self, event):
-        if event.event_type == 'down':
-            if event.name == 'esc' and self.recording:
-                self.stop_recording()
-                return
-            
-            current_time = time.time() - self.start_time
-            self.events.append({
-                'type': 'keyboard',
-                'event': 'press',
-                'key': event.name,
-                'time': current_time
-            })
+        if self.recording:
+            self.keyboard_ring.push((time.perf_counter_ns(), KEYBOARD, event))
 
     def on_mouse_event(self, event):
+        if self.recording:
+            self.mouse_ring.push((time.perf_counter_ns(), MOUSE, event))
+
+    def process_event(self, item):
+        # The stop key calls stop_recording() on this thread, which closes the journal;
+        # events queued behind it in the same batch are dropped
         if not self.recording:
             return
-
-        current_time = time.time() - self.start_time
-        if hasattr(event, 'button'):
-            self.events.append({
-                'type': 'mouse',
-                'event': event.event_type,
-                'button': event.button,
-                'position': (event.x, event.y),
-                'time': current_time
-            })
-        elif hasattr(event, 'x'):
-            self.events.append({
-                'type': 'mouse',
-                'event': 'move',
-                'position': (event.x, event.y),
-                'time': current_time
-            })
-
-    def save_macro(self, name=None):
+        received, _, event = item
+        self.pipeline.process(event, self.capture_clock.timestamp(event, received))
+        if self.recording:
+            self.journal.collect(self.buffer)
+
+    def simplify(self, tolerance=2.0, time_scale=0.0):
+        if isinstance(self.events, MacroStream):
+            self.events = load_events(self.events.path)
+        self.events, stats = simplify_moves(self.events, tolerance, time_scale)
+        print(format_simplify_stats(stats))
+        return stats
+
+    def save_macro(self, name=None, file_format="mrec", compression="zlib"):
         if not name:
             name = datetime.now().strftime("%Y%m%d_%H%M%S")
         
-        filename = os.path.join(self.macro_dir, f"{name}.json")
-        with open(filename, 'w') as f:
-            json.dump(self.events, f)
+        filename = macro_path(self.macro_dir, name, file_format)
+        if self.journal is not None:
+            # Unchanged recordings are moved out of the journal instead of being rewritten
+            streamed = isinstance(self.events, MacroStream)
+            self.journal.save_as(filename, compression, None if streamed else self.events)
+            self.journal = None
+            if streamed:
+                self.events = open_macro(filename)
+        else:
+            save_events(filename, self.events, compression)
         print(f"Macro saved as: {filename}")
         return filename
 
     def load_macro(self, filename):
-        with open(filename, 'r') as f:
-            self.events = json.load(f)
+        if self.journal is not None:
+            self.journal.discard()
+            self.journal = None
+        self.events = load_events(filename)
         return self.events
 
-    def play_macro(self, events=None):
+    def play_file(self, filename, playback_speed=1.0, transform=None, play_range=None, **options):
+        if play_range:
+            # Only the blocks of the range are decoded; the plan is compiled for this run alone
+            events = load_range(filename, play_range)
+            print(f"Playing {format_range(play_range)} ({len(events)} events)")
+            steps = PlaybackPlan.compile(events, playback_speed)
+        else:
+            # Compiled plans are cached per file content and speed; macros too large
+            # to cache are streamed from disk and compiled on the fly
+            steps = self.plan_cache.steps_for(filename, open_macro, playback_speed)
+        if transform:
+            # A TimelineTransform is applied to the whole plan once, before playback starts
+            steps, transform_report = apply_transform(steps, transform, playback_speed)
+            print(format_transform_report(transform_report, options.get('repeat_count', 1),
+                                          options.get('loop_playback', False)))
+        report, telemetry = self.play_steps(steps, **options)
+        if telemetry is not None:
+            summary = write_summary(filename, telemetry, report, playback_speed)
+            print(f"Playback timing: {format_telemetry(summary)}")
+
+    def play_macro(self, events=None, playback_speed=1.0, **options):
         if events is None:
             events = self.events
-        
-        if not events:
+        self.play_steps(PlaybackPlan.compile(events, playback_speed), **options)
+
+    def play_steps(self, steps, repeat_count=1, repeat_delay=0.0, loop_playback=False, token=None):
+        if not len(steps):
             print("No events to play!")
-            return
+            return None, None
 
+        # The run is scheduled against absolute deadlines on the shared injection
+        # thread; cancelling `token` stops it, loops included
         print("Playing macro in 3 seconds...")
-        time.sleep(3)
-        
-        last_time = 0
-        for event in events:
-            # Wait for the appropriate time
-            time_to_wait = event['time'] - last_time
-            if time_to_wait > 0:
-                time.sleep(time_to_wait)
-            
-            if event['type'] == 'keyboard':
-                if event['event'] == 'press':
-                    keyboard.press(event['key'])
-                    keyboard.release(event['key'])
-            
-            elif event['type'] == 'mouse':
-                if event['event'] == 'move':
-                    self.mouse.position = event['position']
-                elif event['event'] == 'click':
-                    mouse.move(event['position'][0], event['position'][1])
-                    mouse.click(event['button'])
-                elif event['event'] == 'double click':
-                    mouse.move(event['position'][0], event['position'][1])
-                    mouse.double_click(event['button'])
-            
-            last_time = event['time']
+        telemetry = PlaybackTelemetry() if self.playback_telemetry else None
+        job = self.job_scheduler.play(steps, repeat_count=repeat_count, repeat_delay=repeat_delay,
+                                      loop_playback=loop_playback, token=token, telemetry=telemetry,
+                                      start_delay=3.0)
+        try:
+            while not job.wait(0.1):  # Short waits so Ctrl+C can interrupt
+                pass
+        except KeyboardInterrupt:
+            job.stop()
+            print("Playback cancelled.")
+
+        report = job.report()
+        if job.state == FAILED:
+            print(f"Playback failed: {job.error}")
+        print(f"Playback finished: {format_drift_report(report)}")
+        if report['syncs']:
+            print(f"Waited {report['sync_wait']:.1f} s at {report['syncs']} sync points")
+        return report, telemetry
 
 def main():
-    recorder = MacroRecorder()
+    recorder = MacroRecorder(conditions=SystemConditionProvider())
     print("Macro Recorder")
     print("Press 'F7' to start recording")
     print("Press 'F8' to play last recorded macro")
@@ -145,11 +207,11 @@ def main():
         else:
             print("No macro recorded yet!")
 
-    keyboard.add_hotkey('f7', on_f7)
-    keyboard.add_hotkey('f8', on_f8)
-    keyboard.add_hotkey('f9', on_f9)
+    recorder.backend.add_hotkey('f7', on_f7)
+    recorder.backend.add_hotkey('f8', on_f8)
+    recorder.backend.add_hotkey('f9', on_f9)
 
-    keyboard.wait('ctrl+q')
+    recorder.backend.wait('ctrl+q')
     print("Program terminated.")
 
 if __name__ == "__main__":
@@ -1,46 +1,81 @@
+from startup_timing import StartupTimer  # First, so startup timing covers every other import
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
-from ttkthemes import ThemedTk
 import json
 import os
-import keyboard
-import mouse
 import time
-from pynput.mouse import Controller as MouseController
-from pynput.keyboard import Controller as KeyboardController
 from datetime import datetime
 import threading
-import pystray
-from PIL import Image, ImageDraw
-import win32gui
-import win32con
+from capture_clock import CaptureClock, format_capture_delay
+from event_store import EventBuffer, KEYBOARD, MOUSE
+from input_backend import SystemInputBackend
+from macro_format import COMPRESSIONS, load_events, save_events, macro_path, find_macro_file, find_references, rename_references
+from macro_index import MacroIndex, SORT_COLUMNS, format_macro_row
+from hotkey_registry import HotkeyRegistry
+from macro_stream import open_macro
+from progress_channel import ProgressChannel, format_clock
+from recording_journal import RecordingJournal, recover_journals
+from recording_pipeline import RecordingConfig, RecordingPipeline
+from replay_buffer import ReplayCapture
+from ring_buffer import RingBuffer, RingConsumer
+from sync_points import SystemConditionProvider
+from play_range import PlayRange, format_range, load_range
+from playback_plan import PlanCache, PlaybackPlan
+from playback_jobs import JobScheduler, PlaybackJob, PENDING, PAUSED, CANCELLED, FAILED
+from playback_scheduler import timeline_duration, format_drift_report
+from playback_telemetry import PlaybackTelemetry, telemetry_path, write_summary, format_telemetry
 
 class MacroRecorderGUI:
-    def __init__(self):
-        self.root = ThemedTk(theme="arc")
+    def __init__(self, backend=None):
+        # Only what the first paint needs is loaded up front; the theme, the tray icon
+        # and the settings tab follow once the window is on screen
+        self.startup = StartupTimer()
+        self.startup.mark("imports")
+        self.root = tk.Tk()
         self.root.title("Macro Recorder")
         self.root.geometry("480x640")
         
+        # Worker, hook and tray threads never touch Tk directly; they post here
+        self.progress = ProgressChannel(self.root)
+        
         # Store the window state
         self.is_minimized = False
         
         # Initialize recorder variables
         self.recording = False
-        self.events = []
-        self.mouse = MouseController()
-        self.keyboard = KeyboardController()
+        self.events = EventBuffer()
+        self.backend = backend if backend is not None else SystemInputBackend()
         self.start_time = None
         self.macro_dir = "macros"
         
-        # System tray icon
+        # Extra FilterStage objects applied to every recording (e.g. RegionOfInterest, KeyAllowlist)
+        self.recording_stages = []
+        
+        # Compiled playback plans, and one injection thread shared by every running macro;
+        # nothing is injected while recording. Sync points in macros wait for the real desktop
+        self.plan_cache = PlanCache()
+        self.job_scheduler = JobScheduler(self.backend, active=lambda: not self.recording,
+                                          conditions=SystemConditionProvider())
+        self.progress_job = None  # The job shown in the progress bar
+        
+        # Global hotkeys stay registered for the app's lifetime; recording hooks come and go on their own
+        self.keyboard_hook = None
+        self.mouse_hook = None
+        
+        # Always-on capture of the last few minutes of input, if enabled in the settings
+        self.replay = None
+        
+        # System tray icon, started after the first paint, and its image per recording state
         self.icon = None
-        self.setup_system_tray()
+        self.tray_images = {}
         
         # Default hotkeys
         self.default_hotkeys = {
             "start_recording": "f7",
             "stop_recording": "esc",
-            "play_macro": "f8"
+            "play_macro": "f8",
+            "stop_playback": "f10",
+            "save_replay": "f9"
         }
         
         # Default recording settings
@@ -51,29 +86,74 @@ class MacroRecorderGUI:
             "record_mouse_clicks": True,
             "record_mouse_scroll": True,
             "minimum_mouse_movement": 5,  # Minimum pixels between recorded mouse movements
+            "simplify_tolerance": 0.0,  # Max pixel error for post-recording path simplification (0 = off)
             "minimize_to_tray": True,  # New setting for system tray behavior
-            "loop_playback": False  # New setting for loop playback
+            "loop_playback": False,  # New setting for loop playback
+            "playback_telemetry": True,  # Time every injected event and write a summary next to the macro
+            "max_idle_gap": 0.0,  # Longest pause replayed, in seconds (0 = off)
+            "trim_dead_time": False,  # Skip the wait before the first step and cursor moves after the last action
+            "retime": [],  # [start, end, speed] spans of the recording to play faster or slower
+            "speed_curve": [],  # [time, speed] points; the speed between them is interpolated
+            "replay_buffer_minutes": 0,  # Always keep the last this many minutes of input, to save with a hotkey (0 = off)
+            "replay_buffer_events": 200000,  # Most events the replay buffer holds; its memory is allocated up front
+            "save_format": "mrec",  # "mrec" (binary) or "json"
+            "compression": "zlib"  # Block compression for binary macros: "none", "zlib" or "lzma"
         }
         
         # Load or create settings
         self.load_settings()
+        self.startup.mark("settings")
         
         # Create macros directory if it doesn't exist
         if not os.path.exists(self.macro_dir):
             os.makedirs(self.macro_dir)
         
+        # Recordings interrupted by a crash are saved as "recovered_<timestamp>" macros
+        recovered = recover_journals(self.macro_dir)
+        
+        # Metadata index of the macros directory, and the names shown in the list
+        self.macro_index = MacroIndex(self.macro_dir)
+        self.macro_names = []
+        self.populate_generation = 0
+        
         self.create_gui()
+        self.setup_global_hotkeys()
+        self.startup.mark("window")
         self.load_macro_list()
+        self.startup.mark("macro list")
+        if recovered:
+            self.status_label.config(text=f"Recovered {len(recovered)} unfinished recording(s)")
+        
+        # Live recording and playback readouts, at most one update per drain interval
+        self.progress.subscribe('recording', self._show_recording_progress)
+        self.progress.subscribe('playback', self._show_playback_progress)
+        self.progress.start()
         
         # Bind window events
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
         self.root.bind("<Configure>", self.on_window_configure)
         
+        # Idle callbacks run in order, so this one runs after the widgets above are drawn
+        self.root.after_idle(self.on_first_paint)
+        
+    def on_first_paint(self):
+        self.startup.mark("first paint")
+        if os.environ.get("MACROREC_STARTUP_TIMING"):
+            print(self.startup.format())
+        
+        # ttkthemes pulls in PIL and the theme's images, so it is applied after the first paint
+        from ttkthemes import ThemedStyle
+        ThemedStyle(self.root).set_theme("arc")
+        
+        tray_thread = threading.Thread(target=self.run_system_tray, name="tray")
+        tray_thread.daemon = True
+        tray_thread.start()
+        self.update_replay_capture()
+        
     def on_window_configure(self, event=None):
         # Check if this is actually a minimize event
         if event and event.widget == self.root:
-            current_state = win32gui.GetWindowState(self.root.winfo_id())
-            is_minimized = current_state == win32con.SW_SHOWMINIMIZED
+            is_minimized = self.root.state() == 'iconic'
             
             if is_minimized and not self.is_minimized:
                 self.is_minimized = True
@@ -82,33 +162,41 @@ class MacroRecorderGUI:
             elif not is_minimized:
                 self.is_minimized = False
     
-    def create_tray_icon(self):
+    def create_tray_icon(self, recording):
+        from PIL import Image, ImageDraw
+        
         # Create a simple square icon
         icon_size = 64
         image = Image.new('RGB', (icon_size, icon_size), color='white')
         draw = ImageDraw.Draw(image)
         
         # Draw a red circle when recording, otherwise blue
-        color = 'red' if self.recording else 'blue'
+        color = 'red' if recording else 'blue'
         margin = 4
         draw.ellipse([margin, margin, icon_size - margin, icon_size - margin], fill=color)
         
         return image
     
-    def setup_system_tray(self):
+    def run_system_tray(self):
+        # Runs on the tray thread; both icon images are drawn once here and reused
+        import pystray
+        
+        self.tray_images = {recording: self.create_tray_icon(recording) for recording in (False, True)}
         menu = (
-            pystray.MenuItem("Show", self.show_window),
-            pystray.MenuItem("Start Recording", self.start_recording),
-            pystray.MenuItem("Stop Recording", self.stop_recording),
+            pystray.MenuItem("Show", lambda: self.progress.post(self.show_window)),
+            pystray.MenuItem("Start Recording", lambda: self.progress.post(self.start_recording)),
+            pystray.MenuItem("Stop Recording", lambda: self.progress.post(self.stop_recording)),
+            pystray.MenuItem("Save Replay", lambda: self.progress.post(self.save_replay)),
             pystray.Menu.SEPARATOR,
-            pystray.MenuItem("Exit", self.quit_app)
+            pystray.MenuItem("Exit", lambda: self.progress.post(self.quit_app))
         )
         
-        self.icon = pystray.Icon("macro_recorder", self.create_tray_icon(), "Macro Recorder", menu)
+        self.icon = pystray.Icon("macro_recorder", self.tray_images[self.recording], "Macro Recorder", menu)
+        self.icon.run()
         
     def update_tray_icon(self):
         if self.icon:
-            self.icon.icon = self.create_tray_icon()
+            self.icon.icon = self.tray_images[self.recording]
     
     def show_window(self, icon=None, item=None):
         self.root.deiconify()
@@ -123,7 +211,11 @@ class MacroRecorderGUI:
             self.quit_app()
     
     def quit_app(self, icon=None):
-        self.icon.stop()
+        self.job_scheduler.shutdown()
+        if self.replay is not None:
+            self.replay.stop()
+        if self.icon:
+            self.icon.stop()
         self.root.quit()
     
     def load_settings(self):
@@ -136,6 +228,8 @@ class MacroRecorderGUI:
                 for key, value in self.default_recording_settings.items():
                     if key not in self.settings["recording"]:
                         self.settings["recording"][key] = value
+                for key, value in self.default_hotkeys.items():
+                    self.settings["hotkeys"].setdefault(key, value)
         except FileNotFoundError:
             self.settings = {
                 "hotkeys": self.default_hotkeys.copy(),
@@ -166,6 +260,11 @@ class MacroRecorderGUI:
         self.status_label = ttk.Label(status_frame, text="Ready")
         self.status_label.pack(padx=5, pady=5)
         
+        self.progress_bar = ttk.Progressbar(status_frame, mode='determinate', maximum=100)
+        self.progress_bar.pack(fill='x', padx=5)
+        self.progress_label = ttk.Label(status_frame, text="")
+        self.progress_label.pack(padx=5, pady=(0, 5))
+        
         # Control frame
         control_frame = ttk.LabelFrame(self.main_frame, text="Controls")
         control_frame.pack(fill='x', padx=5, pady=5)
@@ -175,10 +274,54 @@ class MacroRecorderGUI:
         ttk.Button(control_frame, text="Play Selected", command=self.play_selected_macro).pack(side='left', padx=5, pady=5)
         ttk.Button(control_frame, text="Minimize to Tray", command=self.hide_window).pack(side='right', padx=5, pady=5)
         
+        # Playback job controls; they act on the selected macro's runs, or on all runs if it has none
+        playback_frame = ttk.LabelFrame(self.main_frame, text="Playback")
+        playback_frame.pack(fill='x', padx=5, pady=5)
+        
+        job_row = ttk.Frame(playback_frame)
+        job_row.pack(fill='x')
+        ttk.Button(job_row, text="Pause", command=lambda: self.control_jobs('pause')).pack(side='left', padx=5, pady=5)
+        ttk.Button(job_row, text="Resume", command=lambda: self.control_jobs('resume')).pack(side='left', padx=5, pady=5)
+        ttk.Button(job_row, text="Stop", command=lambda: self.control_jobs('stop')).pack(side='left', padx=5, pady=5)
+        self.jobs_label = ttk.Label(job_row, text="No macros playing")
+        self.jobs_label.pack(side='left', padx=5, pady=5)
+        
+        # Optional time range of the recording to play; empty fields play from the start or to the end
+        range_row = ttk.Frame(playback_frame)
+        range_row.pack(fill='x')
+        ttk.Label(range_row, text="Play from (s):").pack(side='left', padx=5, pady=(0, 5))
+        self.range_start_var = tk.StringVar()
+        ttk.Entry(range_row, textvariable=self.range_start_var, width=8).pack(side='left', pady=(0, 5))
+        ttk.Label(range_row, text="to (s):").pack(side='left', padx=5, pady=(0, 5))
+        self.range_end_var = tk.StringVar()
+        ttk.Entry(range_row, textvariable=self.range_end_var, width=8).pack(side='left', pady=(0, 5))
+        self.restore_cursor_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(range_row, text="Restore cursor", variable=self.restore_cursor_var).pack(side='left', padx=5, pady=(0, 5))
+        
         # Macro list frame
         list_frame = ttk.LabelFrame(self.main_frame, text="Saved Macros")
         list_frame.pack(fill='both', expand=True, padx=5, pady=5)
         
+        # Filter and sort controls
+        filter_frame = ttk.Frame(list_frame)
+        filter_frame.pack(side='top', fill='x', padx=5, pady=5)
+        
+        ttk.Label(filter_frame, text="Filter:").pack(side='left')
+        self.filter_var = tk.StringVar()
+        self.filter_var.trace_add("write", lambda *args: self.populate_macro_list())
+        ttk.Entry(filter_frame, textvariable=self.filter_var, width=15).pack(side='left', padx=5)
+        
+        ttk.Label(filter_frame, text="Sort:").pack(side='left')
+        self.sort_var = tk.StringVar(value="name")
+        sort_box = ttk.Combobox(filter_frame, textvariable=self.sort_var, values=tuple(SORT_COLUMNS),
+                                state="readonly", width=10)
+        sort_box.pack(side='left', padx=5)
+        sort_box.bind("<<ComboboxSelected>>", lambda e: self.populate_macro_list())
+        
+        self.sort_descending_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(filter_frame, text="Desc", variable=self.sort_descending_var,
+                        command=self.populate_macro_list).pack(side='left')
+        
         # Add scrollbar to macro list
         scrollbar = ttk.Scrollbar(list_frame)
         scrollbar.pack(side='right', fill='y')
@@ -195,10 +338,18 @@ class MacroRecorderGUI:
         ttk.Button(list_button_frame, text="Delete", command=self.delete_macro).pack(side='left', padx=5)
         ttk.Button(list_button_frame, text="Refresh", command=self.load_macro_list).pack(side='left', padx=5)
         
-        # Settings tab
+        # Settings tab; its widgets are only built the first time it is opened
         self.settings_frame = ttk.Frame(self.notebook)
         self.notebook.add(self.settings_frame, text='Settings')
-        
+        self.settings_built = False
+        self.notebook.bind("<<NotebookTabChanged>>", self.on_tab_changed)
+    
+    def on_tab_changed(self, event=None):
+        if not self.settings_built and self.notebook.select() == str(self.settings_frame):
+            self.settings_built = True
+            self.create_settings_tab()
+    
+    def create_settings_tab(self):
         # Initialize recording_vars dictionary
         self.recording_vars = {}
         
@@ -262,6 +413,39 @@ class MacroRecorderGUI:
         self.recording_vars["minimum_mouse_movement"] = tk.StringVar(value=str(self.settings["recording"]["minimum_mouse_movement"]))
         ttk.Entry(threshold_frame, textvariable=self.recording_vars["minimum_mouse_movement"], width=5).pack(side='left', padx=5)
         
+        # Path simplification tolerance
+        simplify_frame = ttk.Frame(recording_frame)
+        simplify_frame.pack(fill='x', padx=5, pady=5)
+        
+        ttk.Label(simplify_frame, text="Path Simplification (px, 0 = off):").pack(side='left')
+        self.recording_vars["simplify_tolerance"] = tk.StringVar(value=str(self.settings["recording"]["simplify_tolerance"]))
+        ttk.Entry(simplify_frame, textvariable=self.recording_vars["simplify_tolerance"], width=5).pack(side='left', padx=5)
+        
+        # Always-on replay buffer
+        replay_frame = ttk.Frame(recording_frame)
+        replay_frame.pack(fill='x', padx=5, pady=5)
+        
+        ttk.Label(replay_frame, text="Replay Buffer (min, 0 = off):").pack(side='left')
+        self.recording_vars["replay_buffer_minutes"] = tk.StringVar(value=str(self.settings["recording"]["replay_buffer_minutes"]))
+        ttk.Entry(replay_frame, textvariable=self.recording_vars["replay_buffer_minutes"], width=5).pack(side='left', padx=5)
+        ttk.Label(replay_frame, text="Max Events:").pack(side='left')
+        self.recording_vars["replay_buffer_events"] = tk.StringVar(value=str(self.settings["recording"]["replay_buffer_events"]))
+        ttk.Entry(replay_frame, textvariable=self.recording_vars["replay_buffer_events"], width=8).pack(side='left', padx=5)
+        
+        # Macro file format
+        format_frame = ttk.Frame(recording_frame)
+        format_frame.pack(fill='x', padx=5, pady=5)
+        
+        ttk.Label(format_frame, text="Save Format:").pack(side='left')
+        self.recording_vars["save_format"] = tk.StringVar(value=self.settings["recording"]["save_format"])
+        ttk.Combobox(format_frame, textvariable=self.recording_vars["save_format"], values=("mrec", "json"),
+                     state="readonly", width=6).pack(side='left', padx=5)
+        
+        ttk.Label(format_frame, text="Compression:").pack(side='left')
+        self.recording_vars["compression"] = tk.StringVar(value=self.settings["recording"]["compression"])
+        ttk.Combobox(format_frame, textvariable=self.recording_vars["compression"], values=tuple(COMPRESSIONS),
+                     state="readonly", width=6).pack(side='left', padx=5)
+        
         # System tray settings
         self.recording_vars["minimize_to_tray"] = tk.BooleanVar(value=self.settings["recording"].get("minimize_to_tray", True))
         ttk.Checkbutton(recording_frame, text="Minimize to System Tray", 
@@ -308,26 +492,48 @@ class MacroRecorderGUI:
         ttk.Checkbutton(playback_frame, text="Loop Playback", 
                        variable=self.loop_playback_var).pack(anchor='w', padx=5, pady=5)
         
+        self.playback_telemetry_var = tk.BooleanVar(value=self.settings["recording"].get("playback_telemetry", True))
+        ttk.Checkbutton(playback_frame, text="Record Playback Timing",
+                       variable=self.playback_telemetry_var).pack(anchor='w', padx=5, pady=5)
+        
+        # Timeline edits applied to the macro before it plays
+        ttk.Label(settings_grid, text="Max Idle Gap (s, 0 = off):").grid(row=3, column=0, padx=5, pady=2)
+        self.max_idle_gap_var = tk.StringVar(value=str(self.settings["recording"]["max_idle_gap"]))
+        ttk.Entry(settings_grid, textvariable=self.max_idle_gap_var, width=5).grid(row=3, column=1, padx=5, pady=2)
+        
+        self.trim_dead_time_var = tk.BooleanVar(value=self.settings["recording"]["trim_dead_time"])
+        ttk.Checkbutton(playback_frame, text="Trim Dead Time",
+                       variable=self.trim_dead_time_var).pack(anchor='w', padx=5, pady=5)
+        
         # Save settings button
         ttk.Button(scrollable_frame, text="Save Settings", command=self.save_current_settings).grid(row=3, column=0, pady=10)
-        
-        # Set up global hotkeys
-        self.setup_global_hotkeys()
     
     def setup_global_hotkeys(self):
-        for key, hotkey in self.settings["hotkeys"].items():
-            if key == "start_recording":
-                keyboard.add_hotkey(hotkey, self.start_recording)
-            elif key == "stop_recording":
-                keyboard.add_hotkey(hotkey, self.stop_recording)
-            elif key == "play_macro":
-                keyboard.add_hotkey(hotkey, self.play_selected_macro)
+        # Hotkey callbacks run on the keyboard hook thread, so hand them to the main loop
+        self.hotkeys = HotkeyRegistry(self.backend, {
+            "start_recording": lambda: self.progress.post(self.start_recording),
+            "stop_recording": lambda: self.progress.post(self.stop_recording),
+            "play_macro": lambda: self.progress.post(self.play_selected_macro),
+            "stop_playback": self.job_scheduler.stop_all,
+            "save_replay": lambda: self.progress.post(self.save_replay),
+        })
+        self.apply_hotkeys()
+    
+    def apply_hotkeys(self):
+        """Re-register the hotkeys that changed in the settings; returns False if any was refused."""
+        failures = self.hotkeys.apply(self.settings["hotkeys"])
+        for action, hotkey, error in failures:
+            self.settings["hotkeys"][action] = self.hotkeys.hotkey(action) or ""
+        if failures:
+            names = ", ".join(f"'{hotkey}'" for _, hotkey, _ in failures)
+            messagebox.showwarning("Warning", f"Invalid hotkey {names}, keeping the previous one")
+        return not failures
     
     def set_hotkey(self, key):
         self.status_label.config(text=f"Press new hotkey for {key}...")
         self.root.update()
         
-        new_hotkey = keyboard.read_event(suppress=True).name
+        new_hotkey = self.backend.read_key_name()
         self.hotkey_vars[key].set(new_hotkey)
         self.status_label.config(text="Ready")
     
@@ -341,52 +547,95 @@ class MacroRecorderGUI:
         for key, var in self.recording_vars.items():
             if isinstance(var, tk.BooleanVar):
                 self.settings["recording"][key] = var.get()
+            elif isinstance(self.default_recording_settings[key], str):
+                self.settings["recording"][key] = var.get()
+            elif isinstance(self.default_recording_settings[key], float):
+                self.settings["recording"][key] = float(var.get())
             else:
                 self.settings["recording"][key] = int(var.get())
         
         # Update loop playback setting
         self.settings["recording"]["loop_playback"] = self.loop_playback_var.get()
-        
+        self.settings["recording"]["playback_telemetry"] = self.playback_telemetry_var.get()
+        self.settings["recording"]["max_idle_gap"] = float(self.max_idle_gap_var.get())
+        self.settings["recording"]["trim_dead_time"] = self.trim_dead_time_var.get()
+        for key, var in self.hotkey_vars.items():
+            self.settings["hotkeys"][key] = var.get().strip()
+        
+        # Only hotkeys that changed are re-registered; refused ones keep their previous key
+        if not self.apply_hotkeys():
+            for key, var in self.hotkey_vars.items():
+                var.set(self.settings["hotkeys"][key])
+        self.update_replay_capture()
         self.save_settings()
         
-        # Refresh hotkeys
-        keyboard.unhook_all()
-        self.setup_global_hotkeys()
-        
         messagebox.showinfo("Success", "Settings saved successfully!")
     
     def load_macro_list(self):
+        # Only files whose mtime or size changed are re-read into the index
+        self.macro_index.refresh()
+        self.populate_macro_list()
+    
+    def populate_macro_list(self):
+        rows = self.macro_index.query(self.filter_var.get(), self.sort_var.get(), self.sort_descending_var.get())
+        self.macro_names = [row['name'] for row in rows]
         self.macro_list.delete(0, tk.END)
-        if os.path.exists(self.macro_dir):
-            for file in os.listdir(self.macro_dir):
-                if file.endswith('.json'):
-                    self.macro_list.insert(tk.END, file[:-5])
+        
+        # Fill the Listbox in small chunks so thousands of macros don't block the UI;
+        # a newer populate call cancels the chunks still pending from an older one
+        self.populate_generation += 1
+        self._populate_chunk(rows, 0, self.populate_generation)
     
-    def rename_macro(self):
+    def _populate_chunk(self, rows, start, generation, chunk_size=200):
+        if generation != self.populate_generation:
+            return
+        for row in rows[start:start + chunk_size]:
+            self.macro_list.insert(tk.END, format_macro_row(row))
+        if start + chunk_size < len(rows):
+            self.root.after(1, self._populate_chunk, rows, start + chunk_size, generation, chunk_size)
+    
+    def selected_macro_name(self):
         selection = self.macro_list.curselection()
         if not selection:
+            return None
+        return self.macro_names[selection[0]]
+    
+    def rename_macro(self):
+        old_name = self.selected_macro_name()
+        if old_name is None:
             messagebox.showwarning("Warning", "Please select a macro to rename")
             return
         
-        old_name = self.macro_list.get(selection[0])
         new_name = tk.simpledialog.askstring("Rename Macro", "Enter new name:", initialvalue=old_name)
         
         if new_name:
-            old_path = os.path.join(self.macro_dir, f"{old_name}.json")
-            new_path = os.path.join(self.macro_dir, f"{new_name}.json")
+            old_path = find_macro_file(self.macro_dir, old_name)
+            new_path = os.path.join(self.macro_dir, new_name + os.path.splitext(old_path)[1])
             os.rename(old_path, new_path)
-            self.load_macro_list()
+            if os.path.exists(telemetry_path(old_path)):
+                os.replace(telemetry_path(old_path), telemetry_path(new_path))
+            self.macro_index.rename(old_name, new_path)
+            # Composite macros refer to their segments by name
+            rename_references(self.macro_dir, old_name, new_name)
+            self.populate_macro_list()
     
     def delete_macro(self):
-        selection = self.macro_list.curselection()
-        if not selection:
+        macro_name = self.selected_macro_name()
+        if macro_name is None:
             messagebox.showwarning("Warning", "Please select a macro to delete")
             return
         
-        if messagebox.askyesno("Confirm Delete", "Are you sure you want to delete this macro?"):
-            macro_name = self.macro_list.get(selection[0])
-            os.remove(os.path.join(self.macro_dir, f"{macro_name}.json"))
-            self.load_macro_list()
+        message = "Are you sure you want to delete this macro?"
+        users = find_references(self.macro_dir, macro_name)
+        if users:
+            message += f"\n\nIt is a segment of {', '.join(users)}, which will no longer play."
+        if messagebox.askyesno("Confirm Delete", message):
+            path = find_macro_file(self.macro_dir, macro_name)
+            os.remove(path)
+            if os.path.exists(telemetry_path(path)):
+                os.remove(telemetry_path(path))
+            self.macro_index.remove(macro_name)
+            self.populate_macro_list()
     
     def start_recording(self, icon=None):
         if not self.settings["recording"]["record_keyboard"] and not self.settings["recording"]["record_mouse"]:
@@ -394,10 +643,30 @@ class MacroRecorderGUI:
             return
             
         self.recording = True
-        self.events = []
+        self.events = EventBuffer()
         self.start_time = time.time()
+        self.capture_clock = CaptureClock()
         self.status_label.config(text="Recording...")
-        self.last_mouse_pos = None
+        
+        # Full blocks of events go to an on-disk journal as they are recorded, so
+        # memory stays bounded and a crash loses at most the last partial block
+        self.journal = RecordingJournal(self.macro_dir, self.settings["recording"]["compression"])
+        
+        # Settings are frozen for the whole recording and compiled into per-event-class handlers
+        self.recording_config = RecordingConfig.from_settings(
+            self.settings["recording"], self.settings["hotkeys"]["stop_recording"], self.recording_stages)
+        self.pipeline = RecordingPipeline(self.recording_config, self.events, self.backend,
+                                          lambda: self.progress.post(self.stop_recording))
+        self.recording_rate = (self.start_time, 0)
+        self.progress_bar.config(mode='indeterminate')
+        self.progress_bar.start()
+        
+        # Hook callbacks only push raw (perf_counter_ns, source, event) tuples into these rings;
+        # the consumer thread does all filtering and storage off the hook threads
+        self.keyboard_ring = RingBuffer()
+        self.mouse_ring = RingBuffer()
+        self.event_consumer = RingConsumer([self.keyboard_ring, self.mouse_ring], self._process_event)
+        self.event_consumer.start()
         
         # Update tray icon to show recording state
         self.update_tray_icon()
@@ -408,17 +677,54 @@ class MacroRecorderGUI:
         self.record_thread.start()
     
     def _record(self):
-        if self.settings["recording"]["record_keyboard"]:
-            keyboard.hook(self.on_keyboard_event)
-        if self.settings["recording"]["record_mouse"]:
-            mouse.hook(self.on_mouse_event)
+        if self.recording_config.record_keyboard:
+            self.keyboard_hook = self.backend.hook_keyboard(self.on_keyboard_event)
+        if self.recording_config.record_mouse:
+            self.mouse_hook = self.backend.hook_mouse(self.on_mouse_event)
+    
+    def _unhook_recording(self):
+        # Only the recording hooks are removed; the global hotkeys stay registered
+        self.record_thread.join()
+        if self.keyboard_hook is not None:
+            self.backend.unhook_keyboard(self.keyboard_hook)
+            self.keyboard_hook = None
+        if self.mouse_hook is not None:
+            self.backend.unhook_mouse(self.mouse_hook)
+            self.mouse_hook = None
     
     def stop_recording(self, icon=None):
         if self.recording:
             self.recording = False
-            keyboard.unhook_all()
-            mouse.unhook_all()
-            self.status_label.config(text="Recording stopped")
+            self._unhook_recording()
+            self.progress_bar.stop()
+            self.progress_bar.config(mode='determinate', value=0)
+            self.progress_label.config(text="")
+            
+            # Store whatever the hooks queued before they were removed
+            self.event_consumer.stop()
+            stats = self.event_consumer.stats()
+            try:
+                self.journal.close(self.events)
+            except OSError as e:
+                messagebox.showerror("Error", f"Failed to write recording: {str(e)}")
+                self.journal.discard()
+                self.update_tray_icon()
+                return
+            event_count = self.journal.event_count()
+            status = f"Recording stopped ({event_count} events"
+            if stats['overflows']:
+                status += f", {stats['overflows']} dropped"
+            status += f", {format_capture_delay(self.capture_clock.summary())})"
+            
+            # Drop nearly collinear mouse moves, keeping clicks and scrolls in place;
+            # only then does the recording have to be loaded back from the journal
+            self.events = None
+            tolerance = self.settings["recording"]["simplify_tolerance"]
+            if tolerance > 0 and event_count:
+                from path_simplify import simplify_moves, format_simplify_stats  # NumPy is only needed here
+                self.events, simplify_stats = simplify_moves(load_events(self.journal.path), tolerance)
+                status += f" - {format_simplify_stats(simplify_stats)}"
+            self.status_label.config(text=status)
             
             # Update tray icon to show stopped state
             self.update_tray_icon()
@@ -428,147 +734,244 @@ class MacroRecorderGUI:
             name = tk.simpledialog.askstring("Save Macro", "Enter macro name:")
             if name:
                 self.save_macro(name)
-                self.load_macro_list()
-            
-            # Restore hotkeys
-            self.setup_global_hotkeys()
+                self.populate_macro_list()
+            else:
+                self.journal.discard()
+            self.events = EventBuffer()
     
     def on_keyboard_event(self, event):
-        if event.event_type == 'down':
-            if event.name == self.settings["hotkeys"]["stop_recording"] and self.recording:
-                self.stop_recording()
-                return
-            
-            current_time = time.time() - self.start_time
-            self.events.append({
-                'type': 'keyboard',
-                'event': 'press',
-                'key': event.name,
-                'time': current_time
-            })
+        if self.recording:
+            self.keyboard_ring.push((time.perf_counter_ns(), KEYBOARD, event))
     
     def on_mouse_event(self, event):
+        if self.recording:
+            self.mouse_ring.push((time.perf_counter_ns(), MOUSE, event))
+    
+    def _process_event(self, item):
+        received, _, event = item
+        self.pipeline.process(event, self.capture_clock.timestamp(event, received))
+        self.journal.collect(self.events)
+        self.progress.publish('recording', self.journal.event_count(self.events))
+    
+    def _show_recording_progress(self, count):
         if not self.recording:
             return
-        
-        current_time = time.time() - self.start_time
-        
-        # Handle mouse clicks
-        if hasattr(event, 'button') and self.settings["recording"]["record_mouse_clicks"]:
-            self.events.append({
-                'type': 'mouse',
-                'event': event.event_type,
-                'button': event.button,
-                'position': (event.x, event.y),
-                'time': current_time
-            })
-        
-        # Handle mouse movement
-        elif hasattr(event, 'x') and self.settings["recording"]["record_mouse_movement"]:
-            # Check if movement exceeds minimum threshold
-            if self.last_mouse_pos is None:
-                self.last_mouse_pos = (event.x, event.y)
-            else:
-                dx = event.x - self.last_mouse_pos[0]
-                dy = event.y - self.last_mouse_pos[1]
-                distance = (dx * dx + dy * dy) ** 0.5
-                
-                if distance >= self.settings["recording"]["minimum_mouse_movement"]:
-                    self.events.append({
-                        'type': 'mouse',
-                        'event': 'move',
-                        'position': (event.x, event.y),
-                        'time': current_time
-                    })
-                    self.last_mouse_pos = (event.x, event.y)
-        
-        # Handle mouse scroll
-        elif hasattr(event, 'wheel') and self.settings["recording"]["record_mouse_scroll"]:
-            self.events.append({
-                'type': 'mouse',
-                'event': 'scroll',
-                'delta': event.wheel,
-                'time': current_time
-            })
+        now = time.time()
+        last_time, last_count = self.recording_rate
+        rate = (count - last_count) / (now - last_time) if now > last_time else 0.0
+        self.recording_rate = (now, count)
+        self.progress_label.config(
+            text=f"{count} events - {rate:.0f} events/s - {format_clock(now - self.start_time)} elapsed")
+    
+    def _start_playback_progress(self, job, total, note=None):
+        self.progress_job = job
+        self.playback_total = total
+        self.playback_rate = (time.perf_counter(), 0)
+        self.playback_started = self.playback_rate[0]
+        self.status_label.config(text=f"Playing {job.name}..." + (f" ({note})" if note else ""))
+        self.progress_bar.stop()
+        if total is None:  # Looping, so there is no end to measure against
+            self.progress_bar.config(mode='indeterminate')
+            self.progress_bar.start()
+        else:
+            self.progress_bar.config(mode='determinate', value=0)
+        self.update_jobs_label()
+    
+    def _show_playback_progress(self, value):
+        job, offset, injected = value
+        if job is not self.progress_job:  # A last update can arrive after the run finished
+            return
+        now = time.perf_counter()
+        last_time, last_injected = self.playback_rate
+        rate = (injected - last_injected) / (now - last_time) if now > last_time else 0.0
+        self.playback_rate = (now, injected)
+        
+        text = f"{rate:.0f} events/s - {format_clock(now - self.playback_started)} elapsed"
+        if self.playback_total:
+            self.progress_bar.config(value=min(offset / self.playback_total, 1.0) * 100)
+            text += f" - {format_clock(max(self.playback_total - offset, 0))} remaining"
+        self.progress_label.config(text=text)
+    
+    def _finish_playback(self, job, filename):
+        if job.telemetry is None:
+            status = f"Ready - last run: {format_drift_report(job.report())}"
+        else:
+            summary = write_summary(filename, job.telemetry, job.report(), self.settings["playback_speed"])
+            status = f"Ready - last run: {format_telemetry(summary)}"
+        if job.state == CANCELLED:
+            status = f"Stopped {job.name} - {status}"
+        elif job.state == FAILED:
+            status = f"{job.name} failed: {job.error} - {status}"
+        
+        if job is self.progress_job:
+            self.progress_job = None
+            self.progress_bar.stop()
+            self.progress_bar.config(mode='determinate', value=0)
+            self.progress_label.config(text="")
+        self.status_label.config(text=status)
+        self.update_jobs_label()
+    
+    def update_jobs_label(self):
+        jobs = self.job_scheduler.running_jobs()
+        paused = sum(1 for job in jobs if job.state == PAUSED)
+        text = f"{len(jobs)} playing" if jobs else "No macros playing"
+        if paused:
+            text += f", {paused} paused"
+        self.jobs_label.config(text=text)
+    
+    def control_jobs(self, action):
+        jobs = self.job_scheduler.running_jobs()
+        selected = self.selected_macro_name()
+        selected_jobs = [job for job in jobs if job.name == selected]
+        for job in selected_jobs or jobs:
+            getattr(job, action)()
+        self.update_jobs_label()
     
     def save_macro(self, name):
-        filename = os.path.join(self.macro_dir, f"{name}.json")
-        with open(filename, 'w') as f:
-            json.dump(self.events, f)
+        filename = macro_path(self.macro_dir, name, self.settings["recording"]["save_format"])
+        # Unless it was simplified, the recording is moved out of its journal instead of rewritten
+        self.journal.save_as(filename, self.settings["recording"]["compression"], self.events)
+        self.macro_index.update_file(filename)
         self.status_label.config(text=f"Macro saved as: {name}")
     
+    def update_replay_capture(self):
+        """Start, restart or stop the always-on replay buffer to match the settings."""
+        recording_settings = self.settings["recording"]
+        minutes = recording_settings["replay_buffer_minutes"]
+        capacity = recording_settings["replay_buffer_events"]
+        config = RecordingConfig.from_settings(recording_settings, stages=self.recording_stages)
+        if self.replay is not None:
+            if minutes > 0 and self.replay.config == config and self.replay.buffer.capacity == capacity:
+                self.replay.max_age = minutes * 60
+                return
+            self.replay.stop()
+            self.replay = None
+        if minutes > 0 and capacity > 0:
+            self.replay = ReplayCapture(self.backend, config, capacity, minutes * 60)
+            self.replay.start()
+    
+    def save_replay(self):
+        if self.replay is None:
+            self.status_label.config(text="Replay buffer is off; set its length in Settings")
+            return
+        name = datetime.now().strftime("replay_%Y%m%d_%H%M%S")
+        filename = macro_path(self.macro_dir, name, self.settings["recording"]["save_format"])
+        compression = self.settings["recording"]["compression"]
+        replay = self.replay
+        
+        # Copying and saving happen on a worker thread; capture carries on meanwhile
+        def save():
+            events = replay.snapshot()
+            if not len(events):
+                self.progress.post(self.status_label.config, text="Replay buffer is empty")
+                return
+            try:
+                save_events(filename, events, compression)
+            except OSError as e:
+                self.progress.post(messagebox.showerror, "Error", f"Failed to save replay: {str(e)}")
+                return
+            self.progress.post(self._replay_saved, filename, name, len(events), events.duration())
+        threading.Thread(target=save, name="save replay", daemon=True).start()
+    
+    def _replay_saved(self, filename, name, event_count, duration):
+        self.macro_index.update_file(filename)
+        self.populate_macro_list()
+        self.status_label.config(text=f"Saved the last {format_clock(duration)} ({event_count} events) as: {name}")
+    
     def play_selected_macro(self):
-        selection = self.macro_list.curselection()
-        if not selection:
+        macro_name = self.selected_macro_name()
+        if macro_name is None:
             messagebox.showwarning("Warning", "Please select a macro to play")
             return
         
-        macro_name = self.macro_list.get(selection[0])
-        filename = os.path.join(self.macro_dir, f"{macro_name}.json")
+        try:
+            play_range = self.selected_play_range()
+        except ValueError as e:
+            messagebox.showwarning("Warning", f"Invalid play range: {str(e)}")
+            return
         
         try:
-            with open(filename, 'r') as f:
-                events = json.load(f)
+            filename = find_macro_file(self.macro_dir, macro_name)
             
-            # Start playback in a separate thread
-            playback_thread = threading.Thread(target=self._play_macro, args=(events,))
-            playback_thread.daemon = True
-            playback_thread.start()
+            # Load and compile off the main thread; the job scheduler does the injecting
+            loader_thread = threading.Thread(target=self._play_macro, args=(filename, macro_name, play_range))
+            loader_thread.daemon = True
+            loader_thread.start()
+            self.macro_index.mark_played(macro_name)
             
         except Exception as e:
             messagebox.showerror("Error", f"Error playing macro: {str(e)}")
     
-    def _play_macro(self, events):
-        self.status_label.config(text="Playing macro...")
-        repeat_count = self.settings["repeat_count"]
-        repeat_delay = self.settings["repeat_delay"]
-        playback_speed = self.settings["playback_speed"]
-        loop_playback = self.settings["recording"]["loop_playback"]
-        
-        while True:  # Loop indefinitely if loop_playback is True
-            for _ in range(repeat_count):
-                last_time = 0
-                for event in events:
-                    if not self.recording:  # Don't play events while recording
-                        time_to_wait = (event['time'] - last_time) / playback_speed
-                        if time_to_wait > 0:
-                            time.sleep(time_to_wait)
-                        
-                        if event['type'] == 'keyboard':
-                            if event['event'] == 'press':
-                                keyboard.press(event['key'])
-                                keyboard.release(event['key'])
-                        
-                        elif event['type'] == 'mouse':
-                            if event['event'] == 'move':
-                                self.mouse.position = event['position']
-                            elif event['event'] == 'click':
-                                mouse.move(event['position'][0], event['position'][1])
-                                mouse.click(event['button'])
-                            elif event['event'] == 'double click':
-                                mouse.move(event['position'][0], event['position'][1])
-                                mouse.double_click(event['button'])
-                            elif event['event'] == 'scroll':
-                                mouse.wheel(event['delta'])
-                        
-                        last_time = event['time']
-                
-                if _ < repeat_count - 1:  # Don't delay after the last repeat
-                    time.sleep(repeat_delay)
-            
-            if not loop_playback:
-                break  # Exit the loop if loop_playback is False
+    def selected_play_range(self):
+        """The PlayRange set in the Playback box, or None to play whole macros."""
+        start = self.range_start_var.get().strip()
+        end = self.range_end_var.get().strip()
+        play_range = PlayRange(float(start) if start else None, float(end) if end else None,
+                               restore_cursor=self.restore_cursor_var.get())
+        return play_range or None
+    
+    def _play_macro(self, filename, macro_name, play_range=None):
+        try:
+            self._submit_playback(filename, macro_name, play_range)
+        except Exception as e:
+            # This runs on the loader thread; a missing or corrupt file is reported on the Tk thread
+            self.progress.post(self._playback_failed, macro_name, e)
+    
+    def _playback_failed(self, macro_name, error):
+        if self.progress_job is not None and self.progress_job.state == PENDING:  # Never submitted
+            self.progress_job = None
+        if self.progress_job is None:
+            self.progress_bar.stop()
+            self.progress_bar.config(mode='determinate', value=0)
+            self.progress_label.config(text="")
+        self.status_label.config(text=f"Ready - failed to play {macro_name}")
+        self.update_jobs_label()
+        messagebox.showerror("Error", f"Error playing macro: {str(error)}")
+    
+    def _submit_playback(self, filename, macro_name, play_range=None):
+        note = None
+        if play_range:
+            # Seek straight to the range through the file's seek index; the plan is only used for this run
+            steps = PlaybackPlan.compile(load_range(filename, play_range), self.settings["playback_speed"])
+            note = format_range(play_range)
+        else:
+            # Compiled plans are cached per file and speed, so replays skip parsing and dispatch;
+            # macros too large to cache are streamed from disk and compiled on the fly
+            steps = self.plan_cache.steps_for(filename, open_macro, self.settings["playback_speed"])
+        
+        # Timeline edits are applied to the whole plan once, before any step is injected
+        recording_settings = self.settings["recording"]
+        if (recording_settings["max_idle_gap"] or recording_settings["trim_dead_time"]
+                or recording_settings["retime"] or recording_settings["speed_curve"]):
+            from timeline_transform import TimelineTransform, apply_transform, format_transform_report
+            transform = TimelineTransform(recording_settings["max_idle_gap"], recording_settings["trim_dead_time"],
+                                          recording_settings["retime"], recording_settings["speed_curve"])
+            steps, report = apply_transform(steps, transform, self.settings["playback_speed"])
+            report_note = format_transform_report(report, self.settings["repeat_count"], recording_settings["loop_playback"])
+            note = f"{note}, {report_note}" if note else report_note
+        
+        # The job scheduler lays the run (repeats and loops included) out against absolute
+        # deadlines and merges it with every other running macro on one injection thread
+        job = PlaybackJob(
+            steps,
+            name=macro_name,
+            repeat_count=self.settings["repeat_count"],
+            repeat_delay=self.settings["repeat_delay"],
+            loop_playback=self.settings["recording"]["loop_playback"],
+            telemetry=PlaybackTelemetry() if self.settings["recording"].get("playback_telemetry", True) else None,
+            on_finish=lambda job: self.progress.post(self._finish_playback, job, filename)
+        )
         
-        self.status_label.config(text="Ready")
+        def on_progress(offset, injected):
+            if job is self.progress_job:
+                self.progress.publish('playback', (job, offset, injected))
+        job.on_progress = on_progress
+        self.progress.post(self._start_playback_progress, job, timeline_duration(
+            steps.duration(), job.repeat_count, job.repeat_delay, job.loop_playback), note)
+        self.job_scheduler.submit(job)
 
 def main():
     app = MacroRecorderGUI()
-    
-    # Start system tray icon in a separate thread
-    icon_thread = threading.Thread(target=app.icon.run)
-    icon_thread.daemon = True
-    icon_thread.start()
-    
     app.root.mainloop()
 
 if __name__ == "__main__":
@@ -0,0 +1,88 @@
+import queue
+import threading
+
+from macro_format import COMPOSITE_EXTENSION, JSON_EXTENSION, iter_event_blocks, load_events, read_header
+
+# Number of decoded blocks (of up to BLOCK_SIZE events) kept ahead of playback
+READ_AHEAD_BLOCKS = 4
+
+_END = object()
+
+
+class ReadAheadReader:
+    """Decodes macro blocks on a background thread into a small bounded queue."""
+
+    def __init__(self, path, read_ahead=READ_AHEAD_BLOCKS):
+        self.path = path
+        self.blocks = queue.Queue(maxsize=read_ahead)
+        self.closed = threading.Event()
+        self.error = None
+        self.thread = threading.Thread(target=self._read, daemon=True)
+        self.thread.start()
+
+    def _put(self, item):
+        # Poll so an abandoned reader notices close() instead of blocking forever
+        while not self.closed.is_set():
+            try:
+                self.blocks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _read(self):
+        try:
+            for buffer in iter_event_blocks(self.path):
+                if not self._put(buffer):
+                    return
+        except Exception as e:
+            self.error = e
+        self._put(_END)
+
+    def __iter__(self):
+        try:
+            while True:
+                buffer = self.blocks.get()
+                if buffer is _END:
+                    break
+                yield from buffer
+            if self.error is not None:
+                raise self.error
+        finally:
+            self.close()
+
+    def close(self):
+        self.closed.set()
+
+
+class MacroStream:
+    """Re-iterable view of a binary macro file that never loads it whole.
+
+    Each iteration (e.g. each repeat of a playback run) starts a fresh
+    ReadAheadReader, so time-to-first-event and memory use stay constant
+    regardless of the macro's length.
+    """
+
+    def __init__(self, path, read_ahead=READ_AHEAD_BLOCKS):
+        if path.endswith((JSON_EXTENSION, COMPOSITE_EXTENSION)):
+            raise ValueError("Only binary macros can be streamed")
+        self.path = path
+        self.read_ahead = read_ahead
+        with open(path, 'rb') as f:
+            self.header = read_header(f)
+
+    def __len__(self):
+        return self.header['event_count']
+
+    def __iter__(self):
+        return iter(ReadAheadReader(self.path, self.read_ahead))
+
+    def duration(self):
+        return self.header['duration']
+
+
+def open_macro(path):
+    """Stream binary macros and fall back to a full load for JSON and composite ones."""
+    if path.endswith((JSON_EXTENSION, COMPOSITE_EXTENSION)):
+        return load_events(path)
+    return MacroStream(path)
@@ -0,0 +1,167 @@
+import time
+
+import numpy as np
+
+from event_store import COLUMNS, MOUSE
+
+
+def column(buffer, name):
+    """Copy an EventBuffer column into a NumPy array."""
+    return np.array(getattr(buffer, name))
+
+
+def take(buffer, indices):
+    """Return a new EventBuffer holding only the events at `indices`."""
+    result = buffer.empty_like()
+    for name in COLUMNS:
+        values = column(buffer, name)[indices]
+        getattr(result, name).frombytes(values.tobytes())
+    return result
+
+
+def move_mask(buffer):
+    move_kind = buffer.kind_table.ids.get('move', -1)
+    return (column(buffer, 'types') == MOUSE) & (column(buffer, 'kinds') == move_kind)
+
+
+# Runs longer than this are pre-split at fixed points. Each split keeps at most one
+# extra move, but skips the top levels of the recursion where every point of a
+# long run would otherwise be measured against a chord again and again.
+CHUNK_SIZE = 4096
+
+
+def _scores(coords, starts, ends, interior, segment_of):
+    """Deviation score of each interior point from its segment's chord.
+
+    This is the squared cross product of (point - start) with the chord, which
+    is proportional to the squared distance within a segment. Degenerate
+    segments (start == end) score the squared distance to the start point.
+    Returns the scores and each segment's squared chord length.
+    """
+    directions = [values[ends] - values[starts] for values in coords]
+    length = sum(d * d for d in directions)
+
+    if len(coords) == 2:
+        (x, y), (dx, dy) = coords, directions
+        # cross = (p - a) x d = p x d - a x d
+        constant = x[starts] * dy - y[starts] * dx
+        cross = x[interior] * dy[segment_of] - y[interior] * dx[segment_of]
+        cross -= constant[segment_of]
+        score = cross * cross
+    else:
+        offsets = [values[interior] - values[starts][segment_of] for values in coords]
+        (ox, oy, oz), (dx, dy, dz) = offsets, [d[segment_of] for d in directions]
+        cx = oy * dz - oz * dy
+        cy = oz * dx - ox * dz
+        cz = ox * dy - oy * dx
+        score = cx * cx + cy * cy + cz * cz
+
+    degenerate = np.flatnonzero(length == 0)
+    if len(degenerate):
+        points = np.flatnonzero(np.isin(segment_of, degenerate))
+        score[points] = sum((values[interior[points]] - values[starts[segment_of[points]]]) ** 2
+                            for values in coords)
+    return score, length
+
+
+def rdp_keep(coords, run_starts, run_ends, tolerance, chunk_size=CHUNK_SIZE):
+    """Ramer-Douglas-Peucker over many polylines at once.
+
+    `coords` is a sequence of 1-D float arrays (one per dimension) and each
+    run [run_starts[i], run_ends[i]] is simplified independently. Instead of
+    recursing per segment, every pass processes all open segments together,
+    so the number of NumPy calls grows with the recursion depth rather than
+    with the number of points. Returns a boolean mask of the points to keep.
+    """
+    starts = np.asarray(run_starts, dtype=np.int64)
+    ends = np.asarray(run_ends, dtype=np.int64)
+    if chunk_size:
+        chunks = np.maximum((ends - starts + chunk_size - 1) // chunk_size, 1)
+        offsets = np.arange(chunks.sum()) - np.repeat(np.cumsum(chunks) - chunks, chunks)
+        starts, ends = (np.repeat(starts, chunks) + offsets * chunk_size,
+                        np.minimum(np.repeat(starts, chunks) + (offsets + 1) * chunk_size, np.repeat(ends, chunks)))
+
+    keep = np.zeros(len(coords[0]), dtype=bool)
+    keep[starts] = True
+    keep[ends] = True
+    tolerance_squared = tolerance * tolerance
+
+    while True:
+        open_segments = ends - starts > 1
+        starts, ends = starts[open_segments], ends[open_segments]
+        if not len(starts):
+            break
+
+        # Flatten the interior points of every open segment into one array,
+        # in file order so the gathers below walk memory sequentially
+        order = np.argsort(starts)
+        starts, ends = starts[order], ends[order]
+        lengths = ends - starts - 1
+        first = np.cumsum(lengths) - lengths
+        segment_of = np.repeat(np.arange(len(starts)), lengths)
+        interior = np.arange(lengths.sum()) + (starts + 1 - first)[segment_of]
+
+        score, length = _scores(coords, starts, ends, interior, segment_of)
+        max_score = np.maximum.reduceat(score, first)
+
+        # First point per segment that reaches the segment's maximum
+        candidates = np.flatnonzero(score == max_score[segment_of])
+        candidate_segments = segment_of[candidates]
+        is_first = np.ones(len(candidates), dtype=bool)
+        is_first[1:] = candidate_segments[1:] != candidate_segments[:-1]
+        split_at = interior[candidates[is_first]]
+
+        # score / length is the squared distance, except for degenerate segments
+        split = max_score > tolerance_squared * np.where(length > 0, length, 1.0)
+        split_at = split_at[split]
+        keep[split_at] = True
+        starts = np.concatenate((starts[split], split_at))
+        ends = np.concatenate((split_at, ends[split]))
+
+    return keep
+
+
+def simplify_moves(buffer, tolerance=2.0, time_scale=0.0):
+    """Simplify runs of mouse moves in an EventBuffer with Ramer-Douglas-Peucker.
+
+    Only move events are dropped; clicks, scrolls and keyboard events and the
+    first and last move around each of them are always kept. With a non-zero
+    `time_scale` (pixels per second) time becomes a third coordinate, so
+    pauses along a straight line survive simplification.
+    Returns the simplified buffer and a stats dict.
+    """
+    started = time.perf_counter()
+    moves = move_mask(buffer)
+    move_indices = np.flatnonzero(moves)
+    total = len(buffer)
+
+    keep_event = np.ones(total, dtype=bool)
+    if len(move_indices) > 2:
+        coords = [column(buffer, 'xs')[move_indices].astype(np.float64),
+                  column(buffer, 'ys')[move_indices].astype(np.float64)]
+        if time_scale:
+            coords.append(column(buffer, 'times')[move_indices] * (time_scale / 1e9))
+
+        # A run of moves ends wherever any other event sits between two moves
+        breaks = np.flatnonzero(np.diff(move_indices) > 1)
+        run_starts = np.concatenate(([0], breaks + 1))
+        run_ends = np.concatenate((breaks, [len(move_indices) - 1]))
+
+        keep_event[move_indices] = rdp_keep(coords, run_starts, run_ends, tolerance)
+
+    kept = np.flatnonzero(keep_event)
+    simplified = take(buffer, kept) if len(kept) < total else buffer
+    stats = {
+        'events_before': total,
+        'events_after': len(kept),
+        'moves_before': len(move_indices),
+        'moves_after': int(keep_event[move_indices].sum()),
+        'reduction': 1.0 - len(kept) / total if total else 0.0,
+        'seconds': time.perf_counter() - started,
+    }
+    return simplified, stats
+
+
+def format_simplify_stats(stats):
+    return (f"Simplified {stats['events_before']} -> {stats['events_after']} events "
+            f"({stats['reduction']:.0%} fewer) in {stats['seconds'] * 1000:.0f} ms")
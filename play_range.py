@@ -0,0 +1,93 @@
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+
+from event_store import EventBuffer
+from macro_format import last_position, seek_blocks
+
+
+class PlayRange(namedtuple('PlayRange', ['start', 'end', 'first_event', 'last_event', 'restore_cursor'])):
+    """The part of a macro to play.
+
+    Either a time range of the recording in seconds (`start`, `end`) or a
+    range of event numbers (`first_event`, `last_event`, the end excluded);
+    None leaves that side open. Events keep their spacing, shifted so the
+    seek point (`start`, or the time of `first_event`) plays first. With
+    `restore_cursor` the cursor is first moved to where it was at the seek
+    point.
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, start=None, end=None, first_event=None, last_event=None, restore_cursor=True):
+        if (start is not None or end is not None) and (first_event is not None or last_event is not None):
+            raise ValueError("a play range is either a time range or an event range")
+        if (start or 0) < 0 or (first_event or 0) < 0:
+            raise ValueError("play ranges must not start before 0")
+        if start is not None and end is not None and end <= start:
+            raise ValueError("play ranges must end after they start")
+        if first_event is not None and last_event is not None and last_event <= first_event:
+            raise ValueError("play ranges must end after they start")
+        return super().__new__(cls, start, end, first_event, last_event, restore_cursor)
+
+    def __bool__(self):
+        return any(bound is not None for bound in self[:4])
+
+    def by_time(self):
+        return self.first_event is None and self.last_event is None
+
+
+def load_range(path, play_range):
+    """The events of a macro file within `play_range`, timed from its seek point.
+
+    Binary macros seek to the first block of the range through their seek
+    index (see seek_blocks()) and stop decoding after its last one, so the
+    cost depends on the length of the range, not of the macro.
+    """
+    by_time = play_range.by_time()
+    start_ns = round((play_range.start or 0.0) * 1e9)
+    end_ns = round(play_range.end * 1e9) if play_range.end is not None else None
+    first_event = play_range.first_event or 0
+    last_event = play_range.last_event
+
+    events = None
+    cursor = None
+    origin = start_ns
+    for base, block_cursor, block in seek_blocks(path, start_ns if by_time else None, None if by_time else first_event):
+        count = len(block)
+        if events is None:
+            events = block.empty_like()
+            cursor = block_cursor
+        if by_time:
+            low = bisect_left(block.times, start_ns)
+            high = bisect_left(block.times, end_ns) if end_ns is not None else count
+        else:
+            low = min(max(first_event - base, 0), count)
+            high = count if last_event is None else min(max(last_event - base, 0), count)
+
+        if not len(events):
+            # Nothing is kept yet, so this block may still hold the seek point
+            cursor = last_position(block, 0, low, cursor)
+            if low < high:
+                if not by_time:
+                    origin = block.times[low]
+                if play_range.restore_cursor and cursor is not None:
+                    events.add_move(cursor[0], cursor[1], origin)
+        if low < high:
+            events.extend_slice(block, low, high)
+        if high < count:
+            break
+
+    if events is None:
+        return EventBuffer()
+    events.times = array('q', (max(t - origin, 0) for t in events.times))
+    return events
+
+
+def format_range(play_range):
+    if not play_range.by_time():
+        first = play_range.first_event or 0
+        last = "end" if play_range.last_event is None else play_range.last_event
+        return f"events {first} to {last}"
+    end = "end" if play_range.end is None else f"{play_range.end:.1f} s"
+    return f"{play_range.start or 0.0:.1f} s to {end}"
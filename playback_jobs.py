@@ -0,0 +1,421 @@
+import heapq
+import itertools
+import threading
+import time
+
+from batch_injection import BATCH_TICK, add_step
+from playback_plan import OP_SYNC, WithoutSyncPoints
+from playback_scheduler import SPIN_THRESHOLD, repeat_timeline
+from sync_points import wait_for
+
+# Job states
+PENDING = 'pending'
+RUNNING = 'running'
+PAUSED = 'paused'
+FINISHED = 'finished'
+CANCELLED = 'cancelled'
+FAILED = 'failed'  # A sync point timed out or injection raised, see PlaybackJob.error
+
+
+class CancelToken:
+    """Cancellation flag shared by any number of jobs.
+
+    Cancelling it stops every job holding it, including loop_playback runs
+    that would otherwise never end.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cancelled = False
+        self.listeners = []
+
+    def cancel(self):
+        with self.lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            listeners = list(self.listeners)
+        for listener in listeners:
+            listener(self)
+
+    def add_listener(self, listener):
+        """Call `listener(token)` once when the token is cancelled (immediately if it already is)."""
+        with self.lock:
+            if not self.cancelled:
+                self.listeners.append(listener)
+                return
+        listener(self)
+
+
+class PlaybackJob:
+    """One macro run on a JobScheduler.
+
+    `steps` are compiled plan steps (PlaybackPlan or PlanStream) laid out
+    with repeat_timeline(). `on_progress(offset, injected)` is called on the
+    injection thread after every batch that contained one of the job's
+    steps, and `on_finish(job)` once the job finished, was stopped or failed.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, steps, name=None, repeat_count=1, repeat_delay=0.0, loop_playback=False,
+                 token=None, telemetry=None, start_delay=0.0, on_progress=None, on_finish=None):
+        self.id = next(self._ids)
+        self.name = name or f"job {self.id}"
+        self.steps = steps
+        self.repeat_count = repeat_count
+        self.repeat_delay = repeat_delay
+        self.loop_playback = loop_playback
+        self.token = token if token is not None else CancelToken()
+        self.telemetry = telemetry
+        self.start_delay = start_delay
+        self.on_progress = on_progress
+        self.on_finish = on_finish
+
+        self.scheduler = None
+        self.state = PENDING
+        self.done = threading.Event()
+        self.generation = 0  # Bumped on pause/stop so stale heap entries are ignored
+        self.timeline = None
+        self.pending = None  # Next (offset, step) of the timeline, not yet injected
+        self.start_time = None
+        self.paused_at = None
+        self.end_time = None
+        self.error = None
+        self.waiting = False  # A sync point's condition is being polled
+        self.sync_offset = None  # Timeline offset of that sync point
+
+        self.syncs = 0
+        self.sync_wait = 0.0
+        self.injected = 0
+        self.last_offset = 0.0
+        self.total_lateness = 0.0
+        self.max_lateness = 0.0
+
+    def pause(self):
+        self.scheduler.pause(self)
+
+    def resume(self):
+        self.scheduler.resume(self)
+
+    def stop(self):
+        self.scheduler.stop(self)
+
+    def wait(self, timeout=None):
+        """Block until the job finished, was stopped or failed; returns False on timeout."""
+        return self.done.wait(timeout)
+
+    def report(self):
+        """How far the run drifted from its recorded timing, and the sync points it waited for.
+
+        Time spent at sync points shifts the rest of the timeline like a
+        pause does, so it never counts as drift.
+        """
+        end = self.end_time if self.end_time is not None else self.scheduler.clock()
+        elapsed = end - self.start_time if self.start_time is not None else 0.0
+        return {
+            'events': self.injected,
+            'scheduled_duration': self.last_offset,
+            'actual_duration': elapsed,
+            'final_drift': elapsed - self.last_offset,
+            'mean_lateness': self.total_lateness / self.injected if self.injected else 0.0,
+            'max_lateness': self.max_lateness,
+            'syncs': self.syncs,
+            'sync_wait': self.sync_wait,
+        }
+
+
+class JobScheduler:
+    """Plays any number of PlaybackJobs on a single injection thread.
+
+    Every running job keeps its next step in one heap ordered by absolute
+    deadline, so the timelines of all jobs are merged on the fly. Steps of
+    any job due within `tick` of the earliest one are handed to the backend
+    as one batch; `batches` counts them.
+    `active`, if given, is checked before each batch; while it returns
+    False steps are consumed without being injected.
+
+    Sync points are checked through the ConditionProvider `conditions` as
+    soon as the step before them was injected, on a thread of their own so
+    other jobs keep playing. The job's timeline then continues from the
+    moment the condition is met instead of the recorded gap, or the job
+    fails if it times out. Without `conditions` sync points are skipped and
+    the recorded gaps are kept.
+
+    A batch the backend fails to inject fails every job with a step in it;
+    the thread keeps playing the other jobs.
+    """
+
+    def __init__(self, backend, tick=BATCH_TICK, spin_threshold=SPIN_THRESHOLD, clock=time.perf_counter,
+                 active=None, conditions=None):
+        self.backend = backend
+        self.conditions = conditions
+        self.tick = tick
+        self.spin_threshold = spin_threshold
+        self.clock = clock
+        self.active = active
+        self.condition = threading.Condition()
+        self.heap = []
+        self.sequence = itertools.count()
+        self.jobs = {}
+        self.thread = None
+        self.closed = False
+        self.batches = 0
+
+    def submit(self, job):
+        """Start `job` and return it."""
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("scheduler is shut down")
+            job.scheduler = self
+            job.state = RUNNING
+            job.start_time = self.clock() + job.start_delay
+            if job.telemetry is not None:
+                job.telemetry.start(job.start_time)
+            # Skipped sync points are dropped up front, so a loop with nothing else to play ends at once
+            steps = job.steps if self.conditions is not None else WithoutSyncPoints(job.steps)
+            job.timeline = iter(repeat_timeline(steps, job.repeat_count, job.repeat_delay, job.loop_playback))
+            self.jobs[job.id] = job
+            has_steps = self._advance(job)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="playback", daemon=True)
+                self.thread.start()
+            self.condition.notify()
+        if not has_steps:
+            self._finish(job, FINISHED)
+        job.token.add_listener(lambda token: self.stop(job))
+        return job
+
+    def play(self, steps, **options):
+        """Create a PlaybackJob for `steps` (see PlaybackJob for options) and submit it."""
+        return self.submit(PlaybackJob(steps, **options))
+
+    def pause(self, job):
+        with self.condition:
+            if job.state != RUNNING:
+                return
+            job.state = PAUSED
+            job.paused_at = self.clock()
+            job.generation += 1
+            self.condition.notify()
+
+    def resume(self, job):
+        with self.condition:
+            if job.state != PAUSED:
+                return
+            # Shift the job's timeline so it continues where it was paused
+            shift = self.clock() - job.paused_at
+            job.start_time += shift
+            if job.telemetry is not None:
+                job.telemetry.start_time += shift
+            job.state = RUNNING
+            job.paused_at = None
+            # Without a pending step its last step is already being injected, and a
+            # sync point being waited for queues the next step itself
+            if job.pending is not None and not job.waiting:
+                self._push(job)
+            self.condition.notify()
+
+    def stop(self, job):
+        with self.condition:
+            if job.state in (FINISHED, CANCELLED, FAILED):
+                return
+            job.generation += 1
+            self.condition.notify()
+        self._finish(job, CANCELLED)
+
+    def stop_all(self):
+        for job in self.running_jobs():
+            self.stop(job)
+
+    def pause_all(self):
+        for job in self.running_jobs():
+            self.pause(job)
+
+    def resume_all(self):
+        for job in self.running_jobs():
+            self.resume(job)
+
+    def running_jobs(self):
+        """Jobs that are running or paused."""
+        with self.condition:
+            return list(self.jobs.values())
+
+    def shutdown(self):
+        self.stop_all()
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def _push(self, job):
+        offset = job.pending[0]
+        heapq.heappush(self.heap, (job.start_time + offset, next(self.sequence), job, job.generation))
+
+    def _advance(self, job):
+        """Queue the job's next step; returns False once its timeline is exhausted."""
+        previous = job.pending[0] if job.pending is not None else 0.0
+        try:
+            job.pending = next(job.timeline)
+        except StopIteration:
+            job.pending = None
+            return False
+        if job.pending[1][1] == OP_SYNC:
+            # Due together with the step before it, see _wait_sync()
+            job.sync_offset = job.pending[0]
+            job.pending = (previous, job.pending[1])
+        if job.state == RUNNING:
+            self._push(job)
+        return True
+
+    def _finish(self, job, state):
+        with self.condition:
+            if job.state in (FINISHED, CANCELLED, FAILED):
+                return
+            job.state = state
+            job.end_time = self.clock()
+            self.jobs.pop(job.id, None)
+        job.done.set()
+        if job.on_finish is not None:
+            job.on_finish(job)
+
+    def _fail(self, job, error):
+        with self.condition:
+            if job.state in (FINISHED, CANCELLED, FAILED):
+                return
+            job.generation += 1  # Drops the steps it already queued
+            job.error = error
+            self.condition.notify()
+        self._finish(job, FAILED)
+
+    def _next_batch(self):
+        """Wait for the earliest due step and collect every step due within a tick of it.
+
+        Returns (deadline, batch, exhausted jobs, jobs at a sync point), or None
+        when shut down.
+        Must be called with the condition held.
+        """
+        heap = self.heap
+        while True:
+            if self.closed:
+                return None
+            # Drop entries of paused or stopped jobs
+            while heap and heap[0][2].generation != heap[0][3]:
+                heapq.heappop(heap)
+            if not heap:
+                self.condition.wait()
+                continue
+            remaining = heap[0][0] - self.clock()
+            if remaining > self.spin_threshold:
+                # Any submit, pause or stop wakes us up to re-evaluate the heap
+                self.condition.wait(remaining - self.spin_threshold)
+                continue
+            break
+
+        limit = heap[0][0] + self.tick
+        deadline = heap[0][0]
+        batch = []
+        exhausted = []
+        syncs = []
+        while heap and heap[0][0] <= limit:
+            step_deadline, _, job, generation = heapq.heappop(heap)
+            if job.generation != generation:
+                continue
+            offset, step = job.pending
+            if step[1] == OP_SYNC:
+                job.waiting = True
+                syncs.append(job)
+                continue
+            step = (step[0], step[1], step[2], job, step_deadline, offset)
+            if batch and batch[-1][3] is not job:
+                # Only a job's own moves are coalesced, so every job's counts and telemetry stay its own
+                batch.append(step)
+            else:
+                add_step(batch, step)
+            deadline = step_deadline
+            if not self._advance(job):
+                exhausted.append(job)
+        return deadline, batch, exhausted, syncs
+
+    def _wait_sync(self, job):
+        """Wait for the condition of the job's pending sync point, then queue the step after it.
+
+        The job's timeline is shifted so the sync point happens when its
+        condition was met: earlier than recorded if the application was
+        fast, later if it was slow.
+        """
+        condition, timeout = job.pending[1][2]
+        started = self.clock()
+        try:
+            checks = wait_for(condition, self.conditions, timeout, stop=job.done)
+        except Exception as e:  # A timeout, or a provider that can't read the desktop
+            job.error = e
+            self._finish(job, FAILED)
+            return
+        if checks is None:  # Stopped while waiting
+            return
+
+        with self.condition:
+            if job.state not in (RUNNING, PAUSED):
+                return
+            # A job paused while waiting resumes as if the condition was met when it was paused
+            met = self.clock() if job.state == RUNNING else job.paused_at
+            shift = met - (job.start_time + job.sync_offset)
+            job.start_time += shift
+            if job.telemetry is not None:
+                job.telemetry.start_time += shift
+            job.syncs += 1
+            job.sync_wait += met - started
+            job.waiting = False
+            job.sync_offset = None
+            has_steps = self._advance(job)
+            self.condition.notify()
+        if not has_steps:
+            self._finish(job, FINISHED)
+
+    def _run(self):
+        clock = self.clock
+        submit = self.backend.submit
+        while True:
+            with self.condition:
+                result = self._next_batch()
+            if result is None:
+                return
+            deadline, batch, exhausted, syncs = result
+
+            while clock() < deadline:
+                pass
+            if batch and (self.active is None or self.active()):
+                started = clock()
+                try:
+                    submit(batch)
+                except Exception as e:  # An unmappable key, or an input library that can't inject
+                    failed = {job.id: job for job in exhausted}
+                    failed.update((step[3].id, step[3]) for step in batch)
+                    for job in failed.values():
+                        self._fail(job, e)
+                    batch = ()
+                finished = clock()
+                self.batches += 1
+                touched = {}
+                for _, op, _, job, step_deadline, offset in batch:
+                    lateness = started - step_deadline
+                    job.injected += 1
+                    job.total_lateness += lateness
+                    if lateness > job.max_lateness:
+                        job.max_lateness = lateness
+                    job.last_offset = offset
+                    if job.telemetry is not None:
+                        job.telemetry.record(op, offset, started, finished)
+                    touched[job.id] = job
+                for job in touched.values():
+                    if job.on_progress is not None:
+                        job.on_progress(job.last_offset, job.injected)
+
+            for job in exhausted:
+                self._finish(job, FINISHED)
+            for job in syncs:
+                if job.state == FAILED:
+                    continue
+                threading.Thread(target=self._wait_sync, args=(job,), name="sync", daemon=True).start()
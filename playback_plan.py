@@ -0,0 +1,238 @@
+import os
+import threading
+from array import array
+from collections import OrderedDict
+
+from macro_format import COMPOSITE_EXTENSION, MacroFormatError, content_hash, read_composite, segment_path
+from sync_points import DEFAULT_SYNC_TIMEOUT, parse_condition
+
+# Playback opcodes; a player maps each one to a handler in a tuple indexed by opcode
+OP_KEY_TAP = 0          # args: (key,)
+OP_MOVE = 1             # args: (x, y)
+OP_CLICK = 2            # args: (x, y, button)
+OP_DOUBLE_CLICK = 3     # args: (x, y, button)
+OP_SCROLL = 4           # args: (delta,)
+OP_BUTTON_DOWN = 5      # args: (x, y, button)
+OP_BUTTON_UP = 6        # args: (x, y, button)
+OP_SYNC = 7             # args: (condition, timeout); waited for by the scheduler, never injected
+OPCODE_COUNT = 8
+OP_NAMES = ('key tap', 'move', 'click', 'double click', 'scroll', 'button down', 'button up', 'sync')
+
+# Macros with more events than this are streamed and compiled on the fly
+# instead of being compiled and cached in memory
+PLAN_EVENT_LIMIT = 500000
+
+
+def bind_handlers(backend):
+    """Handlers for each injected opcode, in opcode order, bound to an InputBackend."""
+    return (backend.tap_key, backend.move_to, backend.click_at, backend.double_click_at, backend.scroll,
+            backend.press_button_at, backend.release_button_at)
+
+
+def compile_event(event):
+    """Translate one event dict into an (opcode, args) pair, or None if it is not played."""
+    kind = event['event']
+    if event['type'] == 'keyboard':
+        if kind == 'press':
+            return OP_KEY_TAP, (event['key'],)
+    elif event['type'] == 'sync':
+        return OP_SYNC, (parse_condition(kind, event['condition']), event.get('timeout', DEFAULT_SYNC_TIMEOUT))
+    elif kind == 'move':
+        return OP_MOVE, tuple(event['position'])
+    elif kind == 'click':
+        return OP_CLICK, (event['position'][0], event['position'][1], event['button'])
+    elif kind == 'double click':
+        return OP_DOUBLE_CLICK, (event['position'][0], event['position'][1], event['button'])
+    elif kind == 'scroll':
+        return OP_SCROLL, (event['delta'],)
+    elif kind in ('down', 'double'):
+        # Recorded presses; the `mouse` library reports the second press of a double click as 'double'
+        return OP_BUTTON_DOWN, (event['position'][0], event['position'][1], event['button'])
+    elif kind == 'up':
+        return OP_BUTTON_UP, (event['position'][0], event['position'][1], event['button'])
+    return None
+
+
+class PlanStream:
+    """Compiles events lazily into (offset, opcode, args) steps on every pass."""
+
+    def __init__(self, events, playback_speed=1.0):
+        self.events = events
+        self.playback_speed = playback_speed
+
+    def __len__(self):
+        return len(self.events)
+
+    def duration(self):
+        return self.events.duration() / self.playback_speed
+
+    def __iter__(self):
+        playback_speed = self.playback_speed
+        for event in self.events:
+            step = compile_event(event)
+            if step is not None:
+                yield event['time'] / playback_speed, step[0], step[1]
+
+
+class WithoutSyncPoints:
+    """Re-iterable view of compiled steps that leaves out their sync points."""
+
+    def __init__(self, steps):
+        self.steps = steps
+
+    def __len__(self):
+        return len(self.steps)
+
+    def duration(self):
+        return self.steps.duration()
+
+    def __iter__(self):
+        for step in self.steps:
+            if step[1] != OP_SYNC:
+                yield step
+
+
+class PlaybackPlan:
+    """A macro compiled once into opcodes with deadlines for one playback speed."""
+
+    def __init__(self, playback_speed=1.0):
+        self.playback_speed = playback_speed
+        self.offsets = array('d')
+        self.ops = array('B')
+        self.args = []
+
+    @classmethod
+    def compile(cls, events, playback_speed=1.0):
+        plan = cls(playback_speed)
+        for offset, op, args in PlanStream(events, playback_speed):
+            plan.offsets.append(offset)
+            plan.ops.append(op)
+            plan.args.append(args)
+        return plan
+
+    def __len__(self):
+        return len(self.ops)
+
+    def __iter__(self):
+        return zip(self.offsets, self.ops, self.args)
+
+    def duration(self):
+        return self.offsets[-1] if self.offsets else 0.0
+
+
+class CompositePlan:
+    """Steps of a composite macro, chained from the steps of its segments.
+
+    `segments` is a list of (steps, repeat, offset), with offset already
+    scaled by the playback speed. The segments' own (cached) steps are
+    re-iterated with shifted offsets on every pass; nothing is copied.
+    """
+
+    def __init__(self, segments):
+        self.segments = segments
+
+    def __len__(self):
+        return sum(len(steps) * repeat for steps, repeat, _ in self.segments)
+
+    def duration(self):
+        return sum(offset + steps.duration() * repeat for steps, repeat, offset in self.segments)
+
+    def __iter__(self):
+        base = 0.0
+        for steps, repeat, offset in self.segments:
+            base += offset
+            duration = steps.duration()
+            for _ in range(repeat):
+                for step in steps:
+                    yield base + step[0], step[1], step[2]
+                base += duration
+
+
+class PlanCache:
+    """LRU cache of compiled plans keyed by macro content hash and playback speed.
+
+    Identical macros share one plan whatever they are called, and a macro
+    used as a segment by many composites is compiled once. Hashes are
+    remembered per path, mtime and size, so a cache hit costs a stat() and
+    no reading.
+    """
+
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self.plans = OrderedDict()
+        self.digests = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, path, playback_speed):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            known = self.digests.get(path)
+        if known is None or known[0] != version:
+            known = (version, content_hash(path))
+            with self.lock:
+                self.digests[path] = known
+        return known[1], playback_speed
+
+    def get(self, path, playback_speed):
+        key = self.key(path, playback_speed)
+        with self.lock:
+            plan = self.plans.get(key)
+            if plan is None:
+                self.misses += 1
+                return None
+            self.plans.move_to_end(key)
+            self.hits += 1
+            return plan
+
+    def put(self, path, playback_speed, plan):
+        key = self.key(path, playback_speed)
+        with self.lock:
+            self.plans[key] = plan
+            self.plans.move_to_end(key)
+            while len(self.plans) > self.max_entries:
+                self.plans.popitem(last=False)
+
+    def steps_for(self, path, events_loader, playback_speed):
+        """Return playback steps for a macro file, compiling and caching them if needed.
+
+        `events_loader(path)` is only called on a cache miss. Macros above
+        PLAN_EVENT_LIMIT are compiled lazily on every pass instead of cached.
+        Composite macros are chained from the steps of their segments, each
+        looked up here in turn.
+        """
+        if path.endswith(COMPOSITE_EXTENSION):
+            return self.composite_steps(path, events_loader, playback_speed)
+
+        plan = self.get(path, playback_speed)
+        if plan is not None:
+            return plan
+
+        events = events_loader(path)
+        if len(events) > PLAN_EVENT_LIMIT:
+            return PlanStream(events, playback_speed)
+        plan = PlaybackPlan.compile(events, playback_speed)
+        self.put(path, playback_speed, plan)
+        return plan
+
+    def composite_steps(self, path, events_loader, playback_speed, including=()):
+        including = including + (os.path.abspath(path),)
+        segments = []
+        for segment in read_composite(path):
+            part_path = segment_path(path, segment)
+            if os.path.abspath(part_path) in including:
+                raise MacroFormatError(f"Composite macro '{segment.macro}' includes itself")
+            if part_path.endswith(COMPOSITE_EXTENSION):
+                steps = self.composite_steps(part_path, events_loader, playback_speed, including)
+            else:
+                steps = self.steps_for(part_path, events_loader, playback_speed)
+            segments.append((steps, segment.repeat, segment.offset / playback_speed))
+        return CompositePlan(segments)
+
+    def clear(self):
+        with self.lock:
+            self.plans.clear()
+            self.digests.clear()
@@ -0,0 +1,43 @@
+# Below this many seconds before a deadline we stop sleeping and spin instead,
+# since time.sleep() can overshoot by a scheduler quantum (up to ~15 ms on Windows).
+SPIN_THRESHOLD = 0.002
+
+
+def repeat_timeline(steps, repeat_count=1, repeat_delay=0.0, loop_playback=False):
+    """Lay a whole playback run out on one continuous timeline.
+
+    `steps` is re-iterated once per repeat and must yield tuples whose first
+    element is the step's offset in seconds from the start of the macro.
+    Yields (offset, step) pairs with offsets from the start of the run, so
+    repeats, repeat delays and loops never accumulate the error of the steps
+    before them.
+    """
+    base = 0.0
+    while True:
+        played = False
+        for repeat in range(repeat_count):
+            last_offset = 0.0
+            for step in steps:
+                played = True
+                last_offset = step[0]
+                yield base + last_offset, step
+            base += last_offset
+
+            if repeat < repeat_count - 1:  # Don't delay after the last repeat
+                base += repeat_delay
+
+        if not loop_playback or not played:
+            break
+
+
+def timeline_duration(duration, repeat_count=1, repeat_delay=0.0, loop_playback=False):
+    """Length of a repeat_timeline() run over steps lasting `duration` seconds, or None if it loops."""
+    if loop_playback:
+        return None
+    return duration * repeat_count + repeat_delay * max(repeat_count - 1, 0)
+
+
+def format_drift_report(report):
+    return (f"{report['events']} events, drift {report['final_drift'] * 1000:+.1f} ms, "
+            f"mean lateness {report['mean_lateness'] * 1000:.2f} ms, "
+            f"max {report['max_lateness'] * 1000:.2f} ms")
@@ -0,0 +1,206 @@
+import json
+import os
+from array import array
+from datetime import datetime
+
+from playback_plan import OPCODE_COUNT, OP_NAMES
+
+# Playback summaries are written next to the macro as "<macro file>.timing"
+TELEMETRY_EXTENSION = '.timing'
+
+# Each power-of-two range of the histogram is split into 2**(SUB_BUCKET_BITS - 1)
+# linear buckets, so recorded values are accurate to ~3% at any magnitude
+SUB_BUCKET_BITS = 5
+# Largest value tracked precisely, in ns (~18 minutes); larger values land in the last bucket
+MAX_TRACKABLE_NS = 1 << 40
+
+# Events kept in the rolling per-event trace
+TRACE_CAPACITY = 4096
+
+PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+
+
+class LatencyHistogram:
+    """HDR-style log-linear histogram of nanosecond values.
+
+    Buckets are preallocated when the histogram is created; record() only
+    bumps counters, so it can run for every injected event.
+    """
+
+    def __init__(self, sub_bucket_bits=SUB_BUCKET_BITS, max_value=MAX_TRACKABLE_NS):
+        self.sub_bucket_count = 1 << sub_bucket_bits
+        self.sub_bucket_half = self.sub_bucket_count >> 1
+        self.sub_bucket_bits = sub_bucket_bits
+        self.max_index = self.index_of(max_value)
+        self.counts = array('q', bytes(8 * (self.max_index + 1)))
+        self.reset()
+
+    def reset(self):
+        for index in range(len(self.counts)):
+            self.counts[index] = 0
+        self.count = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+
+    def index_of(self, value):
+        if value < self.sub_bucket_count:
+            return value
+        shift = value.bit_length() - self.sub_bucket_bits
+        return self.sub_bucket_count + (shift - 1) * self.sub_bucket_half + (value >> shift) - self.sub_bucket_half
+
+    def value_at(self, index):
+        """Midpoint of the values that fall in bucket `index`."""
+        if index < self.sub_bucket_count:
+            return index
+        shift, sub_index = divmod(index - self.sub_bucket_count, self.sub_bucket_half)
+        shift += 1
+        return ((sub_index + self.sub_bucket_half) << shift) + (1 << (shift - 1))
+
+    def record(self, value):
+        if value < 0:
+            value = 0
+        index = self.index_of(value)
+        if index > self.max_index:
+            index = self.max_index
+        self.counts[index] += 1
+        if not self.count or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.count += 1
+        self.total += value
+
+    def add(self, other):
+        """Merge the counts of a histogram with the same bucket layout into this one."""
+        if not other.count:
+            return
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        if not self.count or other.min < self.min:
+            self.min = other.min
+        if other.max > self.max:
+            self.max = other.max
+        self.count += other.count
+        self.total += other.total
+
+    def percentile(self, percent):
+        if not self.count:
+            return 0
+        target = max(1, -(-self.count * percent // 100))  # Rank of the value, rounded up
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self.value_at(index), self.max)
+        return self.max
+
+    def summary(self):
+        """Count, mean, min, max and PERCENTILES in milliseconds."""
+        result = {
+            'count': self.count,
+            'mean_ms': self.total / self.count / 1e6 if self.count else 0.0,
+            'min_ms': self.min / 1e6,
+            'max_ms': self.max / 1e6,
+        }
+        for percent in PERCENTILES:
+            result[f'p{percent:g}_ms'] = self.percentile(percent) / 1e6
+        return result
+
+
+class PlaybackTelemetry:
+    """Per-event timing of a playback run, aggregated by opcode.
+
+    For every injected step the scheduler deadline, the time the injection
+    started and the time it returned are recorded into fixed-size lateness and
+    call-duration histograms, plus a rolling trace of the last TRACE_CAPACITY
+    steps. Nothing is allocated per event, so it can stay on for every run.
+    """
+
+    def __init__(self, opcode_count=OPCODE_COUNT, trace_capacity=TRACE_CAPACITY):
+        self.lateness = [LatencyHistogram() for _ in range(opcode_count)]
+        self.call_time = [LatencyHistogram() for _ in range(opcode_count)]
+        self.trace_capacity = trace_capacity
+        self.trace_ops = array('B', bytes(trace_capacity))
+        self.trace_scheduled = array('d', bytes(8 * trace_capacity))
+        self.trace_started = array('d', bytes(8 * trace_capacity))
+        self.trace_finished = array('d', bytes(8 * trace_capacity))
+        self.reset()
+
+    def reset(self):
+        for histogram in self.lateness + self.call_time:
+            histogram.reset()
+        self.events = 0
+        self.start_time = 0.0
+
+    def start(self, start_time):
+        """Begin a run whose step offsets are relative to `start_time` (a perf_counter value)."""
+        self.reset()
+        self.start_time = start_time
+
+    def record(self, op, offset, started, finished):
+        """Record one step scheduled at `offset` that was injected from `started` to `finished`."""
+        self.lateness[op].record(int((started - self.start_time - offset) * 1e9))
+        self.call_time[op].record(int((finished - started) * 1e9))
+        slot = self.events % self.trace_capacity
+        self.trace_ops[slot] = op
+        self.trace_scheduled[slot] = offset
+        self.trace_started[slot] = started - self.start_time
+        self.trace_finished[slot] = finished - self.start_time
+        self.events += 1
+
+    def trace(self):
+        """The most recent steps in order, as (opcode, scheduled, started, finished) offsets in seconds."""
+        count = min(self.events, self.trace_capacity)
+        first = self.events - count
+        return [(self.trace_ops[i % self.trace_capacity], self.trace_scheduled[i % self.trace_capacity],
+                 self.trace_started[i % self.trace_capacity], self.trace_finished[i % self.trace_capacity])
+                for i in range(first, self.events)]
+
+    def summary(self):
+        """Lateness and call-duration histogram summaries per event kind and overall."""
+        overall_lateness = LatencyHistogram()
+        overall_call_time = LatencyHistogram()
+        kinds = {}
+        for op, (lateness, call_time) in enumerate(zip(self.lateness, self.call_time)):
+            if not lateness.count:
+                continue
+            kinds[OP_NAMES[op]] = {'lateness': lateness.summary(), 'call_time': call_time.summary()}
+            overall_lateness.add(lateness)
+            overall_call_time.add(call_time)
+        return {
+            'events': self.events,
+            'lateness': overall_lateness.summary(),
+            'call_time': overall_call_time.summary(),
+            'kinds': kinds,
+        }
+
+
+def telemetry_path(macro_file):
+    return macro_file + TELEMETRY_EXTENSION
+
+
+def write_summary(macro_file, telemetry, drift_report=None, playback_speed=1.0):
+    """Write the run summary next to `macro_file` and return it."""
+    summary = {
+        'macro': os.path.basename(macro_file),
+        'finished': datetime.now().isoformat(timespec='seconds'),
+        'playback_speed': playback_speed,
+    }
+    if drift_report is not None:
+        summary['drift'] = drift_report
+    summary.update(telemetry.summary())
+    with open(telemetry_path(macro_file), 'w') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def format_telemetry(summary):
+    """One-line digest for the status bar: overall lateness and the slowest kind."""
+    lateness = summary['lateness']
+    text = (f"{summary['events']} events, late p50 {lateness['p50_ms']:.2f} ms / "
+            f"p99 {lateness['p99_ms']:.2f} ms / max {lateness['max_ms']:.2f} ms")
+    if summary['kinds']:
+        kind, stats = max(summary['kinds'].items(), key=lambda item: item[1]['call_time']['p99_ms'])
+        text += f", slowest {kind} p99 {stats['call_time']['p99_ms']:.2f} ms"
+    return text
@@ -0,0 +1,68 @@
+import queue
+import threading
+
+# How often the Tk main loop drains the channel; also the cap on UI update rate
+DRAIN_INTERVAL_MS = 50
+
+
+class ProgressChannel:
+    """Hands work and progress from worker threads to the Tk main loop.
+
+    post() queues a call to run on the main thread, in order. publish()
+    stores the latest value for a key; only the newest value per key is
+    delivered to its subscriber on each drain, so a 1 kHz producer still
+    causes at most one UI update per DRAIN_INTERVAL_MS. Both are safe to
+    call from any thread and never touch Tk themselves.
+    """
+
+    def __init__(self, root, interval_ms=DRAIN_INTERVAL_MS):
+        self.root = root
+        self.interval_ms = interval_ms
+        self.calls = queue.SimpleQueue()
+        self.latest = {}
+        self.lock = threading.Lock()
+        self.subscribers = {}
+        self.after_id = None
+
+    def post(self, callback, *args, **kwargs):
+        self.calls.put((callback, args, kwargs))
+
+    def publish(self, key, value):
+        with self.lock:
+            self.latest[key] = value
+
+    def subscribe(self, key, callback):
+        """Call `callback(value)` on the main thread with the newest value published for `key`."""
+        self.subscribers[key] = callback
+
+    def start(self):
+        if self.after_id is None:
+            self.after_id = self.root.after(self.interval_ms, self._drain)
+
+    def stop(self):
+        if self.after_id is not None:
+            self.root.after_cancel(self.after_id)
+            self.after_id = None
+
+    def _drain(self):
+        # Reschedule first: a posted call may open a modal dialog, which runs a
+        # nested event loop that should keep draining
+        self.after_id = self.root.after(self.interval_ms, self._drain)
+        while True:
+            try:
+                callback, args, kwargs = self.calls.get_nowait()
+            except queue.Empty:
+                break
+            callback(*args, **kwargs)
+
+        with self.lock:
+            latest, self.latest = self.latest, {}
+        for key, value in latest.items():
+            callback = self.subscribers.get(key)
+            if callback is not None:
+                callback(value)
+
+
+def format_clock(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes}:{seconds:02d}"
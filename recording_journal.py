@@ -0,0 +1,218 @@
+import itertools
+import os
+import queue
+import threading
+from datetime import datetime
+
+from macro_format import (BINARY_EXTENSION, BLOCK_SIZE, COMPRESSIONS, JSON_EXTENSION, JournalWriter,
+                          MacroFormatError, MacroWriter, finish_binary, iter_event_blocks, load_events,
+                          read_header, save_events)
+
+# Recordings in progress are written to "<macro dir>/recording_<timestamp>_<pid>_<n>.journal";
+# the extension keeps them out of the macro list
+JOURNAL_EXTENSION = '.journal'
+
+# A live journal's process holds an exclusive lock on "<journal>.lock" until the
+# journal is saved or discarded; recover_journals() leaves locked journals alone
+LOCK_EXTENSION = '.lock'
+
+# Full blocks waiting for the writer thread before the recording thread has to wait
+MAX_PENDING_BLOCKS = 4
+
+# Prefix of the macros that unfinished journals are recovered into
+RECOVERED_PREFIX = 'recovered_'
+
+# Numbers the journals of this process, so recordings started in the same second get their own
+_journal_numbers = itertools.count(1)
+
+
+def _lock(path):
+    """Open `path` and hold an exclusive lock on it; returns the open file, or None if another handle holds it.
+
+    The lock belongs to the open file, so it is released when the file is
+    closed or its process dies, and it also excludes other handles in the
+    same process.
+    """
+    f = open(path, 'a+b')
+    try:
+        if os.name == 'nt':
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+
+def _unlock(f):
+    """Release a lock taken with _lock() and remove its file."""
+    f.close()
+    try:
+        os.remove(f.name)
+    except OSError:  # Already taken by another process, which removes it itself
+        pass
+
+
+class RecordingJournal:
+    """Streams a recording to disk while it is being made.
+
+    The recording thread keeps appending to its own EventBuffer and calls
+    collect() after each event; every time the buffer fills a block, its
+    events are handed to a writer thread that appends them to the journal
+    file and flushes it. At most MAX_PENDING_BLOCKS blocks wait in memory,
+    so memory use does not grow with the length of the recording, and a
+    crash loses at most the events that had not filled a block yet.
+
+    The journal is locked (see LOCK_EXTENSION) from the moment it is created
+    until save_as() or discard(), so other recorders never recover it.
+    """
+
+    def __init__(self, macro_dir, compression='zlib', block_size=BLOCK_SIZE, max_pending=MAX_PENDING_BLOCKS):
+        os.makedirs(macro_dir, exist_ok=True)
+        name = f"recording_{datetime.now():%Y%m%d_%H%M%S}_{os.getpid()}_{next(_journal_numbers)}"
+        self.path = os.path.join(macro_dir, name + JOURNAL_EXTENSION)
+        # Taken before the journal exists, so recovery never sees it unlocked
+        self.lock = _lock(self.path + LOCK_EXTENSION)
+        if self.lock is None:
+            raise OSError(f"journal {self.path} is locked by another recorder")
+        self.compression = compression
+        self.block_size = block_size
+        self.writer = JournalWriter(self.path, compression, block_size)
+        self.blocks = queue.Queue(maxsize=max_pending)
+        self.collected = 0
+        self.error = None
+        self.closed = False
+        self.thread = threading.Thread(target=self._write, name="journal", daemon=True)
+        self.thread.start()
+
+    def collect(self, events):
+        """Hand `events` to the writer once they fill a block, leaving the buffer empty."""
+        if len(events) >= self.block_size:
+            self.collected += len(events)
+            self.blocks.put(events.detach())
+
+    def event_count(self, events=()):
+        """Events recorded so far, including those still in `events`."""
+        return self.collected + len(events)
+
+    def _write(self):
+        while True:
+            events = self.blocks.get()
+            if events is None:
+                return
+            if self.error is None:
+                try:
+                    self.writer.write_events(events)
+                except OSError as e:
+                    # Keep draining so the recording thread never blocks on a dead writer
+                    self.error = e
+
+    def close(self, events=None):
+        """Write the rest of `events`, then close the journal; it is a complete binary macro afterwards."""
+        if self.closed:
+            return
+        self.closed = True
+        if events:
+            self.collected += len(events)
+            self.blocks.put(events.detach())
+        self.blocks.put(None)
+        self.thread.join()
+        self.writer.close()
+        if self.error is not None:
+            raise self.error
+
+    def save_as(self, filename, compression='zlib', events=None):
+        """Turn the closed journal into the macro `filename`; see finalize_journal().
+
+        With `events` (e.g. a simplified copy of the recording) those are
+        saved instead and the journal is removed.
+        """
+        if events is not None:
+            save_events(filename, events, compression)
+            self.discard()
+        else:
+            finalize_journal(self.path, filename, compression)
+            self._release()
+
+    def discard(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._release()
+
+    def _release(self):
+        if self.lock is not None:
+            _unlock(self.lock)
+            self.lock = None
+
+
+def finalize_journal(journal_file, filename, compression='zlib'):
+    """Move a closed journal to `filename`, converting it if needed.
+
+    Binary macros with the journal's compression are a plain rename. Other
+    compressions are re-encoded block by block; JSON macros have to be
+    built in memory.
+    """
+    if filename.endswith(JSON_EXTENSION):
+        save_events(filename, load_events(journal_file), compression)
+        os.remove(journal_file)
+        return
+    with open(journal_file, 'rb') as f:
+        same_compression = read_header(f)['compression'] == COMPRESSIONS[compression]
+    if same_compression:
+        os.replace(journal_file, filename)
+        return
+    with MacroWriter(filename, compression) as writer:
+        for block in iter_event_blocks(journal_file):
+            if block:
+                writer.write_block(block, 0, len(block))
+    os.remove(journal_file)
+
+
+def recover_journals(macro_dir):
+    """Save the journals of recordings that never finished as macros.
+
+    Called on startup: each journal left in `macro_dir` (the app crashed or
+    was closed while recording) is closed with finish_binary() and renamed
+    to "recovered_<timestamp>_<pid>_<n>.mrec". Empty or unreadable journals
+    are removed. Journals still locked by a live recorder, in this process
+    or another, are skipped, as are files the OS won't let us move or
+    remove. Returns the paths of the recovered macros.
+    """
+    recovered = []
+    if not os.path.exists(macro_dir):
+        return recovered
+    for file in sorted(os.listdir(macro_dir)):
+        stem, extension = os.path.splitext(file)
+        if extension != JOURNAL_EXTENSION:
+            continue
+        path = os.path.join(macro_dir, file)
+        try:
+            lock = _lock(path + LOCK_EXTENSION)
+        except OSError:
+            continue
+        if lock is None:
+            continue
+        try:
+            if not os.path.exists(path):  # Saved or discarded since the directory was listed
+                continue
+            try:
+                event_count = finish_binary(path)
+            except (OSError, MacroFormatError):
+                event_count = 0
+            try:
+                if not event_count:
+                    os.remove(path)
+                    continue
+                filename = os.path.join(macro_dir, RECOVERED_PREFIX + stem.split('_', 1)[-1] + BINARY_EXTENSION)
+                os.replace(path, filename)
+            except OSError:
+                continue
+            recovered.append(filename)
+        finally:
+            _unlock(lock)
+    return recovered
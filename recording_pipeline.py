@@ -0,0 +1,223 @@
+from collections import namedtuple
+
+# Event sources a filter stage can subscribe to
+SOURCES = ('keyboard', 'button', 'move', 'wheel')
+
+
+class RecordingConfig(namedtuple('RecordingConfig', [
+        'record_keyboard', 'record_mouse', 'record_mouse_movement', 'record_mouse_clicks',
+        'record_mouse_scroll', 'minimum_mouse_movement', 'stop_key', 'stages'])):
+    """Immutable snapshot of the recording settings, taken when a recording starts.
+
+    `stages` is a tuple of FilterStage objects applied after the built-in
+    device and movement filters have been decided.
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, record_keyboard=True, record_mouse=True, record_mouse_movement=True,
+                record_mouse_clicks=True, record_mouse_scroll=True, minimum_mouse_movement=0,
+                stop_key='esc', stages=()):
+        return super().__new__(cls, record_keyboard, record_mouse, record_mouse_movement, record_mouse_clicks,
+                               record_mouse_scroll, minimum_mouse_movement, stop_key, tuple(stages))
+
+    @classmethod
+    def from_settings(cls, recording_settings, stop_key='esc', stages=()):
+        """Snapshot the GUI's "recording" settings dict."""
+        return cls(
+            record_keyboard=recording_settings["record_keyboard"],
+            record_mouse=recording_settings["record_mouse"],
+            record_mouse_movement=recording_settings["record_mouse_movement"],
+            record_mouse_clicks=recording_settings["record_mouse_clicks"],
+            record_mouse_scroll=recording_settings["record_mouse_scroll"],
+            minimum_mouse_movement=recording_settings["minimum_mouse_movement"],
+            stop_key=stop_key,
+            stages=stages,
+        )
+
+
+class FilterStage:
+    """A user-supplied recording filter.
+
+    `sources` lists the event kinds the stage sees (see SOURCES); accept()
+    gets the hook event and the cursor position and returns False to drop
+    the event. Stages are only wired into the chains of their sources.
+    """
+
+    sources = SOURCES
+
+    def accept(self, event, x, y):
+        return True
+
+
+class RegionOfInterest(FilterStage):
+    """Only record mouse events inside a screen rectangle."""
+
+    sources = ('button', 'move', 'wheel')
+
+    def __init__(self, left, top, right, bottom):
+        self.left = left
+        self.top = top
+        self.right = right
+        self.bottom = bottom
+
+    def accept(self, event, x, y):
+        return self.left <= x < self.right and self.top <= y < self.bottom
+
+
+class KeyAllowlist(FilterStage):
+    """Only record presses of the given keys."""
+
+    sources = ('keyboard',)
+
+    def __init__(self, keys):
+        self.keys = frozenset(keys)
+
+    def accept(self, event, x, y):
+        return event.name in self.keys
+
+
+class RecordingPipeline:
+    """Filter-and-store chains specialized for one RecordingConfig.
+
+    Each hook event class maps straight to the handler for its source. The
+    handlers are built once from the config and contain only the enabled
+    stages, so disabled features and unused user stages cost nothing per
+    event. Handlers take (event, time in ns) and append to `events`.
+    """
+
+    def __init__(self, config, events, backend, on_stop=None):
+        self.config = config
+        self.events = events
+        self.on_stop = on_stop
+        # The stop key is matched by scan code; keys the backend has no codes for fall back to the name
+        self.stop_scan_codes = frozenset(backend.scan_codes(config.stop_key)) if config.stop_key else frozenset()
+        self.cursor = backend.position()
+        self.last_move = None
+
+        self.handlers = {}
+        if config.record_keyboard:
+            self.handlers[backend.keyboard_event_class] = self._keyboard_handler()
+        elif on_stop is not None and config.stop_key:
+            # Keys aren't recorded, but the stop key still ends the recording
+            self.handlers[backend.keyboard_event_class] = self._stop_key_handler()
+        if config.record_mouse:
+            # Moves are always dispatched so button events can use the cursor position
+            self.handlers[backend.move_event_class] = self._move_handler()
+            if config.record_mouse_clicks:
+                self.handlers[backend.button_event_class] = self._button_handler()
+            if config.record_mouse_scroll:
+                self.handlers[backend.wheel_event_class] = self._wheel_handler()
+
+    def process(self, event, time_ns):
+        handler = self.handlers.get(type(event))
+        if handler is not None:
+            handler(event, time_ns)
+
+    def _stage_check(self, source):
+        """A single accept(event, x, y) for the user stages of `source`, or None if there are none."""
+        accepts = tuple(stage.accept for stage in self.config.stages if source in stage.sources)
+        if not accepts:
+            return None
+        if len(accepts) == 1:
+            return accepts[0]
+
+        def check(event, x, y):
+            for accept in accepts:
+                if not accept(event, x, y):
+                    return False
+            return True
+        return check
+
+    def _keyboard_handler(self):
+        add_keyboard = self.events.add_keyboard
+        stop_key = self.config.stop_key
+        stop_scan_codes = self.stop_scan_codes
+        on_stop = self.on_stop
+        check = self._stage_check('keyboard')
+        if on_stop is None:
+            stop_key = None
+            stop_scan_codes = frozenset()
+
+        if stop_scan_codes:
+            def keyboard(event, time_ns):
+                if event.event_type != 'down':
+                    return
+                if event.scan_code in stop_scan_codes:
+                    on_stop()
+                    return
+                if check is None or check(event, *self.cursor):
+                    add_keyboard('press', event.name, time_ns)
+        else:
+            def keyboard(event, time_ns):
+                if event.event_type != 'down':
+                    return
+                if stop_key is not None and event.name == stop_key:
+                    on_stop()
+                    return
+                if check is None or check(event, *self.cursor):
+                    add_keyboard('press', event.name, time_ns)
+        return keyboard
+
+    def _stop_key_handler(self):
+        stop_key = self.config.stop_key
+        stop_scan_codes = self.stop_scan_codes
+        on_stop = self.on_stop
+
+        def keyboard(event, time_ns):
+            if event.event_type != 'down':
+                return
+            if event.scan_code in stop_scan_codes if stop_scan_codes else event.name == stop_key:
+                on_stop()
+        return keyboard
+
+    def _button_handler(self):
+        add_mouse = self.events.add_mouse
+        check = self._stage_check('button')
+
+        # Button events carry no position, so use the last known one
+        def button(event, time_ns):
+            x, y = self.cursor
+            if check is None or check(event, x, y):
+                add_mouse(event.event_type, event.button, x, y, time_ns)
+        return button
+
+    def _wheel_handler(self):
+        add_scroll = self.events.add_scroll
+        check = self._stage_check('wheel')
+
+        def wheel(event, time_ns):
+            if check is None or check(event, *self.cursor):
+                add_scroll(event.delta, time_ns)
+        return wheel
+
+    def _move_handler(self):
+        add_move = self.events.add_move
+        check = self._stage_check('move')
+        record = self.config.record_mouse_movement
+        threshold_squared = self.config.minimum_mouse_movement ** 2
+
+        if not record:
+            def move(event, time_ns):
+                self.cursor = (event.x, event.y)
+        elif threshold_squared <= 0:
+            def move(event, time_ns):
+                x, y = self.cursor = (event.x, event.y)
+                if check is None or check(event, x, y):
+                    add_move(x, y, time_ns)
+        else:
+            # The first move only sets the reference point for the threshold
+            def move(event, time_ns):
+                x, y = self.cursor = (event.x, event.y)
+                if check is not None and not check(event, x, y):
+                    return
+                last = self.last_move
+                if last is None:
+                    self.last_move = (x, y)
+                    return
+                dx = x - last[0]
+                dy = y - last[1]
+                if dx * dx + dy * dy >= threshold_squared:
+                    add_move(x, y, time_ns)
+                    self.last_move = (x, y)
+        return move
@@ -0,0 +1,162 @@
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from capture_clock import CaptureClock
+from event_store import COLUMNS, KEYBOARD, MOUSE, NO_ID, EventBuffer, StringTable
+from recording_pipeline import RecordingPipeline
+from ring_buffer import RingBuffer, RingConsumer
+
+# The always-on capture is never watched live, so its consumer can wake up far less
+# often than an interactive recording's; the rings hold ~65k events in between
+REPLAY_POLL_INTERVAL = 0.05
+
+
+class ReplayBuffer(EventBuffer):
+    """An EventBuffer of fixed capacity that keeps only the most recent events.
+
+    Every column is allocated for `capacity` events up front, so nbytes() is
+    known when the buffer is created and never grows; once it is full each
+    new event overwrites the oldest one. The add_* methods are EventBuffer's,
+    so a RecordingPipeline can write into it, and snapshot() copies the
+    events out in order from any thread while capture goes on.
+    """
+
+    def __init__(self, capacity):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        super().__init__()
+
+    def clear(self):
+        template = EventBuffer()
+        for column in COLUMNS:
+            typecode = getattr(template, column).typecode
+            setattr(self, column, array(typecode, bytes(array(typecode).itemsize * self.capacity)))
+        self.count = 0  # Events ever added
+
+    def detach(self):
+        raise TypeError("a ReplayBuffer can't be detached; use snapshot()")
+
+    def _append(self, type_code, kind, name, x, y, delta, time_ns, flags):
+        kind_id = self.kind_table.intern(kind)
+        name_id = NO_ID if name is None else self.name_table.intern(name)
+        with self.lock:
+            slot = self.count % self.capacity
+            self.types[slot] = type_code
+            self.kinds[slot] = kind_id
+            self.flags[slot] = flags
+            self.ids[slot] = name_id
+            self.xs[slot] = x
+            self.ys[slot] = y
+            self.deltas[slot] = delta
+            self.times[slot] = time_ns
+            self.count += 1
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def event(self, index):
+        return super().event((self.count - len(self) + index) % self.capacity)
+
+    def duration(self):
+        """Time between the oldest and the newest event held, in seconds."""
+        if not self.count:
+            return 0.0
+        newest = self.times[(self.count - 1) % self.capacity]
+        oldest = self.times[(self.count - len(self)) % self.capacity]
+        return (newest - oldest) / 1e9
+
+    def snapshot(self, max_age=None):
+        """The events held, oldest first, as an EventBuffer timed from its first event.
+
+        With `max_age` only the events of the last `max_age` seconds before
+        the newest one are kept. The columns are copied under the lock, so
+        the recording thread waits at most for one copy of the buffer.
+        """
+        with self.lock:
+            first = self.count - len(self)
+            start = first % self.capacity
+            columns = {}
+            for column in COLUMNS:
+                values = getattr(self, column)
+                if self.count > self.capacity:
+                    columns[column] = values[start:] + values[:start]
+                else:
+                    columns[column] = values[:self.count]
+        events = EventBuffer()
+        events.kind_table = StringTable(self.kind_table.strings[:])
+        events.name_table = StringTable(self.name_table.strings[:])
+        times = columns['times']
+        begin = 0
+        if max_age is not None and len(times):
+            begin = bisect_left(times, times[-1] - round(max_age * 1e9))
+        for column, values in columns.items():
+            setattr(events, column, values[begin:] if begin else values)
+        if len(events):
+            origin = events.times[0]
+            events.times = array('q', (t - origin for t in events.times))
+        return events
+
+
+class ReplayCapture:
+    """Always-on recording of the last `max_age` seconds (at most `capacity` events) of input.
+
+    Runs its own hooks, rings, consumer thread and RecordingPipeline, so it
+    keeps capturing while normal recordings start and stop; the stop key
+    has no effect on it. Hook callbacks cost the same as a normal
+    recording's: a timestamp and a ring push.
+    """
+
+    def __init__(self, backend, config, capacity, max_age=None, interval=REPLAY_POLL_INTERVAL):
+        self.backend = backend
+        self.config = config
+        self.max_age = max_age
+        self.interval = interval
+        self.buffer = ReplayBuffer(capacity)
+        self.keyboard_hook = None
+        self.mouse_hook = None
+        self.consumer = None
+
+    def start(self):
+        self.capture_clock = CaptureClock()
+        self.pipeline = RecordingPipeline(self.config, self.buffer, self.backend)
+        self.keyboard_ring = RingBuffer()
+        self.mouse_ring = RingBuffer()
+        self.consumer = RingConsumer([self.keyboard_ring, self.mouse_ring], self._process, self.interval)
+        self.consumer.start()
+        if self.config.record_keyboard:
+            self.keyboard_hook = self.backend.hook_keyboard(self._on_keyboard_event)
+        if self.config.record_mouse:
+            self.mouse_hook = self.backend.hook_mouse(self._on_mouse_event)
+
+    def _on_keyboard_event(self, event):
+        self.keyboard_ring.push((time.perf_counter_ns(), KEYBOARD, event))
+
+    def _on_mouse_event(self, event):
+        self.mouse_ring.push((time.perf_counter_ns(), MOUSE, event))
+
+    def _process(self, item):
+        received, _, event = item
+        self.pipeline.process(event, self.capture_clock.timestamp(event, received))
+
+    def snapshot(self):
+        """The captured events, see ReplayBuffer.snapshot().
+
+        Events from the last REPLAY_POLL_INTERVAL may still be queued in the
+        rings and are not included.
+        """
+        return self.buffer.snapshot(self.max_age)
+
+    def stop(self):
+        if self.keyboard_hook is not None:
+            self.backend.unhook_keyboard(self.keyboard_hook)
+            self.keyboard_hook = None
+        if self.mouse_hook is not None:
+            self.backend.unhook_mouse(self.mouse_hook)
+            self.mouse_hook = None
+        if self.consumer is not None:
+            self.consumer.stop()
+            self.consumer = None
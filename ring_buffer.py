@@ -0,0 +1,121 @@
+import heapq
+import threading
+from operator import itemgetter
+
+
+class RingBuffer:
+    """Preallocated single-producer/single-consumer ring of raw event tuples.
+
+    The producer only ever writes `head` and the consumer only ever writes
+    `tail`, and a slot is filled before `head` is published, so no lock is
+    needed under the GIL. When the ring is full new items are dropped and
+    counted in `overflows` rather than blocking the hook thread.
+    """
+
+    def __init__(self, capacity=65536):
+        if capacity & (capacity - 1):
+            raise ValueError("Ring buffer capacity must be a power of two")
+        self.capacity = capacity
+        self.mask = capacity - 1
+        self.slots = [None] * capacity
+        self.head = 0
+        self.tail = 0
+        self.overflows = 0
+        self.high_water = 0
+
+    def push(self, item):
+        head = self.head
+        depth = head - self.tail
+        if depth >= self.capacity:
+            self.overflows += 1
+            return False
+        self.slots[head & self.mask] = item
+        self.head = head + 1
+        if depth >= self.high_water:
+            self.high_water = depth + 1
+        return True
+
+    def pop_batch(self, max_items=4096):
+        tail = self.tail
+        count = min(self.head - tail, max_items)
+        if count <= 0:
+            return []
+        slots = self.slots
+        mask = self.mask
+        items = []
+        for index in range(tail, tail + count):
+            items.append(slots[index & mask])
+            slots[index & mask] = None
+        self.tail = tail + count
+        return items
+
+    def depth(self):
+        return self.head - self.tail
+
+    def stats(self):
+        return {
+            'depth': self.depth(),
+            'high_water': self.high_water,
+            'overflows': self.overflows,
+            'pushed': self.head,
+        }
+
+
+class RingConsumer:
+    """Background thread that drains one or more rings into a handler.
+
+    Items must be tuples whose first element is a timestamp; batches from
+    different rings are merged in timestamp order before being handled.
+    """
+
+    def __init__(self, rings, handler, interval=0.005, batch_size=4096):
+        self.rings = rings
+        self.handler = handler
+        self.interval = interval
+        self.batch_size = batch_size
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.is_set():
+            if not self.drain():
+                self.stopped.wait(self.interval)
+
+    def drain(self):
+        batches = [ring.pop_batch(self.batch_size) for ring in self.rings]
+        batches = [batch for batch in batches if batch]
+        if not batches:
+            return 0
+        items = batches[0] if len(batches) == 1 else heapq.merge(*batches, key=itemgetter(0))
+        handler = self.handler
+        count = 0
+        for item in items:
+            handler(item)
+            count += 1
+        return count
+
+    def stop(self):
+        """Stop the thread and handle whatever is still queued.
+
+        When called from the handler itself (e.g. on a stop hotkey) the
+        remaining items are left for the current drain to finish.
+        """
+        self.stopped.set()
+        if self.thread is threading.current_thread():
+            return
+        if self.thread.is_alive():
+            self.thread.join()
+        while self.drain():
+            pass
+
+    def stats(self):
+        stats = [ring.stats() for ring in self.rings]
+        return {
+            'depth': sum(s['depth'] for s in stats),
+            'high_water': max((s['high_water'] for s in stats), default=0),
+            'overflows': sum(s['overflows'] for s in stats),
+            'pushed': sum(s['pushed'] for s in stats),
+        }
@@ -0,0 +1,38 @@
+import time
+
+# Taken when this module is first imported; import it before anything else
+PROCESS_START = time.perf_counter()
+
+# Target time from launch to the first painted window, in seconds
+STARTUP_BUDGET = 0.3
+
+
+class StartupTimer:
+    """Wall time of each startup phase, measured from PROCESS_START."""
+
+    def __init__(self, start=PROCESS_START):
+        self.start = start
+        self.marks = []
+
+    def mark(self, phase):
+        """Record that `phase` just finished."""
+        self.marks.append((phase, time.perf_counter()))
+
+    def phases(self):
+        """(phase, seconds) for each marked phase, in order."""
+        result = []
+        previous = self.start
+        for phase, at in self.marks:
+            result.append((phase, at - previous))
+            previous = at
+        return result
+
+    def total(self):
+        return self.marks[-1][1] - self.start if self.marks else 0.0
+
+    def format(self):
+        phases = ", ".join(f"{phase} {seconds * 1000:.0f} ms" for phase, seconds in self.phases())
+        text = f"Startup took {self.total() * 1000:.0f} ms ({phases})"
+        if self.total() > STARTUP_BUDGET:
+            text += f", over the {STARTUP_BUDGET * 1000:.0f} ms budget"
+        return text
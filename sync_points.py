@@ -0,0 +1,230 @@
+import hashlib
+import threading
+import time
+from collections import namedtuple
+from functools import cached_property
+
+from event_store import EventBuffer
+
+# A sync condition is checked at once, then after SYNC_POLL_INTERVAL seconds, with the
+# interval growing by SYNC_BACKOFF after every failed check up to SYNC_MAX_POLL_INTERVAL
+SYNC_POLL_INTERVAL = 0.01
+SYNC_MAX_POLL_INTERVAL = 0.25
+SYNC_BACKOFF = 1.5
+
+# Seconds a sync point waits for its condition unless it says otherwise
+DEFAULT_SYNC_TIMEOUT = 10.0
+
+
+class SyncTimeout(Exception):
+    """A sync point's condition was not met within its timeout."""
+
+
+def region_digest(pixels):
+    """Short hash of the raw RGB bytes of a screen region, as stored in pixel conditions."""
+    return hashlib.blake2b(pixels, digest_size=8).hexdigest()
+
+
+class ConditionProvider:
+    """Everything sync conditions read from the desktop.
+
+    Conditions only go through these methods, so playback can be tested
+    against FakeConditionProvider instead of a real screen.
+    """
+
+    def window_titles(self):
+        """Titles of the visible top-level windows."""
+        raise NotImplementedError
+
+    def grab(self, x, y, width, height):
+        """Raw RGB bytes of a screen region, row by row."""
+        raise NotImplementedError
+
+
+class SystemConditionProvider(ConditionProvider):
+    """The real desktop: window titles through pywin32, pixels through Pillow's ImageGrab.
+
+    Both are only loaded the first time a condition is checked.
+    """
+
+    @cached_property
+    def win32gui(self):
+        import win32gui
+        return win32gui
+
+    @cached_property
+    def image_grab(self):
+        from PIL import ImageGrab
+        return ImageGrab
+
+    def window_titles(self):
+        win32gui = self.win32gui
+        titles = []
+
+        def collect(hwnd, _):
+            if win32gui.IsWindowVisible(hwnd):
+                title = win32gui.GetWindowText(hwnd)
+                if title:
+                    titles.append(title)
+            return True
+
+        win32gui.EnumWindows(collect, None)
+        return titles
+
+    def grab(self, x, y, width, height):
+        image = self.image_grab.grab(bbox=(x, y, x + width, y + height), all_screens=True)
+        return image.convert('RGB').tobytes()
+
+
+class FakeConditionProvider(ConditionProvider):
+    """In-memory desktop for tests: a list of window titles and an RGB frame buffer.
+
+    Tests change the desktop from any thread with open_window(),
+    close_window() and fill(); `checks` counts the reads.
+    """
+
+    def __init__(self, titles=(), screen_size=(1920, 1080)):
+        self.lock = threading.Lock()
+        self.titles = list(titles)
+        self.width, self.height = screen_size
+        self.pixels = bytearray(self.width * self.height * 3)
+        self.checks = 0
+
+    def open_window(self, title):
+        with self.lock:
+            self.titles.append(title)
+
+    def close_window(self, title):
+        with self.lock:
+            self.titles.remove(title)
+
+    def fill(self, x, y, width, height, color):
+        """Paint a region in one (r, g, b) color."""
+        row = bytes(color) * width
+        with self.lock:
+            for line in range(y, y + height):
+                start = (line * self.width + x) * 3
+                self.pixels[start:start + len(row)] = row
+
+    def window_titles(self):
+        with self.lock:
+            self.checks += 1
+            return list(self.titles)
+
+    def grab(self, x, y, width, height):
+        with self.lock:
+            self.checks += 1
+            rows = []
+            for line in range(y, y + height):
+                start = (line * self.width + x) * 3
+                rows.append(self.pixels[start:start + width * 3])
+            return b''.join(rows)
+
+
+class WindowCondition(namedtuple('WindowCondition', ['title'])):
+    """Met while a visible top-level window's title contains `title`."""
+
+    __slots__ = ()
+    kind = 'window'
+
+    def text(self):
+        return self.title
+
+    def check(self, provider):
+        return any(self.title in title for title in provider.window_titles())
+
+    def describe(self):
+        return f"window {self.title!r}"
+
+
+class PixelCondition(namedtuple('PixelCondition', ['x', 'y', 'width', 'height', 'digest'])):
+    """Met while a screen region hashes to `digest` (see region_digest())."""
+
+    __slots__ = ()
+    kind = 'pixels'
+
+    @classmethod
+    def capture(cls, provider, x, y, width, height):
+        """A condition on the region as it looks now."""
+        return cls(x, y, width, height, region_digest(provider.grab(x, y, width, height)))
+
+    def text(self):
+        return f"{self.x},{self.y},{self.width},{self.height}:{self.digest}"
+
+    def check(self, provider):
+        return region_digest(provider.grab(self.x, self.y, self.width, self.height)) == self.digest
+
+    def describe(self):
+        return f"pixels {self.width}x{self.height} at ({self.x}, {self.y})"
+
+
+def parse_region(text):
+    """Parse an X,Y,WIDTH,HEIGHT screen region."""
+    try:
+        x, y, width, height = (int(value) for value in text.split(','))
+    except ValueError:
+        raise ValueError(f"invalid region {text!r}, expected X,Y,WIDTH,HEIGHT")
+    if width <= 0 or height <= 0 or x < 0 or y < 0:
+        raise ValueError(f"invalid region {text!r}, expected a position of at least 0 and a positive size")
+    return x, y, width, height
+
+
+def parse_condition(kind, text):
+    """The condition of a sync event from its `event` and `condition` fields."""
+    if kind == WindowCondition.kind:
+        return WindowCondition(text)
+    if kind == PixelCondition.kind:
+        region, _, digest = text.partition(':')
+        if not digest:
+            raise ValueError(f"invalid pixel condition {text!r}, expected X,Y,WIDTH,HEIGHT:HASH")
+        return PixelCondition(*parse_region(region), digest)
+    raise ValueError(f"unknown sync condition {kind!r}")
+
+
+def sync_event(condition, time_s, timeout=DEFAULT_SYNC_TIMEOUT):
+    """The event dict of a sync point on `condition` at `time_s` seconds of a macro."""
+    return {'type': 'sync', 'event': condition.kind, 'condition': condition.text(),
+            'timeout': float(timeout), 'time': time_s}
+
+
+def insert_sync_point(events, event):
+    """A new EventBuffer with the events of `events` and the sync `event` in time order.
+
+    The sync point goes after every event recorded at the same time.
+    """
+    buffer = EventBuffer()
+    pending = event
+    for existing in events:
+        if pending is not None and existing['time'] > pending['time']:
+            buffer.append(pending)
+            pending = None
+        buffer.append(existing)
+    if pending is not None:
+        buffer.append(pending)
+    return buffer
+
+
+def wait_for(condition, provider, timeout, stop=None, interval=SYNC_POLL_INTERVAL,
+             max_interval=SYNC_MAX_POLL_INTERVAL, backoff=SYNC_BACKOFF, clock=time.perf_counter):
+    """Poll `condition` until it is met and return how many checks it took.
+
+    Checks back off from `interval` to `max_interval` seconds, so a
+    condition met quickly is seen within milliseconds while a long wait
+    costs a few checks per second. The waits are on `stop` (a
+    threading.Event): setting it ends the wait early and returns None.
+    Raises SyncTimeout when `timeout` seconds pass first.
+    """
+    if stop is None:
+        stop = threading.Event()
+    deadline = clock() + timeout
+    checks = 0
+    while True:
+        checks += 1
+        if condition.check(provider):
+            return checks
+        remaining = deadline - clock()
+        if remaining <= 0:
+            raise SyncTimeout(f"{condition.describe()} not seen within {timeout:g} s")
+        if stop.wait(min(interval, remaining)):
+            return None
+        interval = min(interval * backoff, max_interval)
@@ -0,0 +1,86 @@
+from collections import namedtuple
+
+import capture_clock
+from capture_clock import MAX_CAPTURE_DELAY_NS, WALL_OFFSET_INTERVAL_NS, CaptureClock, format_capture_delay
+
+Event = namedtuple('Event', ['time'])
+
+
+class FakeClocks:
+    """A monotonic clock and a wall clock `wall_offset` ns ahead of it, both set by hand."""
+
+    def __init__(self):
+        self.now = 0
+        self.wall_offset = 1_700_000_000 * 10**9
+
+    def clock(self):
+        return self.now
+
+    def wall(self):
+        return self.now + self.wall_offset
+
+    def event(self, delay):
+        """An event stamped by the hook `delay` ns before now."""
+        return Event((self.wall() - delay) / 1e9)
+
+
+def new_clock(clocks):
+    return CaptureClock(clocks.clock, wall_clock=clocks.wall, use_event_time=True)
+
+
+def test_event_time_leaves_out_the_capture_delay():
+    clocks = FakeClocks()
+    capture = new_clock(clocks)
+    clocks.now = 10_000_000
+    timestamp = capture.timestamp(clocks.event(300_000), clocks.now)
+    assert abs(timestamp - 9_700_000) < 1000
+    assert capture.summary()['count'] == 1 and capture.fallbacks == 0
+
+
+def test_small_wall_clock_step_is_not_trusted():
+    clocks = FakeClocks()
+    capture = new_clock(clocks)
+    clocks.now = 10_000_000
+    # The wall clock is corrected back by 100 ms, well under a second
+    event = clocks.event(0)._replace(time=clocks.event(0).time - 0.1)
+    assert capture.timestamp(event, clocks.now) == 10_000_000
+    summary = capture.summary()
+    assert summary['fallbacks'] == summary['untrusted'] == 1
+    assert 'out of range' in format_capture_delay(summary)
+
+
+def test_offset_is_measured_again_after_drift():
+    clocks = FakeClocks()
+    capture = new_clock(clocks)
+    # The wall clock drifts ahead of the monotonic clock by more than the trusted bound
+    clocks.now = WALL_OFFSET_INTERVAL_NS + 1
+    clocks.wall_offset -= 2 * MAX_CAPTURE_DELAY_NS
+    timestamp = capture.timestamp(clocks.event(100_000), clocks.now)
+    assert capture.summary()['offset_measures'] == 2 and capture.fallbacks == 0
+    assert abs(timestamp - (clocks.now - 100_000)) < 1000
+
+
+def test_fixed_offset_is_never_measured_again():
+    capture = CaptureClock(lambda: 0, start=0, wall_offset=0, use_event_time=True)
+    capture.timestamp(Event(WALL_OFFSET_INTERVAL_NS * 5 / 1e9), WALL_OFFSET_INTERVAL_NS * 5)
+    assert capture.summary()['offset_measures'] == 0
+
+
+def test_coarse_wall_clock_falls_back_to_the_callback(monkeypatch):
+    info = namedtuple('Info', ['resolution'])(0.015625)  # Windows before Python 3.13
+    monkeypatch.setattr(capture_clock.time, 'get_clock_info', lambda name: info)
+    clocks = FakeClocks()
+    capture = CaptureClock(clocks.clock, wall_clock=clocks.wall)
+    clocks.now = 5_000_000
+    assert capture.timestamp(clocks.event(100_000), clocks.now) == 5_000_000
+    summary = capture.summary()
+    assert summary['coarse_clock'] and summary['fallbacks'] == 1 and summary['untrusted'] == 0
+    assert 'too coarse' in format_capture_delay(summary)
+
+
+def test_timestamps_never_go_backwards():
+    clocks = FakeClocks()
+    capture = new_clock(clocks)
+    clocks.now = 10_000_000
+    first = capture.timestamp(clocks.event(0), clocks.now)
+    assert capture.timestamp(clocks.event(1_000_000), clocks.now) == first
@@ -0,0 +1,87 @@
+from hotkey_registry import HotkeyRegistry
+from input_backend import SimulatedInputBackend
+
+
+class StrictBackend(SimulatedInputBackend):
+    """Refuses hotkeys it can't parse, like `keyboard.add_hotkey` does."""
+
+    def add_hotkey(self, hotkey, callback):
+        if hotkey.startswith('bogus'):
+            raise ValueError(f"unknown key {hotkey!r}")
+        return super().add_hotkey(hotkey, callback)
+
+
+def new_registry(backend=None):
+    backend = backend if backend is not None else StrictBackend()
+    calls = []
+    callbacks = {action: (lambda action=action: calls.append(action)) for action in ('record', 'play', 'stop')}
+    return HotkeyRegistry(backend, callbacks), backend, calls
+
+
+def test_hotkeys_call_their_actions():
+    registry, backend, calls = new_registry()
+    assert registry.apply({'record': 'f7', 'play': 'f8'}) == []
+    backend.trigger_hotkey('f8')
+    backend.trigger_hotkey('f7')
+    assert calls == ['play', 'record']
+    assert registry.hotkey('record') == 'f7' and registry.hotkey('stop') is None
+
+
+def test_rebinding_moves_the_action_to_the_new_hotkey():
+    registry, backend, calls = new_registry()
+    registry.apply({'record': 'f7', 'play': 'f8'})
+    play_handle = registry.registered['play'][1]
+    registry.apply({'record': 'f9', 'play': 'f8'})
+    backend.trigger_hotkey('f7')
+    backend.trigger_hotkey('f9')
+    assert calls == ['record']
+    # The unchanged hotkey kept its registration
+    assert registry.registered['play'][1] is play_handle
+    assert len(backend.hotkeys) == 2
+
+
+def test_swapping_two_hotkeys():
+    registry, backend, calls = new_registry()
+    registry.apply({'record': 'f7', 'play': 'f8'})
+    registry.apply({'record': 'f8', 'play': 'f7'})
+    backend.trigger_hotkey('f7')
+    assert calls == ['play']
+
+
+def test_empty_or_missing_hotkeys_are_unregistered():
+    registry, backend, calls = new_registry()
+    registry.apply({'record': 'f7', 'play': 'f8', 'stop': 'esc'})
+    registry.apply({'record': '', 'play': 'f8'})
+    for hotkey in ('f7', 'f8', 'esc'):
+        backend.trigger_hotkey(hotkey)
+    assert calls == ['play']
+    assert registry.hotkey('record') is None and registry.hotkey('stop') is None
+    assert len(backend.hotkeys) == 1
+
+
+def test_refused_hotkey_keeps_the_previous_one():
+    registry, backend, calls = new_registry()
+    registry.apply({'record': 'f7'})
+    failures = registry.apply({'record': 'bogus+key'})
+    assert [(action, hotkey) for action, hotkey, _ in failures] == [('record', 'bogus+key')]
+    assert isinstance(failures[0][2], ValueError)
+    backend.trigger_hotkey('f7')
+    assert calls == ['record'] and registry.hotkey('record') == 'f7'
+
+
+def test_unknown_actions_are_ignored():
+    registry, backend, _ = new_registry()
+    assert registry.apply({'quit': 'ctrl+q'}) == []
+    assert backend.hotkeys == {}
+
+
+def test_clear_only_removes_the_registry_hotkeys():
+    registry, backend, calls = new_registry()
+    other = []
+    backend.add_hotkey('ctrl+q', lambda: other.append('quit'))
+    registry.apply({'record': 'f7', 'play': 'f8'})
+    registry.clear()
+    for hotkey in ('f7', 'f8', 'ctrl+q'):
+        backend.trigger_hotkey(hotkey)
+    assert calls == [] and other == ['quit']
+    assert registry.registered == {}
@@ -0,0 +1,74 @@
+import pytest
+
+from input_backend import (MOUSEEVENTF_ABSOLUTE, MOUSEEVENTF_MOVE, MOUSEEVENTF_VIRTUALDESK, MOUSEEVENTF_WHEEL,
+                           SendInputBatch, SystemInputBackend)
+from playback_plan import OP_BUTTON_DOWN, OP_BUTTON_UP, OP_CLICK, OP_DOUBLE_CLICK, OP_KEY_TAP, OP_MOVE, OP_SCROLL
+
+MOVE = MOUSEEVENTF_MOVE | MOUSEEVENTF_ABSOLUTE | MOUSEEVENTF_VIRTUALDESK
+LEFT_DOWN, LEFT_UP = 0x0002, 0x0004
+
+# A 1921x1081 virtual desktop, so pixel coordinates scale by 65535 / 1920 and 65535 / 1080
+METRICS = {76: 0, 77: 0, 78: 1921, 79: 1081}
+
+
+class FakeUser32:
+    def __init__(self):
+        self.calls = []
+
+    def send_input(self, count, inputs, size):
+        self.calls.append([(item.mi.dwFlags, item.mi.dx, item.mi.dy, item.mi.mouseData) for item in inputs[:count]])
+        return count
+
+
+def new_batch():
+    user32 = FakeUser32()
+    return SendInputBatch(user32.send_input, METRICS.__getitem__), user32
+
+
+def test_mouse_steps_become_one_send_input_call():
+    batch, user32 = new_batch()
+    for op, args in ((OP_MOVE, (0, 0)), (OP_CLICK, (1920, 1080, 'left')), (OP_BUTTON_DOWN, (960, 540, 'x2')),
+                     (OP_BUTTON_UP, (960, 540, 'x2')), (OP_SCROLL, (-1.0,))):
+        assert batch.add(op, args)
+    batch.flush()
+    assert user32.calls == [[
+        (MOVE, 0, 0, 0),
+        (MOVE, 65535, 65535, 0), (LEFT_DOWN, 0, 0, 0), (LEFT_UP, 0, 0, 0),
+        (MOVE, 32768, 32768, 0), (0x0080, 0, 0, 2),
+        (MOVE, 32768, 32768, 0), (0x0100, 0, 0, 2),
+        (MOUSEEVENTF_WHEEL, 0, 0, 0xffffffff - 119),
+    ]]
+    batch.flush()
+    assert len(user32.calls) == 1
+
+
+def test_double_click_and_unknown_steps():
+    batch, user32 = new_batch()
+    assert batch.add(OP_DOUBLE_CLICK, (0, 0, 'right'))
+    assert not batch.add(OP_KEY_TAP, ('a',))
+    assert not batch.add(OP_CLICK, (0, 0, 'x3'))
+    batch.flush()
+    assert [flags for flags, _, _, _ in user32.calls[0]] == [MOVE, 0x0008, 0x0010, 0x0008, 0x0010]
+
+
+def test_partial_injection_raises():
+    batch = SendInputBatch(lambda count, inputs, size: 0, METRICS.__getitem__)
+    batch.add(OP_MOVE, (1, 1))
+    with pytest.raises(OSError):
+        batch.flush()
+
+
+def test_key_taps_split_the_batch_in_order():
+    taps = []
+
+    class Backend(SystemInputBackend):
+        def tap_key(self, key):
+            taps.append((key, len(user32.calls)))
+
+    backend = Backend()
+    backend.send_input_batch, user32 = new_batch()
+    backend.submit([(0.0, OP_MOVE, (1, 1)), (0.0, OP_MOVE, (2, 2)), (0.0, OP_KEY_TAP, ('a',)),
+                    (0.0, OP_SCROLL, (1.0,))])
+    # The two moves were sent before the key tap, the scroll after it
+    assert [len(call) for call in user32.calls] == [2, 1]
+    assert taps == [('a', 1)]
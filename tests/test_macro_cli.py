@@ -0,0 +1,70 @@
+import os
+
+from event_store import EventBuffer
+from macro_cli import main
+from macro_format import Segment, read_composite, save_composite, save_events
+from macro_index import MacroIndex
+
+
+def save_macro(macro_dir, name, extension='.mrec'):
+    events = EventBuffer([{'type': 'keyboard', 'event': 'press', 'key': 'a', 'time': 0.5}])
+    save_events(os.path.join(macro_dir, name + extension), events)
+
+
+def test_compose_writes_a_composite(tmp_path):
+    save_macro(tmp_path, 'login')
+    assert main(['compose', 'daily', 'login:2', '--dir', str(tmp_path)]) == 0
+    assert read_composite(tmp_path / 'daily.mcomp') == [Segment('login', 2, 0.0)]
+
+
+def test_failed_compose_keeps_the_existing_composite(tmp_path, capsys):
+    save_macro(tmp_path, 'login')
+    save_composite(str(tmp_path / 'daily.mcomp'), [Segment('login')])
+
+    assert main(['compose', 'daily', 'missing', '--dir', str(tmp_path)]) == 1
+    assert main(['compose', 'daily', 'daily', '--dir', str(tmp_path)]) == 1
+    assert read_composite(tmp_path / 'daily.mcomp') == [Segment('login')]
+    assert 'includes itself' in capsys.readouterr().err
+
+
+def test_compose_refuses_a_name_shadowed_by_a_recording(tmp_path):
+    save_macro(tmp_path, 'login')
+    save_macro(tmp_path, 'daily', '.json')
+    assert main(['compose', 'daily', 'login', '--dir', str(tmp_path)]) == 1
+    assert not (tmp_path / 'daily.mcomp').exists()
+
+
+def test_play_leaves_the_working_directory_alone(tmp_path, monkeypatch, capsys):
+    save_macro(tmp_path, 'login')
+    work = tmp_path / 'work'
+    work.mkdir()
+    monkeypatch.chdir(work)
+    assert main(['play', str(tmp_path / 'login.mrec'), '--simulate', '--no-timing']) == 0
+    assert '"actions": 1' in capsys.readouterr().out
+    # No macros folder was created, so nothing in one could have been recovered either
+    assert os.listdir(work) == []
+
+
+def test_dedupe_moves_timing_files_and_index_rows_to_the_composite(tmp_path):
+    save_macro(tmp_path, 'login')
+    save_macro(tmp_path, 'login_copy')
+    # Named like a sidecar of login_copy.mrec, but a macro of its own
+    save_events(str(tmp_path / 'login_copy.v2.mrec'), EventBuffer())
+    (tmp_path / 'login_copy.mrec.timing').write_text('{}')
+    index = MacroIndex(str(tmp_path))
+    index.refresh()
+    index.close()
+
+    assert main(['dedupe', '--dir', str(tmp_path), '--dry-run']) == 0
+    assert (tmp_path / 'login_copy.mrec').exists()
+
+    assert main(['dedupe', '--dir', str(tmp_path)]) == 0
+    assert read_composite(tmp_path / 'login_copy.mcomp') == [Segment('login')]
+    assert not (tmp_path / 'login_copy.mrec').exists()
+    assert (tmp_path / 'login_copy.mcomp.timing').read_text() == '{}'
+    assert (tmp_path / 'login_copy.v2.mrec').exists()
+    index = MacroIndex(str(tmp_path))
+    rows = {row['name']: row for row in index.query()}
+    index.close()
+    assert rows['login_copy']['path'] == str(tmp_path / 'login_copy.mcomp')
+    assert rows['login_copy']['format'] == 'mcomp' and rows['login_copy']['event_count'] == 1
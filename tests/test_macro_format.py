@@ -0,0 +1,105 @@
+import io
+
+import pytest
+
+from event_store import EventBuffer
+from macro_format import (COMPRESSIONS, MacroWriter, SeekIndex, _decode_signed, _decode_varints, _encode_signed,
+                          _encode_varints, _read_varint, iter_event_blocks, load_events, read_header,
+                          read_seek_index, save_events, seek_blocks)
+from play_range import PlayRange, load_range
+
+SIGNED = [0, 1, -1, 63, -64, 64, -65, 2**31 - 1, -2**31, 2**62, -2**62, 2**63 - 1, -2**63]
+UNSIGNED = [0, 1, 127, 128, 16383, 16384, 2**32, 2**63 - 1, 2**64 - 1]
+
+
+def sample_events():
+    return [
+        {'type': 'mouse', 'event': 'move', 'position': (-5, 1079), 'time': 0.0},
+        {'type': 'mouse', 'event': 'down', 'button': 'left', 'position': (10, 20), 'time': 0.25},
+        {'type': 'mouse', 'event': 'up', 'button': 'left', 'position': (10, 20), 'time': 0.3},
+        {'type': 'keyboard', 'event': 'press', 'key': 'ä', 'time': 1.5},
+        {'type': 'mouse', 'event': 'scroll', 'delta': -1.0, 'time': 2.0},
+        {'type': 'sync', 'event': 'window', 'condition': 'Notepad', 'timeout': 10.0, 'time': 2.0},
+        {'type': 'keyboard', 'event': 'press', 'key': 'ctrl', 'time': 3600.000000001},
+    ]
+
+
+def test_varints_round_trip():
+    out = bytearray()
+    _encode_varints(UNSIGNED, out)
+    assert _decode_varints(out, 0, len(UNSIGNED)) == (UNSIGNED, len(out))
+    f = io.BytesIO(bytes(out))
+    assert [_read_varint(f) for _ in UNSIGNED] == UNSIGNED
+    with pytest.raises(EOFError):
+        _read_varint(f)
+
+
+def test_zigzag_round_trips_negative_and_64_bit_values():
+    out = bytearray()
+    _encode_signed(SIGNED, out)
+    assert _decode_signed(out, 0, len(SIGNED)) == (SIGNED, len(out))
+    # Small magnitudes of either sign stay one byte long
+    small = bytearray()
+    _encode_signed([-64, 63], small)
+    assert len(small) == 2
+
+
+@pytest.mark.parametrize('compression', sorted(COMPRESSIONS))
+@pytest.mark.parametrize('extension', ['.mrec', '.json'])
+def test_events_round_trip(tmp_path, compression, extension):
+    path = str(tmp_path / ('macro' + extension))
+    save_events(path, EventBuffer(sample_events()), compression)
+    assert list(load_events(path)) == sample_events()
+
+
+def write_blocks(path, times, block_size):
+    with MacroWriter(path, block_size=block_size) as writer:
+        writer.write_events(EventBuffer({'type': 'mouse', 'event': 'move', 'position': (i, i), 'time': t}
+                                        for i, t in enumerate(times)))
+
+
+def test_blocks_are_written_and_read_in_order(tmp_path):
+    path = str(tmp_path / 'macro.mrec')
+    write_blocks(path, [i * 0.1 for i in range(25)], 10)
+    assert [len(block) for block in iter_event_blocks(path)] == [10, 10, 5]
+    with open(path, 'rb') as f:
+        assert read_header(f)['event_count'] == 25
+
+
+def test_seek_index_at_block_boundaries(tmp_path):
+    path = str(tmp_path / 'macro.mrec')
+    write_blocks(path, [i * 0.1 for i in range(25)], 10)
+    with open(path, 'rb') as f:
+        index = read_seek_index(f, read_header(f))
+        try:
+            assert list(index.events) == [0, 10, 20]
+            assert list(index.times) == [0, 1_000_000_000, 2_000_000_000]
+            assert index.block_for_time(-1) == 0
+            assert index.block_for_time(0) == 0
+            # A time equal to a block's first event may also be the time of the events before it
+            assert index.block_for_time(1_000_000_000) == 0
+            assert index.block_for_time(1_000_000_001) == 1
+            assert index.block_for_time(10**12) == 2
+            assert index.block_for_event(9) == 0
+            assert index.block_for_event(10) == 1
+            assert index.block_for_event(10**6) == 2
+            assert index.cursor(1) == (9, 9)
+        finally:
+            index.release()
+
+
+def test_events_at_one_time_spanning_blocks(tmp_path):
+    path = str(tmp_path / 'macro.mrec')
+    # Events 8 to 12 share a time, across the boundary between the first two blocks
+    write_blocks(path, [0.1 * i for i in range(8)] + [1.0] * 5 + [2.0 + i for i in range(7)], 10)
+    first, _, _ = next(seek_blocks(path, time_ns=1_000_000_000))
+    assert first == 0
+    events = load_range(path, PlayRange(1.0, 1.5, restore_cursor=False))
+    assert [event['position'] for event in events] == [(i, i) for i in range(8, 13)]
+    # The cursor is restored to where the event before the range left it
+    assert load_range(path, PlayRange(1.0, 1.5))[0]['position'] == (7, 7)
+
+
+def test_empty_index():
+    index = SeekIndex()
+    assert len(index) == 0 and index.block_for_time(5) == 0
@@ -0,0 +1,69 @@
+import threading
+import time
+
+from input_backend import ButtonEvent, KeyboardEvent, MoveEvent, SimulatedInputBackend
+from macro_format import BLOCK_SIZE
+from macro_recorder import MacroRecorder
+from macro_stream import MacroStream
+from playback_jobs import FINISHED, JobScheduler
+from playback_plan import PlaybackPlan
+
+
+def wait_until(predicate, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_stop_key_after_several_journal_blocks(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    errors = []
+    monkeypatch.setattr(threading, 'excepthook', errors.append)
+    backend = SimulatedInputBackend()
+    recorder = MacroRecorder(backend)
+    recorder.start_recording()
+
+    moves = BLOCK_SIZE * 2 + 100
+    for i in range(moves):
+        backend.deliver(MoveEvent(i % 1000, (i * 7) % 1000, 0.0))
+    # Keyboard and mouse events are queued in separate rings, so let the moves drain first
+    assert wait_until(lambda: recorder.journal.event_count(recorder.buffer) == moves)
+    backend.deliver(KeyboardEvent('down', 0, 'esc', 0.0))
+
+    assert wait_until(lambda: not recorder.recording)
+    assert wait_until(lambda: not recorder.event_consumer.thread.is_alive())
+    assert isinstance(recorder.events, MacroStream)
+    assert len(recorder.events) == moves
+    assert recorder.journal.error is None
+    assert not errors
+
+
+def test_recorded_button_presses_play_back(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    backend = SimulatedInputBackend()
+    recorder = MacroRecorder(backend)
+    recorder.start_recording()
+    for event in (MoveEvent(100, 200, 0.0), ButtonEvent('down', 'left', 0.0),
+                  MoveEvent(300, 400, 0.0), ButtonEvent('up', 'left', 0.0)):
+        backend.deliver(event)
+    assert wait_until(lambda: recorder.journal.event_count(recorder.buffer) == 4)
+    backend.deliver(KeyboardEvent('down', ord('a'), 'a', 0.0))
+    assert wait_until(lambda: recorder.journal.event_count(recorder.buffer) == 5)
+    backend.deliver(KeyboardEvent('down', 0, 'esc', 0.0))
+    assert wait_until(lambda: not recorder.recording)
+
+    plan = PlaybackPlan.compile(recorder.events)
+    assert len(plan) == 5  # Every recorded event is played, the button presses included
+    player = SimulatedInputBackend()
+    scheduler = JobScheduler(player)
+    job = scheduler.play(plan)
+    assert job.wait(5)
+    scheduler.shutdown()
+
+    assert job.state == FINISHED
+    actions = [(action, args) for _, action, args in player.actions if action != 'move_to']
+    assert actions == [('press_button_at', (100, 200, 'left')), ('release_button_at', (300, 400, 'left')),
+                       ('tap_key', ('a',))]
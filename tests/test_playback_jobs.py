@@ -0,0 +1,113 @@
+import threading
+
+from input_backend import SimulatedInputBackend
+from playback_jobs import FAILED, FINISHED, JobScheduler
+from playback_plan import OP_KEY_TAP, OP_MOVE, OP_SYNC, PlaybackPlan
+from sync_points import FakeConditionProvider, SyncTimeout, WindowCondition
+
+
+def move_plan(count, x):
+    plan = PlaybackPlan()
+    for i in range(count):
+        plan.offsets.append(i * 0.0001)
+        plan.ops.append(OP_MOVE)
+        plan.args.append((x, i))
+    return plan
+
+
+def test_moves_are_only_coalesced_within_a_job():
+    backend = SimulatedInputBackend()
+    scheduler = JobScheduler(backend)
+    # Both jobs are due within the same tick, so their steps share one batch
+    first = scheduler.play(move_plan(3, 1), start_delay=0.05)
+    second = scheduler.play(move_plan(3, 2), start_delay=0.05)
+    assert first.wait(5) and second.wait(5)
+    scheduler.shutdown()
+
+    assert first.state == second.state == FINISHED
+    injected = [args for _, action, args in backend.actions if action == 'move_to']
+    # Each job's last move reaches the backend, and its count matches what was injected for it
+    assert (1, 2) in injected and (2, 2) in injected
+    assert sum(1 for x, _ in injected if x == 1) == first.injected
+    assert sum(1 for x, _ in injected if x == 2) == second.injected
+
+
+def sync_plan(condition, timeout=2.0):
+    plan = PlaybackPlan()
+    for offset, op, args in ((0.0, OP_KEY_TAP, ('a',)), (5.0, OP_SYNC, (condition, timeout)),
+                             (5.05, OP_KEY_TAP, ('b',))):
+        plan.offsets.append(offset)
+        plan.ops.append(op)
+        plan.args.append(args)
+    return plan
+
+
+def test_sync_point_replaces_the_recorded_gap():
+    backend = SimulatedInputBackend()
+    conditions = FakeConditionProvider()
+    scheduler = JobScheduler(backend, conditions=conditions)
+    threading.Timer(0.1, conditions.open_window, ('Untitled - Notepad',)).start()
+    job = scheduler.play(sync_plan(WindowCondition('Notepad')))
+    assert job.wait(5)
+    scheduler.shutdown()
+
+    assert job.state == FINISHED and job.syncs == 1
+    (first, _, _), (second, _, _) = backend.actions
+    # The 5 s recorded before the sync point became the 0.1 s the window took to open
+    assert 0.1 <= second - first < 1.0
+
+
+def test_sync_point_timeout_fails_the_job():
+    backend = SimulatedInputBackend()
+    scheduler = JobScheduler(backend, conditions=FakeConditionProvider())
+    job = scheduler.play(sync_plan(WindowCondition('Notepad'), timeout=0.1))
+    assert job.wait(5)
+    scheduler.shutdown()
+
+    assert job.state == FAILED and isinstance(job.error, SyncTimeout)
+    assert [action for _, action, _ in backend.actions] == ['tap_key']
+
+
+def test_looping_only_skipped_sync_points_ends():
+    plan = PlaybackPlan()
+    plan.offsets.append(0.0)
+    plan.ops.append(OP_SYNC)
+    plan.args.append((WindowCondition('Notepad'), 1.0))
+    scheduler = JobScheduler(SimulatedInputBackend())
+    job = scheduler.play(plan, loop_playback=True)
+    assert job.wait(5)
+    scheduler.shutdown()
+    assert job.state == FINISHED
+
+
+class FailingBackend(SimulatedInputBackend):
+    """Raises for one key, like `keyboard` does for a name it can't map."""
+
+    def tap_key(self, key):
+        if key == 'bad':
+            raise ValueError(f"Key {key!r} is not mapped to any known key.")
+        super().tap_key(key)
+
+
+def key_plan(*keys):
+    plan = PlaybackPlan()
+    for i, key in enumerate(keys):
+        plan.offsets.append(i * 0.05)
+        plan.ops.append(OP_KEY_TAP)
+        plan.args.append((key,))
+    return plan
+
+
+def test_failed_injection_fails_the_job_and_keeps_the_thread():
+    backend = FailingBackend()
+    scheduler = JobScheduler(backend)
+    failed = scheduler.play(key_plan('a', 'bad', 'c'))
+    assert failed.wait(5)
+    assert failed.state == FAILED and isinstance(failed.error, ValueError)
+
+    # The injection thread survived and plays later jobs
+    later = scheduler.play(key_plan('d'))
+    assert later.wait(5)
+    scheduler.shutdown()
+    assert later.state == FINISHED
+    assert [args for _, _, args in backend.actions] == [('a',), ('d',)]
@@ -0,0 +1,61 @@
+import os
+import time
+
+from event_store import EventBuffer
+from macro_format import load_events
+from recording_journal import JOURNAL_EXTENSION, RecordingJournal, recover_journals
+
+
+def record(journal, count):
+    """Append `count` moves the way the recording thread does, then wait until full blocks are on disk."""
+    events = EventBuffer()
+    for i in range(count):
+        events.append({'type': 'mouse', 'event': 'move', 'position': (i, i), 'time': i * 0.001})
+        journal.collect(events)
+    deadline = time.monotonic() + 5
+    while journal.writer.event_count < journal.collected and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return events
+
+
+def journals(macro_dir):
+    return sorted(file for file in os.listdir(macro_dir) if file.endswith(JOURNAL_EXTENSION))
+
+
+def test_stale_journal_is_recovered(tmp_path):
+    macro_dir = str(tmp_path)
+    journal = RecordingJournal(macro_dir, block_size=10)
+    record(journal, 25)
+    # The process dies: its lock goes away, the lock file and journal stay behind
+    journal.lock.close()
+
+    recovered = recover_journals(macro_dir)
+    assert len(recovered) == 1 and os.path.basename(recovered[0]).startswith('recovered_')
+    assert len(load_events(recovered[0])) == 20  # The two full blocks
+    assert os.listdir(macro_dir) == [os.path.basename(recovered[0])]
+
+
+def test_live_journal_is_left_alone(tmp_path):
+    macro_dir = str(tmp_path)
+    small = RecordingJournal(macro_dir, block_size=10)
+    events = record(small, 5)  # Less than a block: recovery would have removed it
+    large = RecordingJournal(macro_dir, block_size=10)
+    record(large, 25)  # Full blocks: recovery would have renamed it
+    assert len(journals(macro_dir)) == 2
+
+    assert recover_journals(macro_dir) == []
+    assert journals(macro_dir) == sorted(os.path.basename(j.path) for j in (small, large))
+
+    small.close(events)
+    assert len(load_events(small.path)) == 5
+    small.discard()
+    large.discard()
+    assert os.listdir(macro_dir) == []
+
+
+def test_journals_started_together_get_their_own_files(tmp_path):
+    first = RecordingJournal(str(tmp_path))
+    second = RecordingJournal(str(tmp_path))
+    assert first.path != second.path
+    first.discard()
+    second.discard()
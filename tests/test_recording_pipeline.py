@@ -0,0 +1,89 @@
+from event_store import EventBuffer
+from input_backend import ButtonEvent, KeyboardEvent, MoveEvent, SimulatedInputBackend, WheelEvent
+from recording_pipeline import KeyAllowlist, RecordingConfig, RecordingPipeline, RegionOfInterest
+
+SESSION = [
+    MoveEvent(10, 10, 0.0),
+    KeyboardEvent('down', ord('a'), 'a', 0.0),
+    KeyboardEvent('up', ord('a'), 'a', 0.0),
+    MoveEvent(12, 10, 0.0),
+    ButtonEvent('down', 'left', 0.0),
+    ButtonEvent('up', 'left', 0.0),
+    MoveEvent(200, 200, 0.0),
+    WheelEvent(-1.0, 0.0),
+    KeyboardEvent('down', ord('b'), 'b', 0.0),
+]
+
+
+def record(config, events=SESSION, on_stop=None):
+    buffer = EventBuffer()
+    pipeline = RecordingPipeline(config, buffer, SimulatedInputBackend(), on_stop)
+    for time_ns, event in enumerate(events):
+        pipeline.process(event, time_ns)
+    return [(event['event'], event.get('key') or event.get('button') or event.get('position') or event.get('delta'))
+            for event in buffer]
+
+
+def test_everything_is_recorded_by_default():
+    assert record(RecordingConfig()) == [
+        ('move', (10, 10)), ('press', 'a'), ('move', (12, 10)), ('down', 'left'), ('up', 'left'),
+        ('move', (200, 200)), ('scroll', -1.0), ('press', 'b')]
+
+
+def test_device_and_kind_filters():
+    assert record(RecordingConfig(record_keyboard=False)) == [
+        ('move', (10, 10)), ('move', (12, 10)), ('down', 'left'), ('up', 'left'), ('move', (200, 200)),
+        ('scroll', -1.0)]
+    assert record(RecordingConfig(record_mouse=False)) == [('press', 'a'), ('press', 'b')]
+    assert record(RecordingConfig(record_mouse_clicks=False, record_mouse_scroll=False)) == [
+        ('move', (10, 10)), ('press', 'a'), ('move', (12, 10)), ('move', (200, 200)), ('press', 'b')]
+
+
+def test_buttons_use_the_cursor_when_moves_are_not_recorded():
+    buffer = EventBuffer()
+    pipeline = RecordingPipeline(RecordingConfig(record_mouse_movement=False), buffer, SimulatedInputBackend())
+    for time_ns, event in enumerate(SESSION):
+        pipeline.process(event, time_ns)
+    assert [(event['event'], event.get('position')) for event in buffer if event['type'] == 'mouse'] == [
+        ('down', (12, 10)), ('up', (12, 10)), ('scroll', None)]
+
+
+def test_minimum_mouse_movement():
+    # The first move only sets the reference point; (12, 10) is too close to it
+    assert record(RecordingConfig(record_keyboard=False, record_mouse_clicks=False, record_mouse_scroll=False,
+                                  minimum_mouse_movement=5)) == [('move', (200, 200))]
+
+
+def test_filter_stages():
+    stages = (RegionOfInterest(0, 0, 100, 100), KeyAllowlist(['b']))
+    assert record(RecordingConfig(stages=stages)) == [
+        ('move', (10, 10)), ('move', (12, 10)), ('down', 'left'), ('up', 'left'), ('press', 'b')]
+
+
+def test_stop_key_is_not_recorded():
+    stops = []
+    events = SESSION[:2] + [KeyboardEvent('down', 0, 'esc', 0.0)] + SESSION[2:]
+    recorded = record(RecordingConfig(), events, lambda: stops.append(True))
+    assert stops == [True]
+    assert ('press', 'esc') not in recorded
+
+
+def test_stop_key_by_scan_code():
+    stops = []
+    events = [KeyboardEvent('down', ord('q'), 'Q', 0.0)]
+    assert record(RecordingConfig(stop_key='q'), events, lambda: stops.append(True)) == []
+    assert stops == [True]
+
+
+def test_stop_key_works_without_recording_the_keyboard():
+    stops = []
+    events = SESSION[:2] + [KeyboardEvent('up', 0, 'esc', 0.0), KeyboardEvent('down', 0, 'esc', 0.0)]
+    recorded = record(RecordingConfig(record_keyboard=False), events, lambda: stops.append(True))
+    assert stops == [True]
+    assert recorded == [('move', (10, 10))]
+
+
+def test_stop_key_without_a_stop_callback_is_recorded():
+    events = [KeyboardEvent('down', 0, 'esc', 0.0)]
+    assert record(RecordingConfig(), events) == [('press', 'esc')]
+    assert record(RecordingConfig(record_keyboard=False), events) == []
@@ -0,0 +1,107 @@
+import time
+
+import pytest
+
+from input_backend import KeyboardEvent, MoveEvent, SimulatedInputBackend
+from macro_format import load_events, save_events
+from recording_pipeline import RecordingConfig
+from replay_buffer import ReplayBuffer, ReplayCapture
+
+
+def press(buffer, key, time_s):
+    buffer.append({'type': 'keyboard', 'event': 'press', 'key': key, 'time': time_s})
+
+
+def keys(events):
+    return [event['key'] for event in events]
+
+
+def test_capacity_must_be_positive():
+    with pytest.raises(ValueError):
+        ReplayBuffer(0)
+
+
+def test_before_the_first_wrap():
+    buffer = ReplayBuffer(4)
+    for i, key in enumerate('ab'):
+        press(buffer, key, 1.0 + i)
+    assert len(buffer) == 2 and keys(buffer) == ['a', 'b']
+    assert buffer.duration() == 1.0
+    snapshot = buffer.snapshot()
+    assert keys(snapshot) == ['a', 'b'] and [event['time'] for event in snapshot] == [0.0, 1.0]
+
+
+def test_wraparound_keeps_the_newest_events_in_order():
+    buffer = ReplayBuffer(4)
+    for i, key in enumerate('abcdefg'):
+        press(buffer, key, float(i))
+    assert len(buffer) == 4 and buffer.count == 7
+    assert keys(buffer) == ['d', 'e', 'f', 'g']
+    assert buffer[0]['time'] == 3.0 and buffer[-1]['time'] == 6.0
+    assert buffer.duration() == 3.0
+    snapshot = buffer.snapshot()
+    assert keys(snapshot) == ['d', 'e', 'f', 'g']
+    assert [event['time'] for event in snapshot] == [0.0, 1.0, 2.0, 3.0]
+
+
+def test_wraparound_at_exact_multiples_of_the_capacity():
+    buffer = ReplayBuffer(3)
+    for i, key in enumerate('abcdef'):
+        press(buffer, key, float(i))
+    assert keys(buffer.snapshot()) == ['d', 'e', 'f']
+
+
+def test_names_interned_before_the_wrap_still_resolve_after_it():
+    buffer = ReplayBuffer(3)
+    for i, key in enumerate(['shift', 'a', 'shift', 'b']):
+        press(buffer, key, float(i))
+    # 'shift' was interned by the overwritten first event; 'c' is new after the wrap
+    press(buffer, 'c', 4.0)
+    press(buffer, 'shift', 5.0)
+    assert keys(buffer) == ['b', 'c', 'shift']
+    snapshot = buffer.snapshot()
+    assert keys(snapshot) == ['b', 'c', 'shift']
+    # The snapshot has its own tables: names interned later don't change it
+    press(buffer, 'z', 6.0)
+    assert 'z' not in snapshot.name_table.strings
+    assert keys(snapshot) == ['b', 'c', 'shift']
+
+
+def test_snapshot_round_trips_through_a_file(tmp_path):
+    buffer = ReplayBuffer(3)
+    for i, key in enumerate('abcde'):
+        press(buffer, key, float(i))
+    buffer.append({'type': 'mouse', 'event': 'move', 'position': (5, 6), 'time': 5.0})
+    path = str(tmp_path / 'replay.mrec')
+    save_events(path, buffer.snapshot())
+    assert [event.get('key') or event['position'] for event in load_events(path)] == ['d', 'e', (5, 6)]
+
+
+def test_max_age_across_the_wrap():
+    buffer = ReplayBuffer(4)
+    for i, key in enumerate('abcdef'):
+        press(buffer, key, float(i))
+    assert keys(buffer.snapshot(max_age=1.5)) == ['e', 'f']
+    assert keys(buffer.snapshot(max_age=100)) == ['c', 'd', 'e', 'f']
+
+
+def test_replay_buffer_can_not_be_detached():
+    with pytest.raises(TypeError):
+        ReplayBuffer(2).detach()
+
+
+def test_capture_keeps_the_last_events_and_ignores_the_stop_key():
+    backend = SimulatedInputBackend()
+    capture = ReplayCapture(backend, RecordingConfig(), capacity=5, interval=0.001)
+    capture.start()
+    for i in range(10):
+        backend.deliver(MoveEvent(i, i, 0.0))
+    backend.deliver(KeyboardEvent('down', 0, 'esc', 0.0))
+    deadline = time.monotonic() + 5
+    while capture.buffer.count < 11 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    capture.stop()
+    assert backend.keyboard_hooks == [] and backend.mouse_hooks == []
+    snapshot = capture.snapshot()
+    assert len(snapshot) == 5
+    assert snapshot[-1] == {'type': 'keyboard', 'event': 'press', 'key': 'esc', 'time': snapshot[-1]['time']}
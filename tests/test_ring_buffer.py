@@ -0,0 +1,101 @@
+import threading
+
+import pytest
+
+from ring_buffer import RingBuffer, RingConsumer
+
+
+def test_capacity_must_be_a_power_of_two():
+    with pytest.raises(ValueError):
+        RingBuffer(6)
+
+
+def test_full_ring_drops_and_counts_overflows():
+    ring = RingBuffer(4)
+    assert all(ring.push((i,)) for i in range(4))
+    assert not ring.push((4,))
+    assert not ring.push((5,))
+    assert ring.stats() == {'depth': 4, 'high_water': 4, 'overflows': 2, 'pushed': 4}
+    # The items kept are the oldest ones
+    assert ring.pop_batch() == [(0,), (1,), (2,), (3,)]
+    assert ring.push((6,))
+    assert ring.stats()['overflows'] == 2
+
+
+def test_high_water_mark_survives_draining_and_wraparound():
+    ring = RingBuffer(8)
+    for i in range(5):
+        ring.push((i,))
+    assert ring.pop_batch(3) == [(0,), (1,), (2,)]
+    # Head and tail wrap around the slots several times at a low depth
+    for i in range(5, 40):
+        ring.push((i,))
+        assert ring.pop_batch(1) == [(i - 2,)]
+    assert ring.depth() == 2
+    assert ring.stats()['high_water'] == 5
+    assert ring.pop_batch() == [(38,), (39,)]
+    assert ring.pop_batch() == []
+
+
+def test_consumer_merges_rings_in_timestamp_order():
+    keyboard = RingBuffer(16)
+    mouse = RingBuffer(16)
+    for t in (1, 4, 6):
+        keyboard.push((t, 'key'))
+    for t in (2, 3, 5, 7):
+        mouse.push((t, 'move'))
+    handled = []
+    consumer = RingConsumer([keyboard, mouse], handled.append)
+    assert consumer.drain() == 7
+    assert [item[0] for item in handled] == [1, 2, 3, 4, 5, 6, 7]
+
+
+def test_stop_drains_everything_still_queued_in_order():
+    keyboard = RingBuffer(16)
+    mouse = RingBuffer(16)
+    handled = []
+    consumer = RingConsumer([keyboard, mouse], handled.append, interval=60, batch_size=4)
+    consumer.start()
+    # Queued while the consumer sleeps; more than one batch per ring
+    for t in range(0, 20, 2):
+        mouse.push((t, 'move'))
+    for t in range(1, 20, 2):
+        keyboard.push((t, 'key'))
+    consumer.stop()
+    assert not consumer.thread.is_alive()
+    assert sorted(item[0] for item in handled) == list(range(20))
+    # Each merged batch is in order, and batches follow each other
+    assert [item[0] for item in handled][:8] == sorted(item[0] for item in handled[:8])
+    assert consumer.stats()['depth'] == 0
+
+
+def test_stop_from_the_handler_leaves_the_rest_to_the_current_drain():
+    ring = RingBuffer(16)
+    handled = []
+    done = threading.Event()
+
+    def handler(item):
+        handled.append(item)
+        if item[1] == 'stop':
+            consumer.stop()
+            done.set()
+
+    consumer = RingConsumer([ring], handler)
+    for item in ((1, 'a'), (2, 'stop'), (3, 'b')):
+        ring.push(item)
+    consumer.start()
+    assert done.wait(5)
+    consumer.thread.join(5)
+    assert not consumer.thread.is_alive()
+    assert handled == [(1, 'a'), (2, 'stop'), (3, 'b')]
+
+
+def test_consumer_stats_sum_the_rings():
+    first = RingBuffer(2)
+    second = RingBuffer(4)
+    for i in range(3):
+        first.push((i,))
+    for i in range(3):
+        second.push((i,))
+    stats = RingConsumer([first, second], None).stats()
+    assert stats == {'depth': 5, 'high_water': 3, 'overflows': 1, 'pushed': 5}
@@ -0,0 +1,85 @@
+import pytest
+
+from playback_plan import OP_CLICK, OP_KEY_TAP, OP_MOVE, PlaybackPlan
+from playback_scheduler import repeat_timeline
+from timeline_transform import TimelineTransform, apply_transform
+
+
+def plan_of(steps, playback_speed=1.0):
+    """A plan from (recorded time, opcode) pairs, compiled for `playback_speed`."""
+    plan = PlaybackPlan(playback_speed)
+    for time, op in steps:
+        plan.offsets.append(time / playback_speed)
+        plan.ops.append(op)
+        plan.args.append(('a',) if op == OP_KEY_TAP else (0, 0))
+    return plan
+
+
+STEPS = [(2.0, OP_MOVE), (3.0, OP_KEY_TAP), (13.0, OP_MOVE), (14.0, OP_KEY_TAP), (15.0, OP_MOVE), (16.0, OP_MOVE)]
+
+
+def test_max_idle_caps_every_gap():
+    plan, report = apply_transform(plan_of(STEPS), TimelineTransform(max_idle=1.5))
+    assert list(plan.offsets) == pytest.approx([1.5, 2.5, 4.0, 5.0, 6.0, 7.0])
+    assert report['duration_before'] == 16.0 and report['saved'] == pytest.approx(9.0)
+
+
+def test_trim_drops_leading_time_and_trailing_moves():
+    plan, report = apply_transform(plan_of(STEPS), TimelineTransform(trim=True))
+    assert list(plan.offsets) == [0.0, 1.0, 11.0, 12.0]
+    assert list(plan.ops) == [OP_MOVE, OP_KEY_TAP, OP_MOVE, OP_KEY_TAP]
+    assert (report['steps_before'], report['steps_after']) == (6, 4)
+
+
+def test_trim_keeps_a_macro_of_only_moves():
+    plan, _ = apply_transform(plan_of([(1.0, OP_MOVE), (2.0, OP_MOVE)]), TimelineTransform(trim=True))
+    assert list(plan.offsets) == [0.0, 1.0]
+
+
+def test_retime_speeds_up_a_recorded_segment():
+    # Gaps starting between 3 s and 13 s of the recording play 10x as fast
+    plan, _ = apply_transform(plan_of(STEPS), TimelineTransform(retime=((3.0, 13.0, 10.0),)))
+    assert list(plan.offsets) == pytest.approx([2.0, 3.0, 4.0, 5.0, 6.0, 7.0])
+
+
+def test_speed_curve_is_interpolated():
+    plan = plan_of([(0.0, OP_CLICK), (1.0, OP_CLICK), (2.0, OP_CLICK), (3.0, OP_CLICK)])
+    result, _ = apply_transform(plan, TimelineTransform(speed_curve=((0.0, 1.0), (2.0, 3.0))))
+    # Each gap plays at the speed at its start: 1x, 2x, then 3x held past the last point
+    assert list(result.offsets) == pytest.approx([0.0, 1.0, 1.5, 1.5 + 1 / 3])
+
+
+def test_transforms_use_recorded_times_at_any_playback_speed():
+    transform = TimelineTransform(max_idle=1.5, retime=((3.0, 13.0, 10.0),))
+    plan, _ = apply_transform(plan_of(STEPS, 2.0), transform, 2.0)
+    # The retimed segment is still found at 3..13 s of the recording; max_idle caps the scaled gaps
+    assert list(plan.offsets) == pytest.approx([1.0, 1.5, 2.0, 2.5, 3.0, 3.5])
+
+
+def test_cached_plan_is_not_modified():
+    plan = plan_of(STEPS)
+    apply_transform(plan, TimelineTransform(trim=True, max_idle=1.0))
+    assert list(plan.offsets) == [time for time, _ in STEPS] and len(plan) == 6
+
+
+def test_transformed_offsets_across_repeats():
+    plan, _ = apply_transform(plan_of(STEPS), TimelineTransform(trim=True))
+    run = [offset for offset, _ in repeat_timeline(plan, repeat_count=2, repeat_delay=0.5)]
+    # The second pass starts repeat_delay after the last kept step, with no leading dead time
+    assert run == [0.0, 1.0, 11.0, 12.0, 12.5, 13.5, 23.5, 24.5]
+
+
+def test_transformed_offsets_across_loops():
+    plan, _ = apply_transform(plan_of(STEPS), TimelineTransform(max_idle=1.0))
+    run = repeat_timeline(plan, loop_playback=True)
+    assert [next(run)[0] for _ in range(12)] == pytest.approx(range(1, 13))
+
+
+def test_invalid_transforms():
+    with pytest.raises(ValueError):
+        TimelineTransform(max_idle=-1)
+    with pytest.raises(ValueError):
+        TimelineTransform(retime=((5.0, 5.0, 2.0),))
+    with pytest.raises(ValueError):
+        TimelineTransform(speed_curve=((0.0, 0.0),))
+    assert not TimelineTransform()
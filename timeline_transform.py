@@ -0,0 +1,118 @@
+from array import array
+from collections import namedtuple
+
+import numpy as np
+
+from playback_plan import OP_MOVE, PlaybackPlan
+
+
+class TimelineTransform(namedtuple('TimelineTransform', ['max_idle', 'trim', 'retime', 'speed_curve'])):
+    """Edits to a macro's timing, applied to its compiled steps once before playback.
+
+    `max_idle` caps every gap between steps (and before the first one) at
+    that many seconds; 0 turns it off. `trim` drops the dead time before
+    the first step and the cursor moves after the last key press, click or
+    scroll. `retime` is a tuple of (start, end, speed): steps recorded
+    between start and end seconds play `speed` times as fast. `speed_curve`
+    is a tuple of (time, speed) points, interpolated linearly, that scales
+    the speed of the whole macro. Times are seconds of the recording, and
+    all speeds multiply the global playback speed.
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, max_idle=0.0, trim=False, retime=(), speed_curve=()):
+        retime = tuple(tuple(segment) for segment in retime)
+        speed_curve = tuple(sorted(tuple(point) for point in speed_curve))
+        if max_idle < 0:
+            raise ValueError("max_idle must not be negative")
+        if any(start >= end for start, end, _ in retime):
+            raise ValueError("retime segments must end after they start")
+        if any(speed <= 0 for *_, speed in retime + speed_curve):
+            raise ValueError("speeds must be positive")
+        return super().__new__(cls, max_idle, trim, retime, speed_curve)
+
+    def __bool__(self):
+        return bool(self.max_idle or self.trim or self.retime or self.speed_curve)
+
+
+def as_plan(steps):
+    """A PlaybackPlan with the steps of a plan, stream or composite; plans are returned as they are."""
+    if isinstance(steps, PlaybackPlan):
+        return steps
+    plan = PlaybackPlan(getattr(steps, 'playback_speed', 1.0))
+    for offset, op, args in steps:
+        plan.offsets.append(offset)
+        plan.ops.append(op)
+        plan.args.append(args)
+    return plan
+
+
+def local_speed(times, transform):
+    """Speed factor of `transform` at each recorded time in `times`."""
+    speed = np.ones(len(times))
+    for start, end, factor in transform.retime:
+        speed[(times >= start) & (times < end)] *= factor
+    if transform.speed_curve:
+        points = np.array(transform.speed_curve)
+        speed *= np.interp(times, points[:, 0], points[:, 1])
+    return speed
+
+
+def transform_offsets(offsets, ops, transform, playback_speed=1.0):
+    """New offsets for compiled steps, and how many of the steps are kept.
+
+    Works on whole columns: each gap is divided by the local speed at its
+    start and capped at max_idle, then the gaps are summed up again.
+    """
+    offsets = np.frombuffer(offsets, dtype=np.float64) if len(offsets) else np.zeros(0)
+    count = len(offsets)
+    if transform.trim and count:
+        active = np.flatnonzero(np.frombuffer(ops, dtype=np.uint8) != OP_MOVE)
+        if len(active):
+            count = active[-1] + 1
+    starts = np.concatenate(([0.0], offsets[:count - 1])) if count else offsets
+    gaps = offsets[:count] - starts
+
+    gaps /= local_speed(starts * playback_speed, transform)
+    if transform.max_idle:
+        np.minimum(gaps, transform.max_idle, out=gaps)
+    if transform.trim and count:
+        gaps[0] = 0.0
+    return np.cumsum(gaps), count
+
+
+def apply_transform(steps, transform, playback_speed=1.0):
+    """Apply a TimelineTransform to compiled steps.
+
+    Returns a new PlaybackPlan and a report of the duration of one pass
+    before and after. Cached plans are never modified; streamed and
+    composite macros are compiled into memory first.
+    """
+    plan = as_plan(steps)
+    offsets, count = transform_offsets(plan.offsets, plan.ops, transform, playback_speed)
+    result = PlaybackPlan(plan.playback_speed)
+    result.offsets = array('d', offsets.tobytes())
+    result.ops = plan.ops[:count]
+    result.args = plan.args[:count]
+
+    before = plan.duration()
+    after = result.duration()
+    report = {
+        'steps_before': len(plan),
+        'steps_after': len(result),
+        'duration_before': before,
+        'duration_after': after,
+        'saved': before - after,
+    }
+    return result, report
+
+
+def format_transform_report(report, repeat_count=1, loop_playback=False):
+    """Summary of a transform report, with the wall time saved by the whole run (or per loop)."""
+    text = f"Timeline {report['duration_before']:.1f} s -> {report['duration_after']:.1f} s per pass"
+    if report['steps_after'] < report['steps_before']:
+        text += f", {report['steps_before'] - report['steps_after']} steps trimmed"
+    if loop_playback:
+        return text + f", saves {report['saved']:.1f} s per loop"
+    return text + f", saves {report['saved'] * repeat_count:.1f} s"